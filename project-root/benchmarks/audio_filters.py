@@ -0,0 +1,52 @@
+"""Measures how many 20 ms PCM frames per second one core can filter.
+
+Run from the project root:
+
+    python -m benchmarks.audio_filters --frames 5000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from music_bot.utils.filters import CHANNELS, FRAME_SAMPLES, AudioFilters, FilterEngine
+
+
+def presets():
+    gain = AudioFilters()
+    gain.set_gain(6)
+
+    bass = AudioFilters()
+    bass.set_bass(10)
+
+    full = AudioFilters()
+    full.set_bass(8)
+    for band, gain_db in enumerate((3, -2, 1, 4, -3)):
+        full.set_band(band, gain_db)
+    full.set_normalize(True)
+    return {'gain': gain, 'bass boost': bass, 'bass boost + 5-band EQ + normalize': full}
+
+
+def measure(filters, frames):
+    engine = FilterEngine(filters)
+    rng = np.random.default_rng(0)
+    frame = (rng.standard_normal((FRAME_SAMPLES, CHANNELS)) * 3000).astype(np.int16).tobytes()
+    started_at = time.perf_counter()
+    for _ in range(frames):
+        engine.process(frame)
+    return frames / (time.perf_counter() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=5000, help='Frames filtered per preset.')
+    args = parser.parse_args()
+
+    for name, filters in presets().items():
+        rate = measure(filters, args.frames)
+        # One stream needs 50 frames per second
+        print(f'{name:36} {rate:,.0f} frames/s ({rate / 50:.0f} streams per core)')
+
+
+if __name__ == '__main__':
+    main()
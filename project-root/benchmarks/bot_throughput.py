@@ -0,0 +1,690 @@
+"""Benchmarks the music cog offline with stub providers and a fake voice client.
+
+YouTube extraction and the Spotify, SoundCloud and Genius clients are replaced
+by stubs that answer from a fixed catalog after a configurable delay, Discord
+by fake guilds, text channels and voice clients, and FFmpeg by a synthetic
+stream. The real MusicCog commands, players, caches, playback store and audio
+pipeline run without network access or a bot token. Each database URL is
+benchmarked in turn: a temporary SQLite file and the in-memory backend by
+default, and MongoDB when its URL is given (with DATABASE_NAME set to a
+scratch database). Results are printed and can be saved as JSON to compare
+runs. Run from the project root:
+
+    python -m benchmarks.bot_throughput --guilds 50 --commands 2000 --output results.json
+    python -m benchmarks.bot_throughput --database sqlite:///bench.db --database mongodb://localhost:27017/
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict
+from types import SimpleNamespace
+
+import discord
+import numpy as np
+from discord.ext import commands
+
+from music_bot.cogs.music import MusicCog
+from music_bot.config import QUEUE_PAGE_SIZE
+from music_bot.utils import loudness, resolver
+from music_bot.utils.async_database import AsyncDatabase
+from music_bot.utils.audio import FRAME_SECONDS, TimedSource, create_audio_source
+from music_bot.utils.cache import YOUTUBE_ID, TrackCache
+from music_bot.utils.database import open_database
+from music_bot.utils.filters import CHANNELS, FRAME_SAMPLES, AudioFilters
+from music_bot.utils.track_queue import QueueEntry, TrackQueue
+
+# Relative frequency of each command in the simulated traffic
+COMMAND_MIX = {
+    'play': 40, 'queue': 12, 'skip': 8, 'volume': 6, 'move': 6, 'remove': 5, 'shuffle': 4, 'lyrics': 4,
+    'loop': 3, 'pause': 3, 'resume': 3, 'bassboost': 3, 'stop': 3,
+}
+# How /play is asked for: a YouTube URL, a plain search, or a Spotify or SoundCloud track URL
+QUERY_MIX = {'youtube': 40, 'search': 30, 'spotify': 15, 'soundcloud': 15}
+QUEUE_SIZES = (100, 1000, 10000)
+# Signed stream URLs stay valid this long, so queued songs never need resolving again mid-run
+STREAM_LIFETIME = 6 * 3600
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def summarize(samples):
+    """Reduces latency samples to the figures tracked between runs.
+
+    Args:
+        samples (list): Latencies in seconds.
+
+    Returns:
+        dict: The count and the p50, p99 and maximum in milliseconds.
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+
+    def at(q):
+        return samples[min(int(q * len(samples)), len(samples) - 1)] * 1000
+
+    return {'count': len(samples), 'p50_ms': at(0.5), 'p99_ms': at(0.99), 'max_ms': samples[-1] * 1000}
+
+
+class Catalog:
+    """
+    The tracks every stub provider knows.
+
+    Tracks are requested with Zipf-like popularity, so caches see the mix of
+    repeat plays and first plays a real bot does.
+    """
+
+    def __init__(self, size, seed=0):
+        rng = random.Random(seed)
+        self.tracks = [
+            {'key': f'{index:011d}', 'title': f'Song {index}', 'artist': f'Artist {index % 97}',
+             'duration': rng.randint(120, 360), 'codec': 'opus' if index % 3 else 'mp4a.40.2'}
+            for index in range(size)
+        ]
+        self._by_key = {track['key']: track for track in self.tracks}
+        self._weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(size)))
+
+    def find(self, query):
+        """
+        Returns the track a URL or search points at; unknown searches still match some track.
+
+        Args:
+            query (str): A URL, track ID or search.
+
+        Returns:
+            dict: The track.
+        """
+        match = YOUTUBE_ID.search(query)
+        track = self._by_key.get(match.group(1) if match else query.rstrip('/').rsplit('/', 1)[-1])
+        return track or self.tracks[zlib.crc32(query.encode()) % len(self.tracks)]
+
+    def query(self, rng):
+        """
+        Picks a track by popularity and asks for it the way a user might.
+
+        Args:
+            rng (random.Random): The random number generator to use.
+
+        Returns:
+            str: The /play query.
+        """
+        track = rng.choices(self.tracks, cum_weights=self._weights)[0]
+        kind = rng.choices(list(QUERY_MIX), list(QUERY_MIX.values()))[0]
+        if kind == 'youtube':
+            return f"https://www.youtube.com/watch?v={track['key']}"
+        if kind == 'spotify':
+            return f"https://open.spotify.com/track/{track['key']}"
+        if kind == 'soundcloud':
+            return f"https://soundcloud.com/artist-{track['artist'].split()[-1]}/{track['key']}"
+        return f"{track['artist']} {track['title']}"
+
+
+class StubExtractor:
+    """
+    Stands in for resolve_track: blocks its worker like youtube_dl would, then answers from the catalog.
+    """
+
+    def __init__(self, catalog, latency):
+        self.catalog = catalog
+        self.latency = latency
+
+    def __call__(self, query):
+        time.sleep(self.latency)
+        track = self.catalog.find(query)
+        return {
+            'id': f"youtube:{track['key']}",
+            'title': track['title'],
+            'artist': track['artist'],
+            'duration': track['duration'],
+            'webpage_url': f"https://www.youtube.com/watch?v={track['key']}",
+            'stream_url': f"https://media.invalid/{track['key']}?expire={int(time.time()) + STREAM_LIFETIME}",
+            'codec': track['codec'],
+        }
+
+
+class StubClients:
+    """
+    Stands in for ApiClients, answering Spotify, SoundCloud and Genius calls from the catalog.
+
+    Calls run on a thread like ``ApiClients.call`` and block it for the
+    configured latency, but skip the provider rate limits, which would
+    otherwise set the pace of the whole run.
+    """
+
+    def __init__(self, catalog, latency):
+        self.catalog = catalog
+        self.latency = latency
+        self.spotify = SimpleNamespace(track=self._spotify_track)
+        self.soundcloud = SimpleNamespace(get=self._soundcloud_get)
+        self.genius = SimpleNamespace(search_song=self._genius_search)
+
+    def _spotify_track(self, track_id):
+        time.sleep(self.latency)
+        track = self.catalog.find(track_id)
+        return {'name': track['title'], 'artists': [{'name': track['artist']}],
+                'external_urls': {'spotify': f"https://open.spotify.com/track/{track['key']}"}}
+
+    def _soundcloud_get(self, path):
+        time.sleep(self.latency)
+        track = self.catalog.find(path)
+        return {'title': track['title'], 'user': {'username': track['artist']},
+                'stream_url': f"https://api.soundcloud.com/tracks/{track['key']}/stream"}
+
+    def _genius_search(self, song_title, artist_name):
+        time.sleep(self.latency)
+        return SimpleNamespace(lyrics=f'{song_title}\n' + 'La la la\n' * 40)
+
+    async def call(self, provider, func, *args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    def close(self):
+        pass
+
+
+class SyntheticStream(discord.AudioSource):
+    """
+    Stands in for FFmpegPCMAudio and FFmpegOpusAudio, returning one pre-made frame over and over.
+
+    Streams are endless unless ``length`` is set to a number of frames. The
+    cost of FFmpeg itself, which runs in a child process, is not included.
+    """
+
+    length = None
+    pcm_frame = (np.random.default_rng(0).standard_normal((FRAME_SAMPLES, CHANNELS)) * 3000).astype(np.int16).tobytes()
+    opus_frame = b'\xfc' + b'\x00' * 159
+
+    def __init__(self, url, codec=None, before_options=None, options=None):
+        # FFmpegOpusAudio is always given a codec, FFmpegPCMAudio never
+        if codec is not None and codec not in ('opus', 'libopus'):
+            # FFmpegOpusAudio re-encodes anything else with libopus, so it would not be a passthrough
+            raise ValueError(f"FFmpegOpusAudio only copies opus streams, got codec {codec!r}")
+        self.opus = codec is not None
+        self.remaining = self.length
+
+    def read(self):
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                return b''
+            self.remaining -= 1
+        return self.opus_frame if self.opus else self.pcm_frame
+
+    def is_opus(self):
+        return self.opus
+
+
+async def _stub_loudness(url, cached=False):
+    # Measuring takes FFmpeg; the result is still stored and looked up like a real one
+    return -12.0, -1.5
+
+
+def install_stubs(catalog, extract_latency):
+    """Swaps youtube_dl, FFmpeg and loudness analysis for the stubs.
+
+    Args:
+        catalog (Catalog): The tracks the stubs know.
+        extract_latency (float): Seconds each extraction blocks its worker.
+    """
+    resolver.resolve_track = StubExtractor(catalog, extract_latency)
+    loudness.analyze_loudness = _stub_loudness
+    discord.FFmpegPCMAudio = discord.FFmpegOpusAudio = SyntheticStream
+
+
+class FakeMessage:
+    """
+    A message the bot sent; edits are counted on its channel.
+    """
+
+    __slots__ = ('id', 'channel')
+
+    def __init__(self, message_id, channel):
+        self.id = message_id
+        self.channel = channel
+
+    async def edit(self, content=None, embed=None):
+        self.channel.edits += 1
+
+
+class FakeTextChannel:
+    """
+    A text channel that accepts every message instantly.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.last_message_id = None
+        self.sent = 0
+        self.edits = 0
+
+    async def send(self, content=None, embed=None):
+        self.sent += 1
+        message = FakeMessage(next(self._ids), self)
+        self.last_message_id = message.id
+        return message
+
+
+class FakeVoiceClient:
+    """
+    A voice connection that accepts sources but never reads them; stopping one ends it like the real client.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.source = None
+        # Nothing is ever encoded, but the player checks for an encoder before switching to PCM
+        self.encoder = object()
+        self._after = None
+        self._paused = False
+        self._connected = True
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self.source is not None and not self._paused
+
+    def is_paused(self):
+        return self.source is not None and self._paused
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    def play(self, source, *, after=None):
+        if self.source is not None:
+            raise discord.ClientException('Already playing audio.')
+        self.source = source
+        self._after = after
+        self._paused = False
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def stop(self):
+        source, self.source = self.source, None
+        if source is None:
+            return
+        source.cleanup()
+        if self._after is not None:
+            self._after(None)
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self._connected = False
+
+
+class FakeVoiceChannel:
+    """
+    A voice channel that connects instantly.
+    """
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+    async def connect(self):
+        return FakeVoiceClient(self)
+
+
+def fake_context(guild_id):
+    """Builds the parts of a command context the cog uses, for one member of a guild.
+
+    Args:
+        guild_id (int): The ID of the guild.
+
+    Returns:
+        SimpleNamespace: The context.
+    """
+    voice_channel = FakeVoiceChannel(guild_id + 2)
+    return SimpleNamespace(
+        guild=SimpleNamespace(id=guild_id),
+        author=SimpleNamespace(id=guild_id + 3, voice=SimpleNamespace(channel=voice_channel)),
+        channel=FakeTextChannel(guild_id + 1),
+    )
+
+
+class ErrorTap:
+    """
+    Counts the error replies the cog sends, so a broken command shows up in the results instead of looking fast.
+    """
+
+    def __init__(self, messages):
+        self.count = 0
+        self.first = None
+        self._send = messages.send
+        messages.send = self.send
+
+    def send(self, channel, content=None, embed=None):
+        if content and content.startswith('An error occurred'):
+            self.count += 1
+            self.first = self.first or content
+        self._send(channel, content, embed)
+
+
+def command_arguments(name, player, catalog, rng):
+    """Picks the arguments a user might give a command, given the guild's queue.
+
+    Args:
+        name (str): The command name.
+        player (MusicPlayer): The guild's player, or None if it has none.
+        catalog (Catalog): The tracks that can be played.
+        rng (random.Random): The random number generator to use.
+
+    Returns:
+        dict: Keyword arguments for the command.
+    """
+    size = max(len(player.queue) if player is not None else 0, 1)
+    if name == 'play':
+        return {'query': catalog.query(rng)}
+    if name == 'queue':
+        return {'page': rng.randint(1, (size - 1) // QUEUE_PAGE_SIZE + 1)}
+    if name == 'remove':
+        return {'position': rng.randint(1, size)}
+    if name == 'move':
+        return {'source': rng.randint(1, size), 'destination': rng.randint(1, size)}
+    if name == 'volume':
+        return {'volume': rng.randint(10, 100)}
+    if name == 'loop':
+        return {'mode': rng.choice(('off', 'song', 'queue'))}
+    if name == 'bassboost':
+        return {'boost': rng.choice((0, 6))}
+    return {}
+
+
+async def drive_guild(bot, cog, guild_id, count, catalog, rng, timings):
+    # One member sending commands back to back; the first few queue something to work with
+    ctx = fake_context(guild_id)
+    names = ['play'] * 3 + rng.choices(list(COMMAND_MIX), list(COMMAND_MIX.values()), k=max(count - 3, 0))
+    for name in names[:count]:
+        kwargs = command_arguments(name, cog.players.peek(guild_id), catalog, rng)
+        command = bot.get_command(name)
+        started_at = time.perf_counter()
+        await command(ctx, **kwargs)
+        timings[name].append(time.perf_counter() - started_at)
+
+
+async def run_commands(database_url, guilds, total, catalog, api_latency, seed):
+    """Runs the command workload against a fresh cog on one database.
+
+    Args:
+        database_url (str): The database to use.
+        guilds (int): Guilds sending commands concurrently.
+        total (int): Commands sent in all.
+        catalog (Catalog): The tracks that can be played.
+        api_latency (float): Seconds each Spotify, SoundCloud and Genius call takes.
+        seed (int): Seed of the simulated traffic.
+
+    Returns:
+        dict: Throughput, CPU time, errors and latency per command.
+    """
+    database = AsyncDatabase(open_database(database_url, autocommit=False))
+    bot = commands.Bot(command_prefix='!', intents=discord.Intents.default())
+    cog = MusicCog(bot, StubClients(catalog, api_latency), database, audio_cache_dir=None)
+    bot.add_cog(cog)
+    # Each run starts with cold caches that persist to its own database
+    cog.resolver.cache = TrackCache(database)
+    errors = ErrorTap(cog.messages)
+
+    timings = defaultdict(list)
+    per_guild, extra = divmod(total, guilds)
+    started_cpu = cpu_seconds()
+    started_at = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            drive_guild(bot, cog, (index + 1) << 22, per_guild + (index < extra), catalog,
+                        random.Random(seed + index), timings)
+            for index in range(guilds)
+        ))
+        elapsed = time.perf_counter() - started_at
+        cpu = cpu_seconds() - started_cpu
+    finally:
+        await cog.players.close()
+        cog.cog_unload()
+        await database.close()
+
+    sent = sum(len(samples) for samples in timings.values())
+    return {
+        'commands': sent,
+        'seconds': elapsed,
+        'commands_per_second': sent / elapsed,
+        'cpu_ms_per_command': cpu * 1000 / sent,
+        'errors': errors.count,
+        'first_error': errors.first,
+        'latency': {name: summarize(samples) for name, samples in sorted(timings.items())},
+    }
+
+
+async def measure_database(database_url, operations, concurrency):
+    """Measures write and read throughput of the operations commands make most.
+
+    Writes are queued without waiting, as the bot does, and timed until they
+    are committed. Reads are issued by ``concurrency`` tasks at once.
+
+    Args:
+        database_url (str): The database to use.
+        operations (int): Writes, and reads, to make.
+        concurrency (int): Tasks reading at once.
+
+    Returns:
+        dict: Writes and reads per second.
+    """
+    database = AsyncDatabase(open_database(database_url, autocommit=False))
+    rng = random.Random(0)
+    keys = [f'benchmark:{index}' for index in range(operations)]
+    track = StubExtractor(Catalog(1), 0)('benchmark')
+    expires_at = time.time() + STREAM_LIFETIME
+    try:
+        started_at = time.perf_counter()
+        for index, key in enumerate(keys):
+            if index % 2:
+                database.append_player_state(index % 100, ['volume', 0.5])
+            else:
+                database.set_cached_track(key, track, expires_at)
+        await database.flush()
+        writes = operations / (time.perf_counter() - started_at)
+
+        async def read(count):
+            for index in range(count):
+                if index % 2:
+                    await database.get_guild_setting(rng.randrange(100), 'default_source')
+                else:
+                    await database.get_cached_track(rng.choice(keys))
+
+        per_task = max(operations // concurrency, 1)
+        started_at = time.perf_counter()
+        await asyncio.gather(*(read(per_task) for _ in range(concurrency)))
+        reads = per_task * concurrency / (time.perf_counter() - started_at)
+    finally:
+        await database.close()
+    return {'writes_per_second': writes, 'reads_per_second': reads}
+
+
+def measure_queue(size, repeat):
+    """Times the queue operations behind /play, /skip, /remove, /move, /shuffle and /queue.
+
+    Args:
+        size (int): Songs in the queue.
+        repeat (int): Times each constant-time operation is repeated; shuffling is repeated 100 times less.
+
+    Returns:
+        dict: Nanoseconds per operation.
+    """
+    queue = TrackQueue(QueueEntry(f'https://media.invalid/{index}', f'Song {index}', 'Artist', 1)
+                       for index in range(size))
+    middle = size // 2
+    results = {}
+
+    def timed(name, operation, times=repeat):
+        started_at = time.perf_counter_ns()
+        for _ in range(times):
+            operation()
+        results[name] = (time.perf_counter_ns() - started_at) / times
+
+    timed('append + popleft', lambda: queue.append(queue.popleft()))
+    timed('remove + insert at middle', lambda: queue.insert(middle, queue.remove(middle)))
+    timed('move front to back', lambda: queue.move(0, size - 1))
+    timed('page at middle', lambda: queue.page(middle // QUEUE_PAGE_SIZE, QUEUE_PAGE_SIZE))
+    timed('shuffle', queue.shuffle, max(repeat // 100, 1))
+    return results
+
+
+def stream_presets():
+    full = AudioFilters()
+    full.set_bass(8)
+    for band, gain_db in enumerate((3, -2, 1, 4, -3)):
+        full.set_band(band, gain_db)
+    full.set_normalize(True)
+    # Volume, codec and filters of the song
+    return {
+        'passthrough': (1.0, 'opus', AudioFilters()),
+        'transcode': (0.5, None, AudioFilters()),
+        'transcode + filters': (1.0, None, full),
+    }
+
+
+def play_stream(volume, codec, filters, encode):
+    # Reads the whole stream the way the voice client's player thread does
+    source = TimedSource(create_audio_source('synthetic', volume, codec, filters=filters))
+    encoder = discord.opus.Encoder() if encode and not source.is_opus() else None
+    try:
+        while True:
+            frame = source.read()
+            if not frame:
+                return
+            if encoder is not None:
+                encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+    finally:
+        source.cleanup()
+
+
+def measure_streams(streams, seconds):
+    """Measures CPU time per voice stream through the bot's audio pipeline, one thread per stream.
+
+    Args:
+        streams (int): Streams played at once.
+        seconds (float): Seconds of audio per stream.
+
+    Returns:
+        dict: CPU seconds per stream-minute and streams per core for each preset,
+            and whether Opus encoding was included.
+    """
+    if not discord.opus.is_loaded():
+        discord.opus._load_default()
+    encode = discord.opus.is_loaded()
+    if encode:
+        SyntheticStream.opus_frame = discord.opus.Encoder().encode(SyntheticStream.pcm_frame, FRAME_SAMPLES)
+
+    results = {'opus_encoding': encode}
+    SyntheticStream.length = int(seconds / FRAME_SECONDS)
+    try:
+        for name, preset in stream_presets().items():
+            threads = [threading.Thread(target=play_stream, args=(*preset, encode)) for _ in range(streams)]
+            started_cpu = cpu_seconds()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            cpu_per_minute = (cpu_seconds() - started_cpu) / (streams * seconds / 60)
+            results[name] = {'cpu_seconds_per_stream_minute': cpu_per_minute,
+                             'streams_per_core': 60 / cpu_per_minute if cpu_per_minute else None}
+    finally:
+        SyntheticStream.length = None
+    return results
+
+
+def _label(database_url, taken):
+    # Results are keyed by backend rather than URL, which may hold credentials
+    label = database_url.split(':', 1)[0]
+    for suffix in itertools.count(2):
+        if label not in taken:
+            return label
+        label = f"{database_url.split(':', 1)[0]}-{suffix}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=50, help='Guilds sending commands concurrently.')
+    parser.add_argument('--commands', type=int, default=2000, help='Commands sent per database.')
+    parser.add_argument('--catalog', type=int, default=500, help='Tracks the stub providers know.')
+    parser.add_argument('--extract-latency', type=float, default=0.1,
+                        help='Seconds each stub YouTube extraction blocks a resolver worker.')
+    parser.add_argument('--api-latency', type=float, default=0.05,
+                        help='Seconds each stub Spotify, SoundCloud and Genius call takes.')
+    parser.add_argument('--database', action='append',
+                        help='Database URL to benchmark; repeat for several. Defaults to a temporary '
+                             'SQLite file and memory://.')
+    parser.add_argument('--db-operations', type=int, default=5000, help='Writes, and reads, per database.')
+    parser.add_argument('--db-concurrency', type=int, default=8, help='Tasks reading from the database at once.')
+    parser.add_argument('--queue-repeat', type=int, default=10000, help='Repetitions of each queue operation.')
+    parser.add_argument('--streams', type=int, default=4, help='Voice streams played at once for the CPU figures.')
+    parser.add_argument('--stream-seconds', type=float, default=60, help='Seconds of audio per voice stream.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the catalog and the simulated traffic.')
+    parser.add_argument('--output', help='JSON file to save the results to.')
+    args = parser.parse_args()
+
+    catalog = Catalog(args.catalog, args.seed)
+    install_stubs(catalog, args.extract_latency)
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'options': {name: value for name, value in vars(args).items() if name not in ('database', 'output')},
+        'commands': {},
+        'database': {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        for database_url in args.database or [f"sqlite:///{os.path.join(directory, 'benchmark.db')}", 'memory://']:
+            label = _label(database_url, results['commands'])
+            run = results['commands'][label] = asyncio.run(run_commands(
+                database_url, args.guilds, args.commands, catalog, args.api_latency, args.seed
+            ))
+            database = results['database'][label] = asyncio.run(measure_database(
+                database_url, args.db_operations, args.db_concurrency
+            ))
+            play = run['latency'].get('play', {})
+            print(f"{label:10} {run['commands_per_second']:,.0f} commands/s, "
+                  f"{run['cpu_ms_per_command']:.2f} CPU ms per command, "
+                  f"/play p50 {play.get('p50_ms', 0):.1f} ms p99 {play.get('p99_ms', 0):.1f} ms, "
+                  f"{run['errors']} errors")
+            print(f"{'':10} {database['writes_per_second']:,.0f} DB writes/s, "
+                  f"{database['reads_per_second']:,.0f} DB reads/s")
+            if run['first_error']:
+                print(f"{'':10} first error: {run['first_error']}")
+
+    results['queue'] = {}
+    for size in QUEUE_SIZES:
+        costs = results['queue'][size] = measure_queue(size, args.queue_repeat)
+        print(f'queue of {size:5}: ' + ', '.join(f'{name} {cost:,.0f} ns' for name, cost in costs.items()))
+
+    streams = results['voice_streams'] = measure_streams(args.streams, args.stream_seconds)
+    for name, result in streams.items():
+        if name != 'opus_encoding':
+            print(f"{name:20} {result['cpu_seconds_per_stream_minute']:.3f} CPU s per stream-minute "
+                  f"({result['streams_per_core']:.0f} streams per core)")
+    if not streams['opus_encoding']:
+        print('libopus is not installed, so the figures above leave out Opus encoding')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved results to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
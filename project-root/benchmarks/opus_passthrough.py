@@ -0,0 +1,71 @@
+"""Compares CPU time per stream between Opus passthrough and PCM transcoding.
+
+Needs FFmpeg, libopus and an Opus/WebM file. Run from the project root:
+
+    python -m benchmarks.opus_passthrough track.webm --streams 5
+"""
+import argparse
+import resource
+import time
+
+import discord
+
+from music_bot.utils.audio import create_audio_source
+
+
+def cpu_seconds():
+    # FFmpeg runs as a child process, so its time is counted once it has exited
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def play(path, passthrough):
+    """Reads a file to the end the way the voice client would, encoding PCM frames.
+
+    Returns:
+        int: The number of frames sent.
+    """
+    source = create_audio_source(path, codec='opus' if passthrough else None)
+    encoder = None if source.is_opus() else discord.opus.Encoder()
+    frames = 0
+    try:
+        while True:
+            frame = source.read()
+            if not frame:
+                return frames
+            if encoder is not None:
+                encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+            frames += 1
+    finally:
+        source.cleanup()
+
+
+def measure(path, streams, passthrough):
+    started_cpu = cpu_seconds()
+    started_at = time.perf_counter()
+    frames = sum(play(path, passthrough) for _ in range(streams))
+    cpu = cpu_seconds() - started_cpu
+    audio_minutes = frames * 0.02 / 60
+    return {
+        'cpu_seconds_per_stream_minute': cpu / audio_minutes,
+        'realtime_factor': audio_minutes * 60 / (time.perf_counter() - started_at),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='An Opus/WebM audio file.')
+    parser.add_argument('--streams', type=int, default=3, help='Streams played per path.')
+    args = parser.parse_args()
+
+    if not discord.opus.is_loaded():
+        discord.opus._load_default()
+    for name, passthrough in (('passthrough', True), ('transcode', False)):
+        result = measure(args.path, args.streams, passthrough)
+        print(f"{name:12} {result['cpu_seconds_per_stream_minute']:.3f} CPU s per stream-minute, "
+              f"{result['realtime_factor']:.0f}x realtime")
+
+
+if __name__ == '__main__':
+    main()
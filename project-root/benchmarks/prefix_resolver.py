@@ -0,0 +1,44 @@
+"""Measures how many messages per second the per-guild prefix resolver handles.
+
+Run from the project root:
+
+    python -m benchmarks.prefix_resolver --guilds 10000 --messages 1000000
+"""
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from music_bot.utils.settings import SettingsCache, prefix_resolver
+
+
+async def run(guilds, messages, custom):
+    settings = SettingsCache()
+    guild_ids = list(range(guilds))
+    for guild_id in random.sample(guild_ids, int(guilds * custom)):
+        await settings.set_guild_setting(guild_id, 'prefix', '?')
+    await settings.warm_guild_setting('prefix', guild_ids)
+
+    get_prefix = prefix_resolver(settings, '!')
+    traffic = [SimpleNamespace(guild=SimpleNamespace(id=random.choice(guild_ids))) for _ in range(messages)]
+    started_at = time.perf_counter()
+    for message in traffic:
+        await get_prefix(None, message)
+    elapsed = time.perf_counter() - started_at
+    return messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=10000, help='Number of guilds.')
+    parser.add_argument('--messages', type=int, default=1000000, help='Number of messages to resolve.')
+    parser.add_argument('--custom', type=float, default=0.2, help='Fraction of guilds with a custom prefix.')
+    args = parser.parse_args()
+
+    rate = asyncio.run(run(args.guilds, args.messages, args.custom))
+    print(f'{rate:,.0f} messages/s across {args.guilds} guilds')
+
+
+if __name__ == '__main__':
+    main()
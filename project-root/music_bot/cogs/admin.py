@@ -2,35 +2,43 @@ import discord
 from discord.ext import commands
 
 from music_bot.config import *
+from music_bot.utils.instrumentation import stats_summary
+from music_bot.utils.messages import MessageScheduler
+from music_bot.utils.metrics import snapshot
+from music_bot.utils.settings import SettingsCache
 
 
 class AdminCog(commands.Cog):
     """Cog for administrative commands."""
 
-    def __init__(self, bot):
+    def __init__(self, bot, settings=None, cluster=None, messages=None):
         self.bot = bot
+        self.settings = settings or SettingsCache()
+        self.cluster = cluster
+        # Replies share the music cog's per-channel rate limits when it is given the same scheduler
+        self.messages = messages or MessageScheduler()
 
     @commands.command(name="setprefix")
     @commands.has_permissions(administrator=True)
     async def set_prefix(self, ctx, prefix: str):
-        """Sets the command prefix for the bot.
+        """Sets the command prefix for this server.
 
         Parameters:
             ctx (discord.ext.commands.Context): The context of the command.
             prefix (str): The new command prefix.
         """
         if len(prefix) > 1:
-            await ctx.send("Prefix must be a single character.")
+            self.messages.send(ctx.channel, "Prefix must be a single character.")
             return
 
-        # Update the command prefix in the .env file (for simplicity)
-        os.environ["COMMAND_PREFIX"] = prefix
-        await ctx.send(f"Command prefix set to `{prefix}`.")
+        # Store the prefix for this server
+        await self.settings.set_guild_setting(ctx.guild.id, "prefix", prefix)
+        self.messages.send(ctx.channel, f"Command prefix set to `{prefix}`.")
 
     @commands.command(name="setsource")
     @commands.has_permissions(administrator=True)
     async def set_source(self, ctx, source: str):
-        """Sets the default music source for the bot.
+        """Sets the default music source for this server.
 
         Parameters:
             ctx (discord.ext.commands.Context): The context of the command.
@@ -38,12 +46,12 @@ class AdminCog(commands.Cog):
         """
         source = source.lower()
         if source not in ["youtube", "spotify", "soundcloud"]:
-            await ctx.send("Invalid music source. Choose from: youtube, spotify, soundcloud.")
+            self.messages.send(ctx.channel, "Invalid music source. Choose from: youtube, spotify, soundcloud.")
             return
 
-        # Update the default music source in the .env file (for simplicity)
-        os.environ["DEFAULT_MUSIC_SOURCE"] = source
-        await ctx.send(f"Default music source set to `{source}`.")
+        # Store the default music source for this server
+        await self.settings.set_guild_setting(ctx.guild.id, "default_source", source)
+        self.messages.send(ctx.channel, f"Default music source set to `{source}`.")
 
     @commands.command(name="reload")
     @commands.has_permissions(administrator=True)
@@ -55,4 +63,27 @@ class AdminCog(commands.Cog):
         """
         for cog in self.bot.cogs:
             self.bot.reload_extension(f"music_bot.cogs.{cog}")
-        await ctx.send("Cogs reloaded.")
\ No newline at end of file
+        self.messages.send(ctx.channel, "Cogs reloaded.")
+
+    @commands.command(name="stats")
+    @commands.has_permissions(administrator=True)
+    async def stats(self, ctx):
+        """Shows how the bot is performing.
+
+        In a multi-process deployment the figures cover every worker, as of
+        their last metrics report.
+
+        Parameters:
+            ctx (discord.ext.commands.Context): The context of the command.
+        """
+        values = snapshot()
+        title = "Bot stats"
+        if self.cluster is not None and self.cluster.cluster_metrics is not None:
+            values = self.cluster.cluster_metrics
+            title = "Bot stats (all workers)"
+
+        embed = discord.Embed(title=title)
+        embed.add_field(name="Gateway latency", value=f"{self.bot.latency * 1000:.0f} ms", inline=False)
+        for name, value in stats_summary(values):
+            embed.add_field(name=name, value=value, inline=False)
+        self.messages.send(ctx.channel, embed=embed)
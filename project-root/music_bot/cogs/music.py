@@ -3,13 +3,28 @@ from discord.ext import commands
 import asyncio
 import youtube_dl
 import requests
-from spotipy import Spotify
-from soundcloud import Client as SoundCloudClient
-import pyaudio
-from pydub import AudioSegment
-import ffmpeg
 
-from music_bot.utils.music import MusicPlayer
+from music_bot.config import (
+    AUDIO_CACHE_DIR,
+    BASS_BOOST_MAX_DB,
+    DEFAULT_MUSIC_SOURCE,
+    EQ_BANDS,
+    EQ_MAX_GAIN_DB,
+    FILTER_MAX_GAIN_DB,
+    MEDIA_WORKERS,
+    QUEUE_PAGE_SIZE,
+)
+from music_bot.utils.audio_cache import AudioCache
+from music_bot.utils.clients import ApiClients
+from music_bot.utils.ingest import PlaylistIngestor, is_playlist_url
+from music_bot.utils.loudness import LoudnessService
+from music_bot.utils.lyrics import LyricsService, lyrics_embeds
+from music_bot.utils.media_workers import MediaWorkerPool
+from music_bot.utils.messages import MessageScheduler
+from music_bot.utils.music import PlayerRegistry
+from music_bot.utils.playback_state import PlaybackStore
+from music_bot.utils.resolver import TrackResolver
+from music_bot.utils.settings import SettingsCache
 
 # Suppress noisy YouTube DL logging
 youtube_dl.utils.bug_reports_message = lambda: ''
@@ -17,10 +32,40 @@ youtube_dl.utils.bug_reports_message = lambda: ''
 class MusicCog(commands.Cog):
     """Cog for music-related commands."""
 
-    def __init__(self, bot):
+    def __init__(self, bot, clients=None, database=None, settings=None, audio_cache_dir=AUDIO_CACHE_DIR,
+                 messages=None):
         self.bot = bot
-        self.music_player = MusicPlayer()
-        self.voice_client = None
+        # Clients handed in belong to whoever created them and outlive the cog
+        self._owns_clients = clients is None
+        self.clients = clients or ApiClients()
+        self.settings = settings or SettingsCache(database)
+        # Extraction and transcoding run in worker processes when they are enabled
+        self.media = MediaWorkerPool() if MEDIA_WORKERS else None
+        self.resolver = TrackResolver(self.media) if self.media is not None else TrackResolver()
+        self.lyrics = LyricsService(self.clients, database)
+        self.loudness = LoudnessService(database)
+        self.audio_cache = AudioCache(audio_cache_dir) if audio_cache_dir else None
+        self.store = PlaybackStore(database) if database is not None else None
+        self.messages = messages or MessageScheduler()
+        self.players = PlayerRegistry(self.resolver, self.lyrics, self.loudness, self.audio_cache, self.store,
+                                      self.messages, self.media)
+
+    def cog_unload(self):
+        """Releases the resolver worker pool and voice connections when the cog is unloaded."""
+        self.resolver.shutdown()
+        self.loudness.close()
+        if self.audio_cache is not None:
+            self.audio_cache.close()
+        self.messages.close()
+        if self._owns_clients:
+            self.clients.close()
+        self.bot.loop.create_task(self._close_players())
+
+    async def _close_players(self):
+        # Media workers have to outlive the streams they are transcoding
+        await self.players.close()
+        if self.media is not None:
+            self.media.shutdown(wait=False)
 
     @commands.command(name='play')
     async def play(self, ctx, *, query: str):
@@ -33,15 +78,17 @@ class MusicCog(commands.Cog):
         try:
             # Check if the user is in a voice channel
             if not ctx.author.voice:
-                await ctx.send("You are not connected to a voice channel.")
+                self.messages.send(ctx.channel, "You are not connected to a voice channel.")
                 return
 
-            # Check if the bot is already in a voice channel
-            if not self.voice_client:
-                # Connect the bot to the user's voice channel
-                self.voice_client = await ctx.author.voice.channel.connect()
-            elif self.voice_client.channel != ctx.author.voice.channel:
-                await self.voice_client.move_to(ctx.author.voice.channel)
+            # Connect the guild's player to the user's voice channel
+            player = await self.players.get(ctx.guild.id)
+            await player.connect(ctx.author.voice.channel)
+
+            # Playlists and albums are streamed into the queue page by page
+            if is_playlist_url(query):
+                await self.play_playlist(ctx, query)
+                return
 
             # Determine the music source
             source = query.lower()
@@ -51,165 +98,277 @@ class MusicCog(commands.Cog):
                 await self.play_spotify(ctx, query)
             elif 'soundcloud' in source:
                 await self.play_soundcloud(ctx, query)
+            elif '://' in query:
+                await self.play_youtube(ctx, query)  # Other URLs go straight to youtube_dl
             else:
-                await self.play_youtube(ctx, query)  # Default to YouTube
+                # Plain searches go to the server's default source; Spotify has no audio, so it searches YouTube
+                default_source = await self.settings.get_guild_setting(ctx.guild.id, 'default_source', DEFAULT_MUSIC_SOURCE)
+                search = 'scsearch1' if default_source == 'soundcloud' else 'ytsearch1'
+                await self.play_youtube(ctx, f"{search}:{query}")
 
         except Exception as e:
-            await ctx.send(f"An error occurred while playing the song: {e}")
+            self.messages.send(ctx.channel, f"An error occurred while playing the song: {e}")
 
     async def play_youtube(self, ctx, query):
         """Plays a song from YouTube."""
         try:
-            # Download and stream the YouTube video
-            with youtube_dl.YoutubeDL({'format': 'bestaudio'}) as ydl:
-                info = ydl.extract_info(query, download=False)
-                url = info['formats'][0]['url']
-                title = info['title']
-                artist = info['uploader']
+            # Resolve the YouTube video on the worker pool so the event loop keeps running
+            track = await self.resolver.resolve(ctx.guild.id, query)
+            url = track['stream_url']
+            title = track['title']
+            artist = track['artist']
 
             # Add the song to the queue and start playback
-            await self.music_player.add_to_queue(ctx, url, title, artist)
-            await self.music_player.play(self.voice_client)
-            await ctx.send(f"Now playing: {title} by {artist}")
+            player = await self.players.get(ctx.guild.id)
+            song = await player.add_to_queue(ctx, url, title, artist, query=track['webpage_url'] or query,
+                                             codec=track.get('codec'), track_id=track['id'])
+            await player.play()
+            # The player announces songs as they start
+            if player.current is not song:
+                self.messages.send(ctx.channel, f"Added {title} by {artist} to the queue.")
 
         except Exception as e:
-            await ctx.send(f"An error occurred while playing the YouTube song: {e}")
+            self.messages.send(ctx.channel, f"An error occurred while playing the YouTube song: {e}")
 
     async def play_spotify(self, ctx, query):
         """Plays a song from Spotify."""
         try:
-            # Get the Spotify API credentials from the .env file
-            spotify_client_id = os.getenv('SPOTIFY_CLIENT_ID')
-            spotify_client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
-
-            # Create a Spotify client
-            spotify = Spotify(client_id=spotify_client_id, client_secret=spotify_client_secret)
-
             # Get the track ID from the query (assume a track URL for now)
             track_id = query.split('/')[-1]
 
-            # Get the track information
-            track_info = spotify.track(track_id)
+            # Get the track information through the shared Spotify client
+            track_info = await self.clients.call('spotify', self.clients.spotify.track, track_id)
 
             # Get the track URL (for streaming)
             track_url = track_info['external_urls']['spotify']
 
             # Add the song to the queue and start playback
-            await self.music_player.add_to_queue(ctx, track_url, track_info['name'], track_info['artists'][0]['name'])
-            await self.music_player.play(self.voice_client)
-            await ctx.send(f"Now playing: {track_info['name']} by {track_info['artists'][0]['name']}")
+            player = await self.players.get(ctx.guild.id)
+            title = track_info['name']
+            artist = track_info['artists'][0]['name']
+            song = await player.add_to_queue(ctx, track_url, title, artist)
+            await player.play()
+            if player.current is not song:
+                self.messages.send(ctx.channel, f"Added {title} by {artist} to the queue.")
 
         except Exception as e:
-            await ctx.send(f"An error occurred while playing the Spotify song: {e}")
+            self.messages.send(ctx.channel, f"An error occurred while playing the Spotify song: {e}")
 
     async def play_soundcloud(self, ctx, query):
         """Plays a song from SoundCloud."""
         try:
-            # Get the SoundCloud API credentials from the .env file
-            soundcloud_client_id = os.getenv('SOUNDCLOUD_CLIENT_ID')
-            soundcloud_client_secret = os.getenv('SOUNDCLOUD_CLIENT_SECRET')
-
-            # Create a SoundCloud client
-            soundcloud = SoundCloudClient(client_id=soundcloud_client_id, client_secret=soundcloud_client_secret)
-
             # Get the track ID from the query (assume a track URL for now)
             track_id = query.split('/')[-1]
 
-            # Get the track information
-            track_info = soundcloud.get('/tracks/' + track_id)
+            # Get the track information through the shared SoundCloud client
+            track_info = await self.clients.call('soundcloud', self.clients.soundcloud.get, '/tracks/' + track_id)
 
             # Get the track URL (for streaming)
             track_url = track_info['stream_url']
 
             # Add the song to the queue and start playback
-            await self.music_player.add_to_queue(ctx, track_url, track_info['title'], track_info['user']['username'])
-            await self.music_player.play(self.voice_client)
-            await ctx.send(f"Now playing: {track_info['title']} by {track_info['user']['username']}")
+            player = await self.players.get(ctx.guild.id)
+            title = track_info['title']
+            artist = track_info['user']['username']
+            song = await player.add_to_queue(ctx, track_url, title, artist)
+            await player.play()
+            if player.current is not song:
+                self.messages.send(ctx.channel, f"Added {title} by {artist} to the queue.")
 
         except Exception as e:
-            await ctx.send(f"An error occurred while playing the SoundCloud song: {e}")
+            self.messages.send(ctx.channel, f"An error occurred while playing the SoundCloud song: {e}")
+
+    async def play_playlist(self, ctx, query):
+        """Queues every song of a Spotify, YouTube or SoundCloud playlist or album."""
+        try:
+            ingestor = PlaylistIngestor(self.resolver, self.clients, self.messages)
+            await ingestor.ingest(ctx, await self.players.get(ctx.guild.id), query)
+
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while loading the playlist: {e}")
 
     @commands.command(name='skip')
     async def skip(self, ctx):
         """Skips the current song in the queue."""
         try:
-            if not self.voice_client:
-                await ctx.send("The bot is not currently playing music.")
+            player = self.players.peek(ctx.guild.id)
+            if player is None or not player.voice_client:
+                self.messages.send(ctx.channel, "The bot is not currently playing music.")
                 return
 
             # Skip the current song
-            await self.music_player.skip(self.voice_client)
-            await ctx.send("Skipping to the next song.")
+            await player.skip()
+            self.messages.send(ctx.channel, "Skipping to the next song.")
 
         except Exception as e:
-            await ctx.send(f"An error occurred while skipping the song: {e}")
+            self.messages.send(ctx.channel, f"An error occurred while skipping the song: {e}")
 
     @commands.command(name='stop')
     async def stop(self, ctx):
         """Stops the current playback and clears the queue."""
         try:
-            if not self.voice_client:
-                await ctx.send("The bot is not currently playing music.")
+            player = self.players.peek(ctx.guild.id)
+            if player is None or not player.voice_client:
+                self.messages.send(ctx.channel, "The bot is not currently playing music.")
                 return
 
             # Stop the music and clear the queue
-            await self.music_player.stop(self.voice_client)
-            await ctx.send("Stopped the music and cleared the queue.")
+            await player.stop()
+            self.messages.send(ctx.channel, "Stopped the music and cleared the queue.")
 
-            # Disconnect the bot from the voice channel
-            await self.voice_client.disconnect()
-            self.voice_client = None
+            # Disconnect the bot from the voice channel and free the guild's player
+            await self.players.remove(ctx.guild.id)
 
         except Exception as e:
-            await ctx.send(f"An error occurred while stopping the music: {e}")
+            self.messages.send(ctx.channel, f"An error occurred while stopping the music: {e}")
 
     @commands.command(name='pause')
     async def pause(self, ctx):
         """Pauses the current playback."""
         try:
-            if not self.voice_client:
-                await ctx.send("The bot is not currently playing music.")
+            player = self.players.peek(ctx.guild.id)
+            if player is None or not player.voice_client:
+                self.messages.send(ctx.channel, "The bot is not currently playing music.")
                 return
 
             # Pause the music
-            await self.music_player.pause(self.voice_client)
-            await ctx.send("Paused the music.")
+            await player.pause()
+            self.messages.send(ctx.channel, "Paused the music.")
 
         except Exception as e:
-            await ctx.send(f"An error occurred while pausing the music: {e}")
+            self.messages.send(ctx.channel, f"An error occurred while pausing the music: {e}")
 
     @commands.command(name='resume')
     async def resume(self, ctx):
         """Resumes the paused playback."""
         try:
-            if not self.voice_client:
-                await ctx.send("The bot is not currently playing music.")
+            player = self.players.peek(ctx.guild.id)
+            if player is None or not player.voice_client:
+                self.messages.send(ctx.channel, "The bot is not currently playing music.")
                 return
 
             # Resume the music
-            await self.music_player.resume(self.voice_client)
-            await ctx.send("Resumed the music.")
+            await player.resume()
+            self.messages.send(ctx.channel, "Resumed the music.")
 
         except Exception as e:
-            await ctx.send(f"An error occurred while resuming the music: {e}")
+            self.messages.send(ctx.channel, f"An error occurred while resuming the music: {e}")
 
     @commands.command(name='queue')
-    async def queue(self, ctx):
-        """Displays the current music queue."""
+    async def queue(self, ctx, page: int = 1):
+        """Displays one page of the current music queue.
+
+        Args:
+            ctx (discord.ext.commands.Context): The context of the command.
+            page (int): The page to show, starting at 1.
+        """
+        try:
+            # Fetching the player restores a queue saved before a restart
+            player = await self.players.get(ctx.guild.id)
+            if not player.queue:
+                self.messages.send(ctx.channel, "The queue is empty.")
+                return
+
+            pages = player.queue.pages(QUEUE_PAGE_SIZE)
+            page = max(1, min(page, pages))
+
+            # Only the visible page is formatted; titles are shortened to stay under the message limit
+            start = (page - 1) * QUEUE_PAGE_SIZE
+            lines = [f"**Queue** ({len(player.queue)} songs, page {page}/{pages}):"]
+            for i, song in enumerate(player.queue.page(page - 1, QUEUE_PAGE_SIZE), start + 1):
+                lines.append(f"{i}. {song.title[:80]} by {(song.artist or 'Unknown')[:40]}")
+
+            self.messages.send(ctx.channel, "\n".join(lines))
+
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while displaying the queue: {e}")
+
+    @commands.command(name='remove')
+    async def remove(self, ctx, position: int):
+        """Removes a song from the queue.
+
+        Args:
+            ctx (discord.ext.commands.Context): The context of the command.
+            position (int): The song's position in the queue, starting at 1.
+        """
+        try:
+            player = await self.players.get(ctx.guild.id)
+            if not player.queue:
+                self.messages.send(ctx.channel, "The queue is empty.")
+                return
+
+            song = player.queue.remove(position - 1)
+            self.messages.send(ctx.channel, f"Removed {song.title} from the queue.")
+
+        except IndexError as e:
+            self.messages.send(ctx.channel, str(e))
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while removing the song: {e}")
+
+    @commands.command(name='move')
+    async def move(self, ctx, source: int, destination: int):
+        """Moves a song to another position in the queue.
+
+        Args:
+            ctx (discord.ext.commands.Context): The context of the command.
+            source (int): The song's position in the queue, starting at 1.
+            destination (int): The position to move it to.
+        """
+        try:
+            player = await self.players.get(ctx.guild.id)
+            if not player.queue:
+                self.messages.send(ctx.channel, "The queue is empty.")
+                return
+
+            song = player.queue.move(source - 1, destination - 1)
+            player.schedule_prefetch()
+            self.messages.send(ctx.channel, f"Moved {song.title} to position {min(max(destination, 1), len(player.queue))}.")
+
+        except IndexError as e:
+            self.messages.send(ctx.channel, str(e))
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while moving the song: {e}")
+
+    @commands.command(name='shuffle')
+    async def shuffle(self, ctx):
+        """Shuffles the queue."""
+        try:
+            player = await self.players.get(ctx.guild.id)
+            if not player.queue:
+                self.messages.send(ctx.channel, "The queue is empty.")
+                return
+
+            player.queue.shuffle()
+            player.schedule_prefetch()
+            self.messages.send(ctx.channel, f"Shuffled {len(player.queue)} songs.")
+
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while shuffling the queue: {e}")
+
+    @commands.command(name='loop')
+    async def loop(self, ctx, mode: str = None):
+        """Sets whether the current song or the whole queue repeats.
+
+        Args:
+            ctx (discord.ext.commands.Context): The context of the command.
+            mode (str): 'off', 'song' or 'queue'; shows the current mode when omitted.
+        """
         try:
-            if not self.music_player.queue:
-                await ctx.send("The queue is empty.")
+            player = await self.players.get(ctx.guild.id)
+            if mode is None:
+                self.messages.send(ctx.channel, f"Loop mode is {player.loop}.")
                 return
 
-            # Build the queue message
-            queue_message = "**Queue:**\n"
-            for i, song in enumerate(self.music_player.queue):
-                queue_message += f"{i+1}. {song['title']} by {song['artist']}\n"
+            mode = mode.lower()
+            if mode not in ('off', 'song', 'queue'):
+                self.messages.send(ctx.channel, "Loop mode must be off, song or queue.")
+                return
 
-            await ctx.send(queue_message)
+            await player.set_loop(mode)
+            self.messages.send(ctx.channel, f"Loop mode set to {mode}.")
 
         except Exception as e:
-            await ctx.send(f"An error occurred while displaying the queue: {e}")
+            self.messages.send(ctx.channel, f"An error occurred while setting the loop mode: {e}")
 
     @commands.command(name='volume')
     async def volume(self, ctx, volume: int):
@@ -220,20 +379,140 @@ class MusicCog(commands.Cog):
             volume (int): The new volume level (0-100).
         """
         try:
-            if not self.voice_client:
-                await ctx.send("The bot is not currently playing music.")
+            player = self.players.peek(ctx.guild.id)
+            if player is None or not player.voice_client:
+                self.messages.send(ctx.channel, "The bot is not currently playing music.")
                 return
 
             if volume < 0 or volume > 100:
-                await ctx.send("Volume must be between 0 and 100.")
+                self.messages.send(ctx.channel, "Volume must be between 0 and 100.")
                 return
 
             # Set the new volume
-            await self.music_player.set_volume(self.voice_client, volume / 100)
-            await ctx.send(f"Volume set to {volume}%")
+            await player.set_volume(volume / 100)
+            self.messages.send(ctx.channel, f"Volume set to {volume}%")
+
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while setting the volume: {e}")
+
+    @commands.command(name='gain')
+    async def gain(self, ctx, gain: float):
+        """Applies a gain filter, which unlike the volume can also make songs louder.
+
+        Args:
+            ctx (discord.ext.commands.Context): The context of the command.
+            gain (float): The gain in dB, or 0 to turn it off.
+        """
+        try:
+            if abs(gain) > FILTER_MAX_GAIN_DB:
+                self.messages.send(ctx.channel, f"Gain must be between -{FILTER_MAX_GAIN_DB} and {FILTER_MAX_GAIN_DB} dB.")
+                return
+
+            player = await self.players.get(ctx.guild.id)
+            player.filters.set_gain(gain)
+            await player.apply_filters()
+            self.messages.send(ctx.channel, f"Gain set to {gain:+g} dB.")
+
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while setting the gain: {e}")
+
+    @commands.command(name='bassboost')
+    async def bass_boost(self, ctx, boost: float):
+        """Boosts the bass.
+
+        Args:
+            ctx (discord.ext.commands.Context): The context of the command.
+            boost (float): The boost in dB, or 0 to turn it off.
+        """
+        try:
+            if boost < 0 or boost > BASS_BOOST_MAX_DB:
+                self.messages.send(ctx.channel, f"Bass boost must be between 0 and {BASS_BOOST_MAX_DB} dB.")
+                return
+
+            player = await self.players.get(ctx.guild.id)
+            player.filters.set_bass(boost)
+            await player.apply_filters()
+            self.messages.send(ctx.channel, f"Bass boost set to {boost:g} dB.")
+
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while setting the bass boost: {e}")
+
+    @commands.command(name='eq')
+    async def equalizer(self, ctx, band: int, gain: float):
+        """Boosts or cuts one equalizer band.
+
+        Args:
+            ctx (discord.ext.commands.Context): The context of the command.
+            band (int): The band number (1 for the lowest frequencies).
+            gain (float): The boost or cut in dB.
+        """
+        try:
+            if band < 1 or band > len(EQ_BANDS):
+                bands = ", ".join(f"{i + 1} ({frequency} Hz)" for i, frequency in enumerate(EQ_BANDS))
+                self.messages.send(ctx.channel, f"Band must be one of: {bands}.")
+                return
+            if abs(gain) > EQ_MAX_GAIN_DB:
+                self.messages.send(ctx.channel, f"Gain must be between -{EQ_MAX_GAIN_DB} and {EQ_MAX_GAIN_DB} dB.")
+                return
+
+            player = await self.players.get(ctx.guild.id)
+            player.filters.set_band(band - 1, gain)
+            await player.apply_filters()
+            self.messages.send(ctx.channel, f"Band {band} ({EQ_BANDS[band - 1]} Hz) set to {gain:+g} dB.")
+
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while setting the equalizer: {e}")
+
+    @commands.command(name='normalize')
+    async def normalize(self, ctx, enabled: bool):
+        """Turns loudness normalization on or off.
+
+        Args:
+            ctx (discord.ext.commands.Context): The context of the command.
+            enabled (bool): Whether to normalize (on/off).
+        """
+        try:
+            player = await self.players.get(ctx.guild.id)
+            player.filters.set_normalize(enabled)
+            await player.apply_filters()
+            self.messages.send(ctx.channel, f"Loudness normalization {'enabled' if enabled else 'disabled'}.")
+
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while setting normalization: {e}")
+
+    @commands.command(name='resetfilters')
+    async def reset_filters(self, ctx):
+        """Turns off every audio filter."""
+        try:
+            player = self.players.peek(ctx.guild.id)
+            if player is not None:
+                player.filters.reset()
+                await player.apply_filters()
+            self.messages.send(ctx.channel, "Audio filters reset.")
+
+        except Exception as e:
+            self.messages.send(ctx.channel, f"An error occurred while resetting the filters: {e}")
+
+    @commands.command(name='lyrics')
+    async def lyrics(self, ctx):
+        """Displays the lyrics for the currently playing song."""
+        try:
+            player = self.players.peek(ctx.guild.id)
+            if player is None or player.current is None:
+                self.messages.send(ctx.channel, "The bot is not currently playing music.")
+                return
+
+            song = player.current
+            lyrics = await self.lyrics.get_lyrics(song.title, song.artist)
+            if not lyrics:
+                self.messages.send(ctx.channel, f"No lyrics found for {song.title} by {song.artist}.")
+                return
+
+            for embed in lyrics_embeds(song.title, song.artist, lyrics):
+                self.messages.send(ctx.channel, embed=embed)
 
         except Exception as e:
-            await ctx.send(f"An error occurred while setting the volume: {e}")
+            self.messages.send(ctx.channel, f"An error occurred while fetching the lyrics: {e}")
 
 def setup(bot):
     """Setup function for the MusicCog."""
@@ -1,4 +1,7 @@
 import os
+import logging
+
+import discord
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -24,6 +27,159 @@ GENIUS_API_KEY = os.getenv('GENIUS_API_KEY')
 # DATABASE_URL = 'mongodb://localhost:27017/'
 # DATABASE_NAME = 'musicbot'
 
+# Track Resolution
+# Worker pool used for blocking metadata extraction ('thread' or 'process')
+RESOLVER_EXECUTOR = os.getenv('RESOLVER_EXECUTOR', 'thread')
+RESOLVER_MAX_WORKERS = int(os.getenv('RESOLVER_MAX_WORKERS', '4'))
+# Maximum number of concurrent extractions for a single guild
+RESOLVER_GUILD_CONCURRENCY = 2
+# Seconds before a pending extraction is cancelled
+RESOLVER_TIMEOUT = 15
+
+# Track Cache
+# Maximum number of tracks kept in memory
+TRACK_CACHE_SIZE = 2048
+# Seconds a resolved track stays cached when its stream URL has no expiry
+TRACK_CACHE_TTL = 6 * 60 * 60
+# Seconds before a stream URL's expiry at which it is treated as stale
+STREAM_EXPIRY_MARGIN = 300
+
+# Guild Players
+# Seconds a guild's player may sit idle before it disconnects and is freed
+PLAYER_IDLE_TIMEOUT = 300
+# Seconds between idle player sweeps
+PLAYER_SWEEP_INTERVAL = 60
+
+# Number of queued songs whose stream URLs are resolved ahead of playback
+PREFETCH_DEPTH = 3
+# Songs shown per page of /queue
+QUEUE_PAGE_SIZE = 10
+
+# API Clients
+# Requests per second allowed against each provider's API
+SPOTIFY_RATE_LIMIT = 10
+SOUNDCLOUD_RATE_LIMIT = 5
+GENIUS_RATE_LIMIT = 5
+# Times a rate-limited request is retried before giving up
+API_MAX_RETRIES = 3
+# Keep-alive connections kept per API host
+CLIENT_POOL_SIZE = 10
+# Seconds before expiry at which OAuth tokens are refreshed
+TOKEN_REFRESH_MARGIN = 120
+
+# Chat Messages
+# Seconds updates for a channel are held so they can be sent as one message
+MESSAGE_COALESCE_WINDOW = 0.5
+# Messages per second allowed in each channel, and how many may go out at once (Discord allows 5 per 5 seconds)
+CHANNEL_MESSAGE_RATE = 1
+CHANNEL_MESSAGE_BURST = 5
+# Requests per second allowed across every channel
+GLOBAL_MESSAGE_RATE = 50
+
+# Playlist Ingestion
+# Seconds between progress edits on the playlist message
+INGEST_PROGRESS_INTERVAL = 2
+
+# Lyrics
+# Maximum number of lyrics kept in memory
+LYRICS_CACHE_SIZE = 512
+# Seconds found lyrics stay cached
+LYRICS_CACHE_TTL = 30 * 24 * 60 * 60
+# Seconds a lyrics miss stays cached before Genius is asked again
+LYRICS_MISS_TTL = 24 * 60 * 60
+
+# Database Access
+# Read connections kept open for concurrent queries
+DB_READ_POOL_SIZE = 4
+# Maximum number of queued writes committed together
+DB_WRITE_BATCH_SIZE = 100
+
+# Audio Streaming
+# FFmpeg reconnects dropped HTTP streams instead of ending the song
+FFMPEG_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+FFMPEG_OPTIONS = '-vn'
+# 20 ms frames read ahead of playback (250 frames = 5 seconds)
+AUDIO_READ_AHEAD = 250
+# Seconds to wait for a late frame before sending silence instead
+AUDIO_UNDERRUN_WAIT = 0.02
+
+# Audio Filters
+# Centre frequencies (Hz) of the equalizer bands and their quality factor
+EQ_BANDS = (60, 230, 910, 3600, 14000)
+EQ_Q = 1.0
+EQ_MAX_GAIN_DB = 12
+# Corner frequency (Hz) and maximum boost of the bass boost shelf
+BASS_BOOST_FREQUENCY = 120
+BASS_BOOST_MAX_DB = 20
+# Maximum gain the gain filter applies
+FILTER_MAX_GAIN_DB = 12
+# Loudness normalization target level (RMS dBFS) and the most gain it may add
+NORMALIZE_TARGET_DBFS = -18
+NORMALIZE_MAX_GAIN_DB = 12
+# Fraction of the way to the target gain moved each frame
+NORMALIZE_SMOOTHING = 0.02
+
+# Loudness Analysis
+# Loudness (LUFS) tracks are normalized to, and the highest peak (dBTP) the gain may push them to
+LOUDNESS_TARGET_LUFS = -14
+LOUDNESS_PEAK_CEILING = -1
+# Tracks measured at the same time
+LOUDNESS_ANALYSIS_CONCURRENCY = 2
+# Maximum number of track gains kept in memory
+LOUDNESS_CACHE_SIZE = 4096
+
+# Local Audio Cache
+# Directory for cached Opus audio; leave unset to stream every play
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR')
+AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+# Plays after which a track is downloaded into the cache
+AUDIO_CACHE_MIN_PLAYS = 2
+# Tracks downloaded at the same time
+AUDIO_CACHE_FILL_CONCURRENCY = 1
+# Bitrate used when a non-Opus stream has to be encoded for the cache
+AUDIO_CACHE_BITRATE = '128k'
+
+# Playback State
+# Changes logged per guild before they are compacted into a single snapshot
+STATE_COMPACT_EVERY = 100
+
+# Sharding
+# Total number of shards; leave unset for one unsharded bot (or Discord's recommendation with --sharded)
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+# Worker processes the shards are split between
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', 1))
+# Seconds before a crashed worker is restarted, doubling after each quick crash up to the maximum
+WORKER_RESTART_DELAY = 5
+WORKER_RESTART_MAX_DELAY = 300
+# Seconds between metrics reports from workers to the supervisor
+METRICS_REPORT_INTERVAL = 15
+
+# Media Workers
+# Processes that extract tracks and decode, filter and encode audio outside the bot's process; 0 keeps it all in-process
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', '0'))
+# Calls, such as track extractions, each media worker runs at once besides its streams
+MEDIA_WORKER_THREADS = 4
+# Encoded frames a stream may get ahead of playback (50 frames = 1 second); volume and filter changes lag by as much
+MEDIA_RING_FRAMES = 50
+# Seconds before a media worker that keeps crashing is restarted, doubling after each quick crash up to the maximum
+MEDIA_WORKER_RESTART_DELAY = 1
+MEDIA_WORKER_RESTART_MAX_DELAY = 30
+# Times a stream is reopened on a new worker after its worker dies
+MEDIA_STREAM_MAX_RECOVERIES = 3
+
+# Instrumentation
+# Address and port of the Prometheus metrics endpoint; a port of 0 disables it (worker N of a sharded bot adds N)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9400'))
+# Seconds between event loop lag measurements
+LOOP_LAG_INTERVAL = 0.5
+# Set LOOP_WATCHDOG=1 to capture the stack whenever the event loop stalls for longer than the threshold (seconds)
+LOOP_WATCHDOG = os.getenv('LOOP_WATCHDOG', '0') == '1'
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv('LOOP_WATCHDOG_THRESHOLD', '0.1'))
+# Call sites listed in each watchdog report, and seconds between reports
+LOOP_WATCHDOG_TOP = 10
+LOOP_WATCHDOG_REPORT_INTERVAL = 300
+
 # Default Command Prefix
 COMMAND_PREFIX = '/'
 
@@ -39,5 +195,4 @@ LOGGING_LEVEL = logging.INFO
 
 # Other Settings (Optional)
 # - Playlist Saving/Loading Settings (e.g., file path)
-# - Audio Filters (e.g., bass boost, equalizer settings)
-# - Additional Features (e.g., random shuffle, looping)
\ No newline at end of file
+# - Additional Features
\ No newline at end of file
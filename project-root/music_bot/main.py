@@ -1,6 +1,9 @@
+import argparse
 import discord
 from discord.ext import commands
+import functools
 import logging
+import sys
 
 import os
 from dotenv import load_dotenv
@@ -8,36 +11,182 @@ from dotenv import load_dotenv
 from music_bot.config import *
 from music_bot.cogs.music import MusicCog
 from music_bot.cogs.admin import AdminCog
+from music_bot.utils.cache import track_cache
+from music_bot.utils.clients import ApiClients
+from music_bot.utils.async_database import AsyncDatabase
+from music_bot.utils.cluster import FATAL_EXIT_CODE, Supervisor, WorkerLink
+from music_bot.utils.database import DATABASE_URL
+from music_bot.utils.instrumentation import LoopLagMonitor, LoopWatchdog, MetricsServer, instrument_commands
+from music_bot.utils.messages import MessageScheduler
+from music_bot.utils.settings import InvalidationBus, SettingsCache, prefix_resolver
 
 load_dotenv()
 
 # Set up logging
 logging.basicConfig(level=LOGGING_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Create Discord bot instance
-intents = discord.Intents.default()
-intents.members = True
-intents.message_content = True
 
-bot = commands.Bot(command_prefix=COMMAND_PREFIX, intents=intents)
+def create_bot(sharded=False, shard_count=None, shard_ids=None, bus=None, audio_cache_dir=AUDIO_CACHE_DIR,
+               cluster=None, metrics_port=METRICS_PORT):
+    """Builds the bot with its cogs and shared services.
 
-# Load cogs
-bot.add_cog(MusicCog(bot))
-bot.add_cog(AdminCog(bot))
+    Args:
+        sharded (bool): Whether to run as an AutoShardedBot.
+        shard_count (int): The total number of shards, or None to use Discord's recommendation.
+        shard_ids (list): The shards this process runs, or None for all of them.
+        bus (InvalidationBus): The bus cache invalidations are shared on between processes.
+        audio_cache_dir (str): The directory of the local audio cache, or None to disable it.
+        cluster (WorkerLink): The link to the supervisor of a multi-process deployment, if any.
+        metrics_port (int): The port of the Prometheus metrics endpoint, or 0 to disable it.
 
-# Set bot activity
-bot.activity = discord.Activity(type=ACTIVITY_TYPE, name=ACTIVITY_NAME)
+    Returns:
+        commands.Bot: The bot, ready to run.
+    """
+    # Persist resolved tracks and lyrics across restarts when a database is configured
+    database = AsyncDatabase() if DATABASE_URL else None
+    track_cache.database = database
 
-@bot.event
-async def on_ready():
-    """Event handler for when the bot is ready."""
-    logging.info(f'Logged in as {bot.user.name} (ID: {bot.user.id})')
+    # Guild settings, user preferences and bot settings are answered from memory
+    settings = SettingsCache(database, bus)
 
-# Run the bot
-if __name__ == '__main__':
+    # Create Discord bot instance
+    intents = discord.Intents.default()
+    intents.members = True
+    intents.message_content = True
+
+    # Each guild's prefix is looked up from memory on every message
+    command_prefix = prefix_resolver(settings, COMMAND_PREFIX)
+    if sharded:
+        bot = commands.AutoShardedBot(command_prefix=command_prefix, intents=intents, shard_count=shard_count,
+                                      shard_ids=shard_ids)
+    else:
+        bot = commands.Bot(command_prefix=command_prefix, intents=intents)
+
+    # API clients are shared for the lifetime of the process
+    clients = ApiClients()
+
+    # Every cog posts through one scheduler, so each channel has a single set of rate limits
+    messages = MessageScheduler()
+
+    # Load cogs
+    bot.add_cog(MusicCog(bot, clients, database, settings, audio_cache_dir, messages))
+    bot.add_cog(AdminCog(bot, settings, cluster, messages))
+
+    # Commands, the event loop and audio are always measured; see /stats and the metrics endpoint
+    instrument_commands(bot)
+    LoopLagMonitor().start(bot.loop)
+    if LOOP_WATCHDOG:
+        # Logs the code behind heartbeat warnings and voice stutter
+        LoopWatchdog().start(bot.loop)
+    if metrics_port:
+        bot.loop.create_task(MetricsServer(port=metrics_port).start())
+
+    # Set bot activity
+    bot.activity = discord.Activity(type=ACTIVITY_TYPE, name=ACTIVITY_NAME)
+
+    close_bot = bot.close
+
+    async def close():
+        # Cogs are unloaded first, so nothing is left using the clients when their connections close
+        await close_bot()
+        clients.close()
+
+    bot.close = close
+
+    @bot.event
+    async def on_ready():
+        """Event handler for when the bot is ready."""
+        logging.info(f'Logged in as {bot.user.name} (ID: {bot.user.id})')
+        # Load every guild's prefix in one query so messages never wait on the database
+        prefixes = await settings.warm_guild_setting('prefix', [guild.id for guild in bot.guilds])
+        logging.info(f'Loaded custom prefixes for {len(prefixes)} guilds')
+
+    return bot
+
+
+def use_gateway(url):
+    """Sends the bot's REST and gateway traffic to another server, such as utils/fake_gateway.py.
+
+    Args:
+        url (str): The base URL of the server.
+    """
+    version = discord.http.Route.BASE.rsplit('/', 1)[-1]
+    discord.http.Route.BASE = f"{url.rstrip('/')}/api/{version}"
+
+
+def run_bot(bot, token=DISCORD_TOKEN):
+    """Runs the bot until it is closed.
+
+    Args:
+        bot (commands.Bot): The bot to run.
+        token (str): The bot token.
+
+    Returns:
+        bool: False if the bot could not log in.
+    """
     try:
-        bot.run(DISCORD_TOKEN)
+        bot.run(token)
     except discord.errors.LoginFailure:
         logging.error('Invalid Discord token. Please check your .env file.')
+        return False
     except Exception as e:
-        logging.error(f'An error occurred while running the bot: {e}')
\ No newline at end of file
+        logging.error(f'An error occurred while running the bot: {e}')
+    return True
+
+
+def run_worker(worker_id, shard_ids, shard_count, connection, gateway=None):
+    """Runs one worker process of a sharded deployment.
+
+    Args:
+        worker_id (int): The worker's index.
+        shard_ids (list): The shards the worker runs.
+        shard_count (int): The total number of shards.
+        connection (multiprocessing.connection.Connection): The worker's end of the pipe to the supervisor.
+        gateway (str): The base URL of a gateway to use instead of Discord's, if any.
+    """
+    token = DISCORD_TOKEN
+    if gateway:
+        use_gateway(gateway)
+        # The fake gateway accepts any token
+        token = token or 'fake-token'
+    bus = InvalidationBus()
+    link = WorkerLink(connection, bus)
+    # The audio cache index is not shared between processes, so each worker keeps its own
+    audio_cache_dir = os.path.join(AUDIO_CACHE_DIR, f'worker-{worker_id}') if AUDIO_CACHE_DIR else None
+    # Each worker serves its own metrics next to the others'
+    metrics_port = METRICS_PORT + worker_id if METRICS_PORT else 0
+    bot = create_bot(sharded=True, shard_count=shard_count, shard_ids=shard_ids, bus=bus,
+                     audio_cache_dir=audio_cache_dir, cluster=link, metrics_port=metrics_port)
+
+    # bot.run already logs out on SIGTERM from the supervisor; do the same if the supervisor goes away
+    link.start(bot.loop, on_lost=lambda: bot.loop.create_task(bot.close()))
+    if not run_bot(bot, token):
+        sys.exit(FATAL_EXIT_CODE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the music bot.')
+    parser.add_argument('--sharded', action='store_true', help='Run as an AutoShardedBot in this process.')
+    parser.add_argument('--shards', type=int, default=SHARD_COUNT, help='Total number of shards.')
+    parser.add_argument('--workers', type=int, default=SHARD_WORKERS,
+                        help='Worker processes to split the shards between; needs --shards.')
+    parser.add_argument('--gateway', help="Base URL of a fake gateway to connect to instead of Discord's.")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        if args.shards is None:
+            parser.error('--workers needs --shards (or SHARD_COUNT) to split them between processes')
+        target = functools.partial(run_worker, gateway=args.gateway)
+        Supervisor(target, args.shards, args.workers).run()
+        return
+
+    token = DISCORD_TOKEN
+    if args.gateway:
+        use_gateway(args.gateway)
+        token = token or 'fake-token'
+    run_bot(create_bot(sharded=args.sharded or args.shards is not None, shard_count=args.shards), token)
+
+
+# Run the bot
+if __name__ == '__main__':
+    main()
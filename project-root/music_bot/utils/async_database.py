@@ -0,0 +1,162 @@
+import asyncio
+import concurrent.futures
+import logging
+import time
+
+from music_bot.config import DB_READ_POOL_SIZE, DB_WRITE_BATCH_SIZE
+from music_bot.utils.database import Database, open_database
+from music_bot.utils.metrics import histogram
+
+
+def _latency(name):
+    return histogram(f'db_{name}_latency_seconds', f'Latency of Database.{name}, including queueing.')
+
+
+def _write_op(name):
+    def op(self, *args):
+        return self._write(name, *args)
+    op.__name__ = name
+    op.__doc__ = getattr(Database, name).__doc__
+    return op
+
+
+def _read_op(name):
+    async def op(self, *args):
+        return await self._read(name, *args)
+    op.__name__ = name
+    op.__doc__ = getattr(Database, name).__doc__
+    return op
+
+
+class AsyncDatabase:
+    """
+    An asyncio front end for a Database backend that never blocks the event loop.
+
+    Writes are queued to a single writer thread, which applies everything that
+    is pending and commits it together. Write methods return a future: await it
+    to wait for the commit, or drop it to fire and forget. Reads run on a small
+    pool of connections, so they may not yet see writes that are still queued.
+    Each operation records its latency in a ``db_<method>_latency_seconds`` histogram.
+    """
+
+    def __init__(self, writer=None, pool_size=DB_READ_POOL_SIZE, batch_size=DB_WRITE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.writer = writer or open_database(autocommit=False)
+        # Backends that are safe to share hand back themselves here
+        readers = [self.writer.open_reader() for _ in range(pool_size)]
+        self._connections = [self.writer, *readers]
+        self._readers = asyncio.Queue()
+        for reader in readers:
+            self._readers.put_nowait(reader)
+        self._read_executor = concurrent.futures.ThreadPoolExecutor(pool_size, thread_name_prefix='db-reader')
+        self._write_executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='db-writer')
+        self._writes = asyncio.Queue()
+        self._writer_task = None
+        self._latency = {}
+
+    def _observe(self, name, started_at):
+        metric = self._latency.get(name)
+        if metric is None:
+            metric = self._latency[name] = _latency(name)
+        metric.observe(time.perf_counter() - started_at)
+
+    def _write(self, name, *args):
+        loop = asyncio.get_running_loop()
+        if self._writer_task is None:
+            self._writer_task = loop.create_task(self._run_writer())
+        future = loop.create_future()
+        future.add_done_callback(_log_write_error)
+        self._writes.put_nowait((name, args, future, time.perf_counter()))
+        return future
+
+    async def _run_writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._writes.get()]
+            while len(batch) < self.batch_size and not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+            try:
+                results = await loop.run_in_executor(self._write_executor, self._apply, batch)
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+            for (name, args, future, started_at), (ok, value) in zip(batch, results):
+                self._observe(name, started_at)
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _apply(self, batch):
+        # Runs on the writer thread: one commit for the whole batch
+        results = []
+        for name, args, future, started_at in batch:
+            try:
+                results.append((True, getattr(self.writer, name)(*args)))
+            except Exception as e:
+                results.append((False, e))
+        self.writer.commit()
+        return results
+
+    async def _read(self, name, *args):
+        started_at = time.perf_counter()
+        reader = await self._readers.get()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._read_executor, getattr(reader, name), *args)
+        finally:
+            self._readers.put_nowait(reader)
+            self._observe(name, started_at)
+
+    async def flush(self):
+        """
+        Waits until every write queued so far has been committed.
+        """
+        if self._writer_task is not None:
+            await self._write('commit')
+
+    async def close(self):
+        """
+        Commits queued writes and closes every connection.
+        """
+        await self.flush()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+        self._write_executor.shutdown()
+        self._read_executor.shutdown()
+        for database in {id(database): database for database in self._connections}.values():
+            database.close()
+
+    create_playlist = _write_op('create_playlist')
+    add_song_to_playlist = _write_op('add_song_to_playlist')
+    add_songs_to_playlist = _write_op('add_songs_to_playlist')
+    remove_song_from_playlist = _write_op('remove_song_from_playlist')
+    remove_songs_from_playlist = _write_op('remove_songs_from_playlist')
+    delete_playlist = _write_op('delete_playlist')
+    set_user_preference = _write_op('set_user_preference')
+    set_bot_setting = _write_op('set_bot_setting')
+    set_guild_setting = _write_op('set_guild_setting')
+    set_cached_track = _write_op('set_cached_track')
+    delete_cached_track = _write_op('delete_cached_track')
+    set_track_loudness = _write_op('set_track_loudness')
+    set_cached_lyrics = _write_op('set_cached_lyrics')
+    append_player_state = _write_op('append_player_state')
+    save_player_state = _write_op('save_player_state')
+
+    get_playlist = _read_op('get_playlist')
+    get_all_playlists = _read_op('get_all_playlists')
+    get_user_preference = _read_op('get_user_preference')
+    get_bot_setting = _read_op('get_bot_setting')
+    get_guild_setting = _read_op('get_guild_setting')
+    get_guild_settings = _read_op('get_guild_settings')
+    get_cached_track = _read_op('get_cached_track')
+    get_track_loudness = _read_op('get_track_loudness')
+    get_cached_lyrics = _read_op('get_cached_lyrics')
+    get_player_state = _read_op('get_player_state')
+
+
+def _log_write_error(future):
+    # Fire-and-forget writes would otherwise fail silently
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f'Database write failed: {future.exception()}')
@@ -0,0 +1,357 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import discord
+
+from music_bot.config import (
+    AUDIO_READ_AHEAD,
+    AUDIO_UNDERRUN_WAIT,
+    FFMPEG_BEFORE_OPTIONS,
+    FFMPEG_OPTIONS,
+    MEDIA_STREAM_MAX_RECOVERIES,
+)
+from music_bot.utils.audio_cache import CachedOpusSource
+from music_bot.utils.errors import MediaWorkerError
+from music_bot.utils.filters import FilterEngine
+from music_bot.utils.metrics import counter, histogram
+
+underruns = counter('audio_underruns_total', 'Frames the voice client asked for before the read-ahead buffer had one.')
+reencoded_streams = counter('audio_reencoded_streams_total', 'Streams decoded to PCM and encoded to Opus again.')
+passthrough_streams = counter('audio_passthrough_streams_total', 'Opus streams sent to Discord without decoding.')
+worker_streams = counter('audio_worker_streams_total', 'Streams decoded and encoded again by a media worker.')
+stream_recoveries = counter('audio_stream_recoveries_total', 'Streams reopened on another media worker after theirs died.')
+ring_stalls = counter('audio_ring_stalls_total', 'Frames a media worker held back because playback had not caught up.')
+frame_time = histogram('audio_frame_seconds', 'Time taken to hand the voice client one frame.',
+                       buckets=(0.0001, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05))
+send_jitter = histogram('voice_send_jitter_seconds', 'How far the gap between two frames sent to Discord was from 20 ms.',
+                        buckets=(0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25))
+ring_fill = histogram('audio_ring_fill_ratio', 'How full media worker frame rings are, sampled once a second.',
+                      buckets=(0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0))
+
+# 20 ms of silence, sent in place of a late frame so playback does not end early
+PCM_SILENCE = b'\x00' * discord.opus.Encoder.FRAME_SIZE
+OPUS_SILENCE = b'\xf8\xff\xfe'
+FRAME_SECONDS = 0.02
+# Frames between samples of a frame ring's fill level
+RING_SAMPLE_FRAMES = 50
+# Seconds between checks of an empty frame ring
+RING_POLL_INTERVAL = 0.005
+# A longer gap between two frames is a pause, not jitter
+JITTER_MAX_GAP = 0.5
+
+
+class BufferedAudioSource(discord.AudioSource):
+    """
+    Reads frames from another source ahead of playback on a background thread.
+
+    Up to ``read_ahead`` frames are buffered so network jitter does not reach
+    the voice client. When the buffer runs dry mid-stream, the next frame is
+    waited for briefly and silence is sent if it does not arrive; each such
+    underrun is counted on the source and in ``audio_underruns_total``.
+    """
+
+    def __init__(self, source, offset=0, read_ahead=AUDIO_READ_AHEAD, underrun_wait=AUDIO_UNDERRUN_WAIT):
+        self.source = source
+        self.offset = offset
+        self.read_ahead = read_ahead
+        self.underrun_wait = underrun_wait
+        self.frames = 0
+        self.underruns = 0
+        self._silence = OPUS_SILENCE if source.is_opus() else PCM_SILENCE
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        self._finished = False
+        self._closed = False
+        self._reader = threading.Thread(target=self._fill, name='audio-read-ahead', daemon=True)
+        self._reader.start()
+
+    def _fill(self):
+        try:
+            while True:
+                frame = self.source.read()
+                with self._condition:
+                    while len(self._buffer) >= self.read_ahead and not self._closed:
+                        self._condition.wait()
+                    if not frame or self._closed:
+                        return
+                    self._buffer.append(frame)
+                    self._condition.notify_all()
+        except Exception as e:
+            logging.error(f'Error reading audio stream: {e}')
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+
+    def read(self):
+        with self._condition:
+            if not self._buffer and not self._finished:
+                if self.frames:
+                    # The start of the stream is allowed to wait; later gaps are underruns
+                    self._condition.wait(self.underrun_wait)
+                else:
+                    self._condition.wait_for(lambda: self._buffer or self._finished)
+                if not self._buffer and not self._finished:
+                    self.underruns += 1
+                    underruns.inc()
+                    return self._silence
+            if not self._buffer:
+                return b''
+            frame = self._buffer.popleft()
+            self._condition.notify_all()
+        self.frames += 1
+        return frame
+
+    @property
+    def position(self):
+        """
+        float: Seconds into the track of the last frame handed to the voice client.
+        """
+        return self.offset + self.frames * FRAME_SECONDS
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self.source.cleanup()
+        if self.underruns:
+            logging.info(f'Stream ended after {self.frames} frames with {self.underruns} underruns')
+
+
+class FilterSource(discord.AudioSource):
+    """
+    Runs PCM frames through a guild's audio filters.
+
+    Frames pass through untouched while no filter is active, and changes to
+    the filters take effect from the next frame.
+    """
+
+    def __init__(self, original, filters, track_gain=None):
+        self.original = original
+        self.filters = filters
+        self.track_gain = track_gain
+        self.engine = None
+
+    def read(self):
+        frame = self.original.read()
+        if not frame or not self.filters.active:
+            return frame
+        if self.engine is None:
+            self.engine = FilterEngine(self.filters, self.track_gain)
+        return self.engine.process(frame)
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+class WorkerAudioSource(discord.AudioSource):
+    """
+    Plays Opus frames that a media worker decodes, filters and encodes.
+
+    Frames are read straight out of the worker's shared memory ring. Volume
+    and filter changes are sent to the worker and heard once the frames
+    already in the ring have played. If the worker dies, the frames it wrote
+    are played out and the stream is reopened on a new worker from where it
+    stopped, up to MEDIA_STREAM_MAX_RECOVERIES times.
+    """
+
+    def __init__(self, pool, url, volume=1.0, position=0, filters=None, track_gain=None, cached=False,
+                 underrun_wait=AUDIO_UNDERRUN_WAIT, max_recoveries=MEDIA_STREAM_MAX_RECOVERIES):
+        self.pool = pool
+        self.url = url
+        self.offset = position
+        self.filters = filters
+        self.track_gain = track_gain
+        self.cached = cached
+        self.underrun_wait = underrun_wait
+        self.max_recoveries = max_recoveries
+        self.frames = 0
+        self.underruns = 0
+        self.recoveries = 0
+        self._volume = volume
+        self._version = filters.version if filters is not None else None
+        self._stream = self._open()
+
+    def _open(self):
+        filters = self.filters.state() if self.filters is not None else None
+        return self.pool.open_stream(self.url, _before_options(self.position, self.cached), self._volume, filters,
+                                     self.track_gain)
+
+    @property
+    def volume(self):
+        """
+        float: The playback volume; setting it tells the worker.
+        """
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = max(value, 0.0)
+        self._stream.update(volume=self._volume)
+
+    @property
+    def position(self):
+        """
+        float: Seconds into the track of the last frame handed to the voice client.
+        """
+        return self.offset + self.frames * FRAME_SECONDS
+
+    def read(self):
+        if self.filters is not None and self.filters.version != self._version:
+            self._version = self.filters.version
+            self._stream.update(filters=self.filters.state())
+        # The start of the stream is allowed to wait; later gaps are underruns
+        deadline = time.monotonic() + self.underrun_wait if self.frames else None
+        while True:
+            ring = self._stream.ring
+            frame = ring.get()
+            if frame is not None:
+                break
+            if ring.ended:
+                return b''
+            if self._stream.lost and not self._recover():
+                return b''
+            if deadline is not None and time.monotonic() >= deadline:
+                self.underruns += 1
+                underruns.inc()
+                return OPUS_SILENCE
+            time.sleep(RING_POLL_INTERVAL)
+        self.frames += 1
+        if self.frames % RING_SAMPLE_FRAMES == 0:
+            ring_fill.observe(ring.fill)
+        return frame
+
+    def _recover(self):
+        if self.recoveries >= self.max_recoveries:
+            logging.error(f'Giving up on {self.url} after {self.recoveries} media worker failures')
+            return False
+        self.recoveries += 1
+        try:
+            stream = self._open()
+        except MediaWorkerError as e:
+            logging.error(f'Could not reopen {self.url}: {e}')
+            return False
+        self._close_stream()
+        self._stream = stream
+        stream_recoveries.inc()
+        return True
+
+    def _close_stream(self):
+        ring_stalls.inc(self._stream.ring.stalls)
+        self._stream.close()
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        if self._stream is not None:
+            self._close_stream()
+            self._stream = None
+        if self.underruns:
+            logging.info(f'Stream ended after {self.frames} frames with {self.underruns} underruns')
+
+
+class TimedSource(discord.AudioSource):
+    """
+    Measures the source the voice client plays.
+
+    Records how long each frame takes to produce and how far the gap since
+    the previous frame was from 20 ms, which is the jitter of the packets
+    sent to Discord. Both cost two clock reads and two histogram updates per
+    frame.
+    """
+
+    def __init__(self, original):
+        self.original = original
+        self._last_read = None
+
+    def read(self):
+        started_at = time.perf_counter()
+        frame = self.original.read()
+        frame_time.observe(time.perf_counter() - started_at)
+        if self._last_read is not None and started_at - self._last_read < JITTER_MAX_GAP:
+            send_jitter.observe(abs(started_at - self._last_read - FRAME_SECONDS))
+        self._last_read = started_at
+        return frame
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+def _before_options(position, cached):
+    # Reconnecting only applies to network streams
+    before_options = '' if cached else FFMPEG_BEFORE_OPTIONS
+    if position:
+        before_options = f'-ss {position:.2f} {before_options}'
+    return before_options
+
+
+def stream_position(source):
+    """Returns how far into its track a source from create_audio_source has played.
+
+    Args:
+        source (discord.AudioSource): The source playing on the voice client.
+
+    Returns:
+        float: The position in seconds, or 0 if the source does not track it.
+    """
+    while source is not None and not hasattr(source, 'position'):
+        source = getattr(source, 'original', None)
+    return source.position if source is not None else 0
+
+
+def create_audio_source(url, volume=1.0, codec=None, position=0, filters=None, track_gain=None, cached=False,
+                        pool=None):
+    """Opens a stream URL as a buffered source for the voice client.
+
+    Opus streams at full volume and without filters are passed through: FFmpeg
+    copies the Opus packets into an Ogg stream without decoding them, and
+    Discord sends them as they are. Anything else
+    is decoded to PCM, filtered, wrapped for volume control and encoded to Opus
+    again by the voice client, or by a media worker when a pool is given.
+    FFmpeg reconnects on dropped connections and the read-ahead buffer covers
+    the gap, so short network hiccups do not stop the song. Files from the
+    audio cache are passed through straight from a memory map.
+
+    Args:
+        url (str): The stream URL.
+        volume (float): The initial volume (0.0-1.0).
+        codec (str): The audio codec of the stream, if known.
+        position (float): Seconds into the track to start from.
+        filters (AudioFilters): The guild's audio filters, if any.
+        track_gain (float): The track's normalizing gain in dB, if it has been measured.
+        cached (bool): Whether url is an Ogg Opus file from the audio cache.
+        pool (MediaWorkerPool): Media workers to transcode on, if any.
+
+    Returns:
+        discord.AudioSource: The audio source, a PCMVolumeTransformer unless passed through or transcoded by a worker.
+    """
+    passthrough = (cached or codec == 'opus') and volume == 1.0 and not (filters is not None and filters.active)
+    if cached and passthrough:
+        passthrough_streams.inc()
+        return CachedOpusSource(url, offset=position)
+    if not passthrough and pool is not None:
+        worker_streams.inc()
+        return WorkerAudioSource(pool, url, volume, position, filters, track_gain, cached)
+    before_options = _before_options(position, cached)
+    if passthrough:
+        source = discord.FFmpegOpusAudio(url, codec='opus', before_options=before_options, options=FFMPEG_OPTIONS)
+        passthrough_streams.inc()
+        return BufferedAudioSource(source, offset=position)
+    source = discord.FFmpegPCMAudio(url, before_options=before_options, options=FFMPEG_OPTIONS)
+    reencoded_streams.inc()
+    source = BufferedAudioSource(source, offset=position)
+    if filters is not None:
+        source = FilterSource(source, filters, track_gain)
+    return discord.PCMVolumeTransformer(source, volume=volume)
@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+
+import discord
+from discord.oggparse import OggStream
+
+from music_bot.config import (
+    AUDIO_CACHE_BITRATE,
+    AUDIO_CACHE_DIR,
+    AUDIO_CACHE_FILL_CONCURRENCY,
+    AUDIO_CACHE_MAX_BYTES,
+    AUDIO_CACHE_MIN_PLAYS,
+    FFMPEG_BEFORE_OPTIONS,
+)
+from music_bot.utils.metrics import counter
+
+cache_hits = counter('audio_cache_hits_total', 'Songs played from the local audio cache.')
+cache_misses = counter('audio_cache_misses_total', 'Songs streamed because they were not in the local audio cache.')
+cache_fills = counter('audio_cache_fills_total', 'Tracks downloaded into the local audio cache.')
+cache_evictions = counter('audio_cache_evictions_total', 'Tracks removed from the local audio cache to stay under budget.')
+cache_corrupt = counter('audio_cache_corrupt_total', 'Cached tracks dropped because they failed the integrity check.')
+
+INDEX_FILE = 'index.json'
+# Names of the files the cache writes, finished or still downloading; nothing else in the directory is touched
+CACHE_FILE = re.compile(r'[0-9a-f]{40}\.opus(\.part)?')
+# Opus frames are 20 ms
+FRAME_SECONDS = 0.02
+# Play counts are kept for this many tracks to decide what is worth caching
+PLAY_COUNT_ENTRIES = 16384
+
+
+def _checksum(path):
+    checksum = 0
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            checksum = zlib.crc32(chunk, checksum)
+    return checksum
+
+
+class CachedOpusSource(discord.AudioSource):
+    """
+    Plays an Ogg Opus file from the audio cache without FFmpeg.
+
+    The file is memory-mapped and its Opus packets are handed to the voice
+    client as they are, so a cached song needs no network access and no decoding.
+    """
+
+    def __init__(self, path, offset=0):
+        self.offset = offset
+        self.frames = 0
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._packets = OggStream(self._map).iter_packets()
+        # Skip to the requested position one packet at a time
+        for _ in range(int(offset / FRAME_SECONDS)):
+            if next(self._packets, None) is None:
+                break
+
+    @property
+    def position(self):
+        """
+        float: Seconds into the track of the last packet handed to the voice client.
+        """
+        return self.offset + self.frames * FRAME_SECONDS
+
+    def read(self):
+        packet = next(self._packets, b'')
+        if packet:
+            self.frames += 1
+        return packet
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._packets = iter(())
+        self._map.close()
+        self._file.close()
+
+
+class AudioCache:
+    """
+    An on-disk cache of encoded Opus audio, keyed by track ID.
+
+    A track is downloaded in the background the second time it is played
+    (AUDIO_CACHE_MIN_PLAYS), remuxed or encoded to Ogg Opus. When the cache
+    grows past its byte budget the least frequently played tracks are removed,
+    the least recently played first among equals. Each file's CRC is stored in
+    the index and checked the first time the file is used after a restart.
+    """
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES, min_plays=AUDIO_CACHE_MIN_PLAYS,
+                 concurrency=AUDIO_CACHE_FILL_CONCURRENCY):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        os.makedirs(directory, exist_ok=True)
+        self._entries = self._load_index()
+        self._verified = set()
+        self._plays = OrderedDict()
+        self._filling = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @property
+    def size(self):
+        """
+        int: The bytes used by cached tracks.
+        """
+        return sum(entry['size'] for entry in self._entries.values())
+
+    def _path(self, track_id):
+        return os.path.join(self.directory, hashlib.sha1(track_id.encode()).hexdigest() + '.opus')
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            entries = {}
+        # Drop entries whose file is gone or truncated, and cache files the index does not know about
+        entries = {
+            track_id: entry for track_id, entry in entries.items()
+            if os.path.exists(self._path(track_id)) and os.path.getsize(self._path(track_id)) == entry['size']
+        }
+        known = {os.path.basename(self._path(track_id)) for track_id in entries}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name not in known and CACHE_FILE.fullmatch(name) and os.path.isfile(path):
+                os.remove(path)
+        return entries
+
+    def _save_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self._entries, file)
+        os.replace(path + '.tmp', path)
+
+    def _remove(self, track_id):
+        self._entries.pop(track_id, None)
+        self._verified.discard(track_id)
+        try:
+            os.remove(self._path(track_id))
+        except FileNotFoundError:
+            pass
+
+    async def lookup(self, track_id):
+        """
+        Returns the cached file of a track and records the play.
+
+        Args:
+            track_id (str): The canonical track ID.
+
+        Returns:
+            str: The path of the cached Ogg Opus file, or None if the track is not cached.
+        """
+        entry = self._entries.get(track_id)
+        if entry is None:
+            cache_misses.inc()
+            return None
+        path = self._path(track_id)
+        if track_id not in self._verified:
+            try:
+                checksum = await asyncio.to_thread(_checksum, path)
+            except OSError:
+                checksum = None
+            if checksum != entry['crc32']:
+                cache_corrupt.inc()
+                logging.warning(f'Dropping corrupt cached audio for {track_id}')
+                self._remove(track_id)
+                await asyncio.to_thread(self._save_index)
+                return None
+            self._verified.add(track_id)
+        entry['hits'] += 1
+        entry['last_used'] = time.time()
+        cache_hits.inc()
+        return path
+
+    def record_play(self, track_id, url, codec=None):
+        """
+        Counts a streamed play and starts caching the track once it is played often enough.
+
+        Args:
+            track_id (str): The canonical track ID.
+            url (str): The stream URL the track is playing from.
+            codec (str): The audio codec of the stream, if known.
+        """
+        plays = self._plays.pop(track_id, 0) + 1
+        self._plays[track_id] = plays
+        while len(self._plays) > PLAY_COUNT_ENTRIES:
+            self._plays.popitem(last=False)
+        if plays >= self.min_plays and track_id not in self._entries and track_id not in self._filling:
+            self._filling[track_id] = asyncio.get_running_loop().create_task(self._fill(track_id, url, codec, plays))
+
+    async def _fill(self, track_id, url, codec, plays):
+        path = self._path(track_id)
+        partial = path + '.part'
+        try:
+            async with self._semaphore:
+                # Opus is copied as it is; anything else is encoded once here instead of on every play
+                audio = ['-c:a', 'copy'] if codec == 'opus' else ['-c:a', 'libopus', '-b:a', AUDIO_CACHE_BITRATE]
+                process = await asyncio.create_subprocess_exec(
+                    'ffmpeg', '-hide_banner', '-loglevel', 'error', *FFMPEG_BEFORE_OPTIONS.split(), '-i', url,
+                    '-vn', *audio, '-ar', '48000', '-f', 'opus', '-y', partial,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                try:
+                    _, stderr = await process.communicate()
+                except asyncio.CancelledError:
+                    process.kill()
+                    raise
+                if process.returncode != 0:
+                    raise RuntimeError(stderr.decode(errors='replace').strip())
+
+            size = os.path.getsize(partial)
+            if size > self.max_bytes:
+                return
+            checksum = await asyncio.to_thread(_checksum, partial)
+            os.replace(partial, path)
+            self._entries[track_id] = {'size': size, 'crc32': checksum, 'hits': plays, 'last_used': time.time()}
+            self._verified.add(track_id)
+            cache_fills.inc()
+            self._evict()
+            await asyncio.to_thread(self._save_index)
+        except Exception as e:
+            logging.error(f'Error caching audio for {track_id}: {e}')
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+            del self._filling[track_id]
+
+    def _evict(self):
+        size = self.size
+        while size > self.max_bytes and self._entries:
+            track_id = min(self._entries, key=lambda key: (self._entries[key]['hits'], self._entries[key]['last_used']))
+            size -= self._entries[track_id]['size']
+            self._remove(track_id)
+            cache_evictions.inc()
+
+    def close(self):
+        """
+        Cancels downloads in progress and saves the index with the latest play counts.
+        """
+        for task in self._filling.values():
+            task.cancel()
+        self._save_index()
@@ -0,0 +1,262 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+from music_bot.config import STREAM_EXPIRY_MARGIN, TRACK_CACHE_SIZE, TRACK_CACHE_TTL
+from music_bot.utils.metrics import counter
+
+memory_hits = counter('track_cache_memory_hits_total', 'Track lookups served from the in-memory tier.')
+disk_hits = counter('track_cache_disk_hits_total', 'Track lookups served from the database tier.')
+misses = counter('track_cache_misses_total', 'Track lookups that required a fresh extraction.')
+coalesced = counter('track_cache_coalesced_total', 'Track lookups that joined an in-flight extraction.')
+
+YOUTUBE_ID = re.compile(r'(?:v=|youtu\.be/|/shorts/|/embed/)([\w-]{11})')
+
+
+def canonical_track_id(query):
+    """Builds a stable cache key for a search query or URL.
+
+    Args:
+        query (str): The search query or URL of the song.
+
+    Returns:
+        str: The canonical track ID, e.g. ``youtube:dQw4w9WgXcQ``.
+    """
+    query = query.strip()
+    lowered = query.lower()
+    if 'youtube' in lowered or 'youtu.be' in lowered:
+        match = YOUTUBE_ID.search(query)
+        if match:
+            return f"youtube:{match.group(1)}"
+    if 'spotify' in lowered or 'soundcloud' in lowered:
+        url = urlparse(query)
+        source = 'spotify' if 'spotify' in url.netloc else 'soundcloud'
+        return f"{source}:{url.path.strip('/').lower()}"
+    return f"search:{' '.join(lowered.split())}"
+
+
+def stream_expiry(stream_url):
+    """Reads the expiry timestamp embedded in a signed stream URL.
+
+    Args:
+        stream_url (str): The stream URL.
+
+    Returns:
+        float: The UNIX timestamp at which the URL expires, or None if unknown.
+    """
+    expire = parse_qs(urlparse(stream_url).query).get('expire')
+    if expire:
+        try:
+            return float(expire[0])
+        except ValueError:
+            return None
+    return None
+
+
+def _format_rank(fmt):
+    # Opus in WebM at 48 kHz is what Discord sends, so it can be passed through untouched
+    return (
+        fmt.get('acodec') == 'opus',
+        fmt.get('vcodec') in ('none', None),
+        fmt.get('asr') == 48000,
+        fmt.get('abr') or fmt.get('tbr') or 0,
+    )
+
+
+def best_audio_format(info):
+    """Picks the format to stream from a youtube_dl info dictionary.
+
+    Audio-only Opus/WebM formats win, then other audio-only formats, each by bitrate.
+
+    Args:
+        info (dict): The youtube_dl info dictionary of a single track.
+
+    Returns:
+        dict: The chosen format, with at least a ``url``.
+    """
+    formats = [fmt for fmt in info.get('formats') or () if fmt.get('url') and fmt.get('acodec') != 'none']
+    if not formats:
+        return {'url': info['url'], 'acodec': info.get('acodec')}
+    return max(formats, key=_format_rank)
+
+
+def track_from_info(info):
+    """Reduces a youtube_dl info dictionary to the fields the bot uses.
+
+    Args:
+        info (dict): The youtube_dl info dictionary.
+
+    Returns:
+        dict: The compact track (id, title, artist, duration, webpage_url, stream_url, codec).
+    """
+    if 'entries' in info:
+        info = next(entry for entry in info['entries'] if entry)
+    fmt = best_audio_format(info)
+    return {
+        'id': f"{info.get('extractor_key', 'youtube').lower()}:{info['id']}",
+        'title': info['title'],
+        'artist': info.get('uploader'),
+        'duration': info.get('duration'),
+        'webpage_url': info.get('webpage_url'),
+        'stream_url': fmt['url'],
+        'codec': fmt.get('acodec'),
+    }
+
+
+class TrackCache:
+    """
+    A two-tier cache of resolved tracks.
+
+    The first tier is an in-memory LRU, the second a table in the bot database
+    reached through AsyncDatabase.
+    Entries expire with their stream URL, and concurrent lookups of the same
+    key share a single extraction.
+    """
+
+    def __init__(self, database=None, max_entries=TRACK_CACHE_SIZE, ttl=TRACK_CACHE_TTL):
+        self.database = database
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    def _expires_at(self, track):
+        expires_at = time.time() + self.ttl
+        expiry = stream_expiry(track['stream_url'])
+        if expiry is not None:
+            expires_at = min(expires_at, expiry - STREAM_EXPIRY_MARGIN)
+        return expires_at
+
+    def peek(self, key):
+        """
+        Looks up a track in the memory tier only.
+
+        Args:
+            key (str): The canonical track ID.
+
+        Returns:
+            dict: The cached track, or None if missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, track = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                memory_hits.inc()
+                return track
+            del self._entries[key]
+        return None
+
+    async def get(self, key):
+        """
+        Looks up a track in the memory tier, then the database tier.
+
+        Args:
+            key (str): The canonical track ID.
+
+        Returns:
+            dict: The cached track, or None if missing or expired.
+        """
+        track = self.peek(key)
+        if track is not None or self.database is None:
+            return track
+
+        cached = await self.database.get_cached_track(key)
+        if cached is not None and cached[1] > time.time():
+            track, expires_at = cached
+            self._remember(key, track, expires_at)
+            disk_hits.inc()
+            return track
+        return None
+
+    def _remember(self, key, track, expires_at):
+        self._entries[key] = (expires_at, track)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def remember(self, key, track):
+        """
+        Stores a track in the memory tier only, e.g. from code running off the event loop.
+
+        Args:
+            key (str): The key the track was looked up by.
+            track (dict): The resolved track.
+        """
+        expires_at = self._expires_at(track)
+        for alias in {key, track['id']}:
+            self._remember(alias, track, expires_at)
+
+    def put(self, key, track):
+        """
+        Stores a track under its lookup key and its canonical ID.
+
+        The database write is queued and not waited for.
+
+        Args:
+            key (str): The key the track was looked up by.
+            track (dict): The resolved track.
+        """
+        expires_at = self._expires_at(track)
+        for alias in {key, track['id']}:
+            self._remember(alias, track, expires_at)
+            if self.database is not None:
+                self.database.set_cached_track(alias, track, expires_at)
+
+    def invalidate(self, key):
+        """
+        Drops a track from both tiers, e.g. after its stream URL stopped working.
+
+        Args:
+            key (str): The canonical track ID.
+        """
+        self._entries.pop(key, None)
+        if self.database is not None:
+            self.database.delete_cached_track(key)
+
+    async def get_or_load(self, key, loader):
+        """
+        Returns a cached track or loads it, sharing one load between concurrent callers.
+
+        The load runs in its own task, so cancelling one caller, e.g. a
+        command that timed out, does not cancel it for the others; it still
+        finishes and fills the cache.
+
+        Args:
+            key (str): The canonical track ID.
+            loader (callable): A coroutine function returning the resolved track.
+
+        Returns:
+            dict: The resolved track.
+        """
+        track = await self.get(key)
+        if track is not None:
+            return track
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            coalesced.inc()
+        else:
+            misses.inc()
+            pending = self._inflight[key] = asyncio.get_running_loop().create_task(self._load(key, loader))
+            pending.add_done_callback(_retrieve_exception)
+        return await asyncio.shield(pending)
+
+    async def _load(self, key, loader):
+        try:
+            track = await loader()
+            self.put(key, track)
+            return track
+        finally:
+            del self._inflight[key]
+
+
+def _retrieve_exception(task):
+    # Callers get the exception themselves; this only keeps a load nobody waits for anymore from being reported
+    if not task.cancelled():
+        task.exception()
+
+# Shared by the music cog and the helper functions
+track_cache = TrackCache()
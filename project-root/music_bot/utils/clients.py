@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import threading
+import time
+
+import lyricsgenius
+import requests
+from requests.adapters import HTTPAdapter
+from spotipy import Spotify
+
+from music_bot.config import (
+    API_MAX_RETRIES,
+    CLIENT_POOL_SIZE,
+    GENIUS_API_KEY,
+    GENIUS_RATE_LIMIT,
+    SOUNDCLOUD_CLIENT_ID,
+    SOUNDCLOUD_CLIENT_SECRET,
+    SOUNDCLOUD_RATE_LIMIT,
+    SPOTIFY_CLIENT_ID,
+    SPOTIFY_CLIENT_SECRET,
+    SPOTIFY_RATE_LIMIT,
+    TOKEN_REFRESH_MARGIN,
+)
+from music_bot.utils.metrics import counter, histogram
+from music_bot.utils.ratelimit import RateLimiter, retry_after
+
+SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
+SOUNDCLOUD_TOKEN_URL = 'https://secure.soundcloud.com/oauth/token'
+SOUNDCLOUD_API_URL = 'https://api.soundcloud.com'
+
+
+def pooled_session(pool_size=CLIENT_POOL_SIZE):
+    """Creates a requests session that keeps connections to each host alive.
+
+    Args:
+        pool_size (int): The number of connections kept per host.
+
+    Returns:
+        requests.Session: The session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class OAuthToken:
+    """
+    A client-credentials OAuth token, cached until shortly before it expires.
+
+    Implements ``get_access_token`` so it can be used as a spotipy auth manager.
+    """
+
+    def __init__(self, name, token_url, client_id, client_secret, session, margin=TOKEN_REFRESH_MARGIN):
+        self.name = name
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.session = session
+        self.margin = margin
+        self.access_token = None
+        self.expires_at = 0
+        self._lock = threading.Lock()
+        self.refreshes = counter(f'{name}_token_refreshes_total', f'OAuth token refreshes for {name}.')
+
+    @property
+    def is_stale(self):
+        """
+        bool: Whether the token is missing or about to expire.
+        """
+        return self.expires_at - self.margin <= time.time()
+
+    def refresh(self):
+        """
+        Fetches a new access token.
+        """
+        response = self.session.post(
+            self.token_url,
+            data={'grant_type': 'client_credentials'},
+            auth=(self.client_id, self.client_secret),
+            timeout=10
+        )
+        response.raise_for_status()
+        payload = response.json()
+        self.access_token = payload['access_token']
+        self.expires_at = time.time() + payload.get('expires_in', 3600)
+        self.refreshes.inc()
+
+    def get_access_token(self, as_dict=False):
+        """
+        Returns a valid access token, refreshing it first if needed.
+
+        Args:
+            as_dict (bool): Accepted for spotipy compatibility; only the token string is returned.
+
+        Returns:
+            str: The access token.
+        """
+        with self._lock:
+            if self.is_stale:
+                self.refresh()
+            return self.access_token
+
+
+class SoundCloudApi:
+    """
+    A minimal SoundCloud API client that sends its requests over a shared session.
+
+    Requests are authorized with a client-credentials token, and responses
+    are returned as decoded JSON.
+    """
+
+    def __init__(self, token, session, base_url=SOUNDCLOUD_API_URL):
+        self.token = token
+        self.session = session
+        self.base_url = base_url
+
+    def get(self, path, **params):
+        """
+        Fetches an API resource.
+
+        Args:
+            path (str): The resource path, e.g. ``/tracks/123`` or ``/resolve``.
+            **params: Query parameters.
+
+        Returns:
+            The decoded JSON response.
+
+        Raises:
+            requests.HTTPError: If SoundCloud answers with an error status.
+        """
+        response = self.session.get(
+            self.base_url + path,
+            params=params,
+            headers={'Authorization': f'OAuth {self.token.get_access_token()}'},
+            timeout=10
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+class ApiClients:
+    """
+    The Spotify, SoundCloud and Genius clients shared by every command.
+
+    Clients are created once, keep their HTTP connections alive, and every call
+    goes through ``call`` so it is rate limited, retried on Retry-After and timed.
+    """
+
+    def __init__(self):
+        self.session = pooled_session()
+        self.spotify_token = OAuthToken('spotify', SPOTIFY_TOKEN_URL, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET,
+                                        self.session)
+        self.spotify = Spotify(auth_manager=self.spotify_token, requests_session=self.session)
+        self.soundcloud_token = OAuthToken('soundcloud', SOUNDCLOUD_TOKEN_URL, SOUNDCLOUD_CLIENT_ID,
+                                           SOUNDCLOUD_CLIENT_SECRET, self.session)
+        self.soundcloud = SoundCloudApi(self.soundcloud_token, self.session)
+        self.genius = lyricsgenius.Genius(GENIUS_API_KEY)
+        # Genius keeps its own session for its auth headers, but its connections come from the shared pool
+        for prefix in ('https://', 'http://'):
+            self.genius._session.mount(prefix, self.session.get_adapter(prefix))
+        # Tokens refreshed in the background, for the providers that are configured
+        self.tokens = [token for token in (self.spotify_token, self.soundcloud_token) if token.client_id]
+        self.limiters = {
+            'spotify': RateLimiter(SPOTIFY_RATE_LIMIT),
+            'soundcloud': RateLimiter(SOUNDCLOUD_RATE_LIMIT),
+            'genius': RateLimiter(GENIUS_RATE_LIMIT),
+        }
+        self.latency = {
+            provider: histogram(f'{provider}_api_latency_seconds', f'Latency of {provider} API calls.')
+            for provider in self.limiters
+        }
+        self.rate_limited = {
+            provider: counter(f'{provider}_api_rate_limited_total', f'{provider} API calls answered with a rate limit.')
+            for provider in self.limiters
+        }
+        self._refresher = None
+
+    async def call(self, provider, func, *args, **kwargs):
+        """
+        Runs a blocking client call on a thread under the provider's rate limit.
+
+        Args:
+            provider (str): The provider name (spotify, soundcloud or genius).
+            func (callable): The client method to call.
+            *args: Positional arguments passed to the method.
+            **kwargs: Keyword arguments passed to the method.
+
+        Returns:
+            The return value of the client method.
+        """
+        if self._refresher is None and self.tokens:
+            self._refresher = asyncio.get_running_loop().create_task(self._refresh_tokens())
+
+        limiter = self.limiters[provider]
+        for attempt in range(API_MAX_RETRIES + 1):
+            await limiter.acquire()
+            started_at = time.perf_counter()
+            try:
+                return await asyncio.to_thread(func, *args, **kwargs)
+            except Exception as e:
+                delay = retry_after(e)
+                if delay is None or attempt == API_MAX_RETRIES:
+                    raise
+                self.rate_limited[provider].inc()
+                limiter.penalize(delay)
+            finally:
+                self.latency[provider].observe(time.perf_counter() - started_at)
+
+    async def _refresh_tokens(self):
+        # Refresh ahead of expiry so no command ever waits on the token endpoint
+        while True:
+            delays = []
+            for token in self.tokens:
+                try:
+                    if token.is_stale:
+                        await asyncio.to_thread(token.get_access_token)
+                    delays.append(token.expires_at - token.margin - time.time())
+                except Exception as e:
+                    logging.error(f'Error refreshing {token.name} token: {e}')
+                    delays.append(30)
+            await asyncio.sleep(max(min(delays), 1))
+
+    def close(self):
+        """
+        Stops token refreshing and closes pooled connections.
+        """
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+        self.session.close()
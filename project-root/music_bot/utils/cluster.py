@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from multiprocessing.connection import wait
+
+from music_bot.config import METRICS_REPORT_INTERVAL, WORKER_RESTART_DELAY, WORKER_RESTART_MAX_DELAY
+from music_bot.utils.metrics import counter, merge_snapshots, snapshot
+
+worker_restarts = counter('cluster_worker_restarts_total', 'Worker processes restarted after exiting unexpectedly.')
+invalidations_forwarded = counter('cluster_invalidations_forwarded_total',
+                                  'Cache invalidations forwarded between worker processes.')
+
+# Exit code of a worker that cannot start at all, e.g. because the token is invalid; it is not restarted
+FATAL_EXIT_CODE = 78
+# A worker that ran this long before exiting is restarted after the initial delay again
+STABLE_SECONDS = 300
+
+
+def shard_ranges(shard_count, workers):
+    """Splits shards between worker processes as evenly as possible.
+
+    Args:
+        shard_count (int): The total number of shards.
+        workers (int): The number of worker processes.
+
+    Returns:
+        list: One list of consecutive shard IDs per worker.
+    """
+    if not 0 < workers <= shard_count:
+        raise ValueError(f'Cannot split {shard_count} shards between {workers} workers.')
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for worker_id in range(workers):
+        end = start + size + (1 if worker_id < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class WorkerLink:
+    """
+    A worker process's connection to the supervisor.
+
+    Invalidations published on the worker's bus are sent to the supervisor,
+    which forwards them to every other worker; those arriving from the
+    supervisor are delivered to the bus on the event loop. Every
+    METRICS_REPORT_INTERVAL seconds the worker reports its metrics and gets the
+    totals of the whole cluster back in ``cluster_metrics``.
+    """
+
+    def __init__(self, connection, bus, report_interval=METRICS_REPORT_INTERVAL):
+        self.connection = connection
+        self.bus = bus
+        self.report_interval = report_interval
+        self.cluster_metrics = None
+        self._send_lock = threading.Lock()
+        bus.attach(self.publish)
+
+    def publish(self, message):
+        """
+        Sends an invalidation to the other workers.
+
+        Args:
+            message (tuple): The invalidation message.
+        """
+        self._send(('invalidate', message))
+
+    def _send(self, item):
+        with self._send_lock:
+            try:
+                self.connection.send(item)
+            except (OSError, EOFError) as e:
+                logging.error(f'Could not reach the supervisor: {e}')
+
+    def start(self, loop, on_lost=None):
+        """
+        Starts receiving from the supervisor and reporting metrics.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): The worker's event loop.
+            on_lost (callable): Called on the event loop if the supervisor goes away.
+        """
+        threading.Thread(target=self._receive, args=(loop, on_lost), name='supervisor-link', daemon=True).start()
+        loop.create_task(self._report())
+
+    def _receive(self, loop, on_lost):
+        # Runs on its own thread, since receiving from a pipe blocks
+        while True:
+            try:
+                kind, payload = self.connection.recv()
+            except (OSError, EOFError):
+                logging.error('Lost the connection to the supervisor')
+                if on_lost is not None:
+                    loop.call_soon_threadsafe(on_lost)
+                return
+            if kind == 'invalidate':
+                loop.call_soon_threadsafe(self.bus.receive, payload)
+            elif kind == 'metrics':
+                self.cluster_metrics = payload
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self._send(('metrics', snapshot()))
+
+
+class _Worker:
+    """
+    The supervisor's record of one worker process.
+    """
+
+    __slots__ = ('shard_ids', 'process', 'connection', 'started_at', 'delay', 'restart_at')
+
+    def __init__(self, shard_ids):
+        self.shard_ids = shard_ids
+        self.process = None
+        self.connection = None
+        self.started_at = None
+        self.delay = 0
+        self.restart_at = None
+
+
+class Supervisor:
+    """
+    Runs the bot as several worker processes, each owning a range of shards.
+
+    Workers are started with ``target(worker_id, shard_ids, shard_count,
+    connection)`` in fresh interpreters. A worker that exits is restarted,
+    waiting twice as long after each quick failure up to
+    WORKER_RESTART_MAX_DELAY, unless it exits with FATAL_EXIT_CODE. The
+    supervisor also relays cache invalidations between workers and adds up
+    the metrics they report.
+    """
+
+    def __init__(self, target, shard_count, workers, restart_delay=WORKER_RESTART_DELAY,
+                 max_restart_delay=WORKER_RESTART_MAX_DELAY):
+        self.target = target
+        self.shard_count = shard_count
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.metrics = {}
+        self._workers = {worker_id: _Worker(shard_ids)
+                         for worker_id, shard_ids in enumerate(shard_ranges(shard_count, workers))}
+        # Forked children would inherit the parent's threads and locks in whatever state they were in
+        self._context = multiprocessing.get_context('spawn')
+        self._running = False
+
+    def _start(self, worker_id):
+        worker = self._workers[worker_id]
+        connection, child_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=self.target, args=(worker_id, worker.shard_ids, self.shard_count, child_connection),
+            name=f'music-bot-worker-{worker_id}'
+        )
+        process.start()
+        child_connection.close()
+        worker.process = process
+        worker.connection = connection
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        logging.info(f'Started worker {worker_id} (pid {worker.process.pid}) for shards '
+                     f'{worker.shard_ids[0]}-{worker.shard_ids[-1]} of {self.shard_count}')
+
+    def run(self):
+        """
+        Starts every worker and supervises them until interrupted or a worker fails fatally.
+        """
+        self._running = True
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        try:
+            for worker_id in self._workers:
+                self._start(worker_id)
+            while self._running:
+                self._relay(timeout=1.0)
+                self._check_workers()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _handle_signal(self, signum, frame):
+        self._running = False
+
+    def _relay(self, timeout):
+        connections = {
+            worker.connection: worker_id for worker_id, worker in self._workers.items()
+            if worker.connection is not None
+        }
+        if not connections:
+            time.sleep(timeout)
+            return
+        for connection in wait(list(connections), timeout):
+            worker_id = connections[connection]
+            try:
+                kind, payload = connection.recv()
+            except (OSError, EOFError):
+                # The process has exited; _check_workers restarts it
+                self._workers[worker_id].connection = None
+                connection.close()
+                continue
+            if kind == 'invalidate':
+                self._broadcast(('invalidate', payload), exclude=worker_id)
+                invalidations_forwarded.inc()
+            elif kind == 'metrics':
+                self.metrics[worker_id] = payload
+                self._send(worker_id, ('metrics', merge_snapshots(self.metrics.values())))
+
+    def _send(self, worker_id, item):
+        connection = self._workers[worker_id].connection
+        if connection is None:
+            return
+        try:
+            connection.send(item)
+        except (OSError, EOFError):
+            # Picked up on the next relay
+            pass
+
+    def _broadcast(self, item, exclude=None):
+        for worker_id in self._workers:
+            if worker_id != exclude:
+                self._send(worker_id, item)
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker_id, worker in self._workers.items():
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    worker_restarts.inc()
+                    self._start(worker_id)
+                continue
+            if worker.process.is_alive():
+                continue
+            exit_code = worker.process.exitcode
+            if worker.connection is not None:
+                worker.connection.close()
+                worker.connection = None
+            if exit_code == FATAL_EXIT_CODE:
+                logging.error(f'Worker {worker_id} cannot start; shutting down')
+                self._running = False
+                return
+            if now - worker.started_at >= STABLE_SECONDS:
+                worker.delay = self.restart_delay
+            else:
+                worker.delay = min(max(worker.delay * 2, self.restart_delay), self.max_restart_delay)
+            worker.restart_at = now + worker.delay
+            logging.error(f'Worker {worker_id} exited with code {exit_code}; restarting in {worker.delay} seconds')
+
+    def stop(self, timeout=10):
+        """
+        Asks every worker to shut down, killing those that do not exit in time.
+
+        Args:
+            timeout (float): Seconds to wait for each worker.
+        """
+        self._running = False
+        workers = [worker for worker in self._workers.values() if worker.process is not None]
+        for worker in workers:
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.kill()
+            if worker.connection is not None:
+                worker.connection.close()
+                worker.connection = None
@@ -1,5 +1,3 @@
-import sqlite3
-import pymongo
 import os
 from dotenv import load_dotenv
 
@@ -10,65 +8,21 @@ DATABASE_NAME = os.getenv('DATABASE_NAME')
 
 class Database:
     """
-    A class to manage database interactions.
+    The interface every storage backend implements.
 
-    Supports both SQLite and MongoDB.
+    Backends: SQLiteDatabase, MongoDatabase and MemoryDatabase (for tests and
+    benchmarks). Use open_database to pick one from DATABASE_URL once at startup.
     """
 
-    def __init__(self):
-        if DATABASE_URL.startswith('sqlite'):
-            self.connection = sqlite3.connect(DATABASE_URL)
-            self.create_tables()
-        elif DATABASE_URL.startswith('mongodb'):
-            self.client = pymongo.MongoClient(DATABASE_URL)
-            self.db = self.client[DATABASE_NAME]
-        else:
-            raise ValueError("Invalid database URL. Choose SQLite or MongoDB.")
-
-    def create_tables(self):
-        """
-        Creates the required tables in the SQLite database.
-        """
-        cursor = self.connection.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS playlists (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                user_id INTEGER NOT NULL,
-                songs TEXT
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_preferences (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                preference_name TEXT NOT NULL,
-                preference_value TEXT
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS bot_settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                setting_name TEXT NOT NULL,
-                setting_value TEXT
-            )
-        """)
-        self.connection.commit()
-
     def create_playlist(self, playlist_name, user_id):
         """
-        Creates a new playlist in the database.
+        Creates a new playlist in the database. Does nothing if the user already has one with that name.
 
         Args:
             playlist_name (str): The name of the playlist.
             user_id (int): The ID of the user creating the playlist.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            cursor = self.connection.cursor()
-            cursor.execute("INSERT INTO playlists (name, user_id, songs) VALUES (?, ?, '')", (playlist_name, user_id))
-            self.connection.commit()
-        elif DATABASE_URL.startswith('mongodb'):
-            self.db.playlists.insert_one({"name": playlist_name, "user_id": user_id, "songs": []})
+        raise NotImplementedError
 
     def add_song_to_playlist(self, playlist_name, song_url, user_id):
         """
@@ -79,21 +33,18 @@ class Database:
             song_url (str): The URL of the song to add.
             user_id (int): The ID of the user adding the song.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT songs FROM playlists WHERE name = ? AND user_id = ?", (playlist_name, user_id))
-            songs = cursor.fetchone()[0]
-            if songs:
-                songs += f"{song_url},"
-            else:
-                songs = f"{song_url},"
-            cursor.execute("UPDATE playlists SET songs = ? WHERE name = ? AND user_id = ?", (songs, playlist_name, user_id))
-            self.connection.commit()
-        elif DATABASE_URL.startswith('mongodb'):
-            self.db.playlists.update_one(
-                {"name": playlist_name, "user_id": user_id},
-                {"$push": {"songs": song_url}}
-            )
+        self.add_songs_to_playlist(playlist_name, [song_url], user_id)
+
+    def add_songs_to_playlist(self, playlist_name, song_urls, user_id):
+        """
+        Appends several songs to an existing playlist in one write.
+
+        Args:
+            playlist_name (str): The name of the playlist.
+            song_urls (list): The URLs of the songs to add, in order.
+            user_id (int): The ID of the user adding the songs.
+        """
+        raise NotImplementedError
 
     def remove_song_from_playlist(self, playlist_name, song_url, user_id):
         """
@@ -104,20 +55,18 @@ class Database:
             song_url (str): The URL of the song to remove.
             user_id (int): The ID of the user removing the song.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT songs FROM playlists WHERE name = ? AND user_id = ?", (playlist_name, user_id))
-            songs = cursor.fetchone()[0]
-            if songs:
-                songs = songs.replace(f"{song_url},", "")
-                songs = songs.replace(f"{song_url}", "")
-            cursor.execute("UPDATE playlists SET songs = ? WHERE name = ? AND user_id = ?", (songs, playlist_name, user_id))
-            self.connection.commit()
-        elif DATABASE_URL.startswith('mongodb'):
-            self.db.playlists.update_one(
-                {"name": playlist_name, "user_id": user_id},
-                {"$pull": {"songs": song_url}}
-            )
+        self.remove_songs_from_playlist(playlist_name, [song_url], user_id)
+
+    def remove_songs_from_playlist(self, playlist_name, song_urls, user_id):
+        """
+        Removes every occurrence of several songs from a playlist in one write.
+
+        Args:
+            playlist_name (str): The name of the playlist.
+            song_urls (list): The URLs of the songs to remove.
+            user_id (int): The ID of the user removing the songs.
+        """
+        raise NotImplementedError
 
     def delete_playlist(self, playlist_name, user_id):
         """
@@ -127,12 +76,7 @@ class Database:
             playlist_name (str): The name of the playlist to delete.
             user_id (int): The ID of the user deleting the playlist.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            cursor = self.connection.cursor()
-            cursor.execute("DELETE FROM playlists WHERE name = ? AND user_id = ?", (playlist_name, user_id))
-            self.connection.commit()
-        elif DATABASE_URL.startswith('mongodb'):
-            self.db.playlists.delete_one({"name": playlist_name, "user_id": user_id})
+        raise NotImplementedError
 
     def get_playlist(self, playlist_name, user_id):
         """
@@ -145,20 +89,7 @@ class Database:
         Returns:
             list: A list of song URLs in the playlist, or None if the playlist is not found.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT songs FROM playlists WHERE name = ? AND user_id = ?", (playlist_name, user_id))
-            songs = cursor.fetchone()
-            if songs:
-                return songs[0].split(',')[:-1]  # Remove trailing comma
-            else:
-                return None
-        elif DATABASE_URL.startswith('mongodb'):
-            playlist = self.db.playlists.find_one({"name": playlist_name, "user_id": user_id})
-            if playlist:
-                return playlist["songs"]
-            else:
-                return None
+        raise NotImplementedError
 
     def get_all_playlists(self, user_id):
         """
@@ -170,13 +101,7 @@ class Database:
         Returns:
             list: A list of playlist names.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT name FROM playlists WHERE user_id = ?", (user_id,))
-            return [row[0] for row in cursor.fetchall()]
-        elif DATABASE_URL.startswith('mongodb'):
-            playlists = self.db.playlists.find({"user_id": user_id})
-            return [playlist["name"] for playlist in playlists]
+        raise NotImplementedError
 
     def set_user_preference(self, user_id, preference_name, preference_value):
         """
@@ -187,19 +112,7 @@ class Database:
             preference_name (str): The name of the preference.
             preference_value (str): The value of the preference.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            cursor = self.connection.cursor()
-            cursor.execute(
-                "INSERT OR REPLACE INTO user_preferences (user_id, preference_name, preference_value) VALUES (?, ?, ?)",
-                (user_id, preference_name, preference_value)
-            )
-            self.connection.commit()
-        elif DATABASE_URL.startswith('mongodb'):
-            self.db.user_preferences.update_one(
-                {"user_id": user_id, "preference_name": preference_name},
-                {"$set": {"preference_value": preference_value}},
-                upsert=True  # Create the document if it doesn't exist
-            )
+        raise NotImplementedError
 
     def get_user_preference(self, user_id, preference_name):
         """
@@ -212,20 +125,7 @@ class Database:
         Returns:
             str: The value of the preference, or None if not found.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT preference_value FROM user_preferences WHERE user_id = ? AND preference_name = ?", (user_id, preference_name))
-            preference = cursor.fetchone()
-            if preference:
-                return preference[0]
-            else:
-                return None
-        elif DATABASE_URL.startswith('mongodb'):
-            preference = self.db.user_preferences.find_one({"user_id": user_id, "preference_name": preference_name})
-            if preference:
-                return preference["preference_value"]
-            else:
-                return None
+        raise NotImplementedError
 
     def set_bot_setting(self, setting_name, setting_value):
         """
@@ -235,19 +135,7 @@ class Database:
             setting_name (str): The name of the setting.
             setting_value (str): The value of the setting.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            cursor = self.connection.cursor()
-            cursor.execute(
-                "INSERT OR REPLACE INTO bot_settings (setting_name, setting_value) VALUES (?, ?)",
-                (setting_name, setting_value)
-            )
-            self.connection.commit()
-        elif DATABASE_URL.startswith('mongodb'):
-            self.db.bot_settings.update_one(
-                {"setting_name": setting_name},
-                {"$set": {"setting_value": setting_value}},
-                upsert=True  # Create the document if it doesn't exist
-            )
+        raise NotImplementedError
 
     def get_bot_setting(self, setting_name):
         """
@@ -259,26 +147,192 @@ class Database:
         Returns:
             str: The value of the setting, or None if not found.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT setting_value FROM bot_settings WHERE setting_name = ?", (setting_name,))
-            setting = cursor.fetchone()
-            if setting:
-                return setting[0]
-            else:
-                return None
-        elif DATABASE_URL.startswith('mongodb'):
-            setting = self.db.bot_settings.find_one({"setting_name": setting_name})
-            if setting:
-                return setting["setting_value"]
-            else:
-                return None
+        raise NotImplementedError
+
+    def set_guild_setting(self, guild_id, setting_name, setting_value):
+        """
+        Updates a setting for a single guild.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            setting_name (str): The name of the setting.
+            setting_value (str): The value of the setting.
+        """
+        raise NotImplementedError
+
+    def get_guild_setting(self, guild_id, setting_name):
+        """
+        Retrieves a setting for a single guild.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            setting_name (str): The name of the setting.
+
+        Returns:
+            str: The value of the setting, or None if not set.
+        """
+        raise NotImplementedError
+
+    def get_guild_settings(self, setting_name):
+        """
+        Retrieves one setting for every guild that has it set.
+
+        Args:
+            setting_name (str): The name of the setting.
+
+        Returns:
+            dict: The setting's value keyed by guild ID.
+        """
+        raise NotImplementedError
+
+    def get_cached_track(self, track_id):
+        """
+        Retrieves a resolved track from the track cache.
+
+        Args:
+            track_id (str): The canonical track ID.
+
+        Returns:
+            tuple: The track dictionary and its expiry timestamp, or None if not cached.
+        """
+        raise NotImplementedError
+
+    def set_cached_track(self, track_id, track, expires_at):
+        """
+        Stores a resolved track in the track cache.
+
+        Args:
+            track_id (str): The canonical track ID.
+            track (dict): The resolved track.
+            expires_at (float): The UNIX timestamp after which the entry is stale.
+        """
+        raise NotImplementedError
+
+    def delete_cached_track(self, track_id):
+        """
+        Removes a track from the track cache.
+
+        Args:
+            track_id (str): The canonical track ID.
+        """
+        raise NotImplementedError
+
+    def get_track_loudness(self, track_id):
+        """
+        Retrieves the loudness analysis of a track.
+
+        Args:
+            track_id (str): The canonical track ID.
+
+        Returns:
+            tuple: The integrated loudness (LUFS) and true peak (dBTP), or None if not analyzed.
+        """
+        raise NotImplementedError
+
+    def set_track_loudness(self, track_id, loudness, peak):
+        """
+        Stores the loudness analysis of a track.
+
+        Args:
+            track_id (str): The canonical track ID.
+            loudness (float): The integrated loudness in LUFS.
+            peak (float): The true peak in dBTP.
+        """
+        raise NotImplementedError
+
+    def get_player_state(self, guild_id):
+        """
+        Retrieves a guild's saved playback state.
+
+        Args:
+            guild_id (int): The ID of the guild.
+
+        Returns:
+            tuple: The last snapshot (None if there is none) and the list of deltas recorded since.
+        """
+        raise NotImplementedError
+
+    def append_player_state(self, guild_id, delta):
+        """
+        Records one change to a guild's playback state.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            delta (list): The change, as a JSON-serializable list.
+        """
+        raise NotImplementedError
+
+    def save_player_state(self, guild_id, snapshot):
+        """
+        Replaces a guild's playback state with a snapshot and drops its recorded deltas.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            snapshot (dict): The full state, as a JSON-serializable dictionary.
+        """
+        raise NotImplementedError
+
+    def get_cached_lyrics(self, lyrics_key):
+        """
+        Retrieves lyrics from the lyrics cache.
+
+        Args:
+            lyrics_key (str): The normalized title and artist key.
+
+        Returns:
+            tuple: The lyrics (None for a cached miss) and their expiry timestamp, or None if not cached.
+        """
+        raise NotImplementedError
+
+    def set_cached_lyrics(self, lyrics_key, lyrics, expires_at):
+        """
+        Stores lyrics, or a miss, in the lyrics cache.
+
+        Args:
+            lyrics_key (str): The normalized title and artist key.
+            lyrics (str): The lyrics, or None if the song has none.
+            expires_at (float): The UNIX timestamp after which the entry is stale.
+        """
+        raise NotImplementedError
+
+    def commit(self):
+        """
+        Commits pending writes. Only needed for backends opened with autocommit off.
+        """
+
+    def open_reader(self):
+        """
+        Returns a handle that can serve reads concurrently with this one.
+
+        Returns:
+            Database: A new connection for backends that need one, otherwise this backend.
+        """
+        return self
 
     def close(self):
         """
         Closes the database connection.
         """
-        if DATABASE_URL.startswith('sqlite'):
-            self.connection.close()
-        elif DATABASE_URL.startswith('mongodb'):
-            self.client.close()
\ No newline at end of file
+
+def open_database(database_url=DATABASE_URL, autocommit=True):
+    """
+    Opens the storage backend selected by a database URL.
+
+    Args:
+        database_url (str): ``sqlite:///path.db``, ``mongodb://...`` or ``memory://``.
+        autocommit (bool): Whether SQLite commits after every write.
+
+    Returns:
+        Database: The opened backend.
+    """
+    if database_url and database_url.startswith('sqlite'):
+        from music_bot.utils.sqlite_database import SQLiteDatabase
+        return SQLiteDatabase(database_url.split('sqlite:///', 1)[-1], autocommit=autocommit)
+    elif database_url and database_url.startswith('mongodb'):
+        from music_bot.utils.mongo_database import MongoDatabase
+        return MongoDatabase(database_url, DATABASE_NAME)
+    elif database_url and database_url.startswith('memory'):
+        from music_bot.utils.memory_database import MemoryDatabase
+        return MemoryDatabase()
+    else:
+        raise ValueError("Invalid database URL. Choose SQLite or MongoDB.")
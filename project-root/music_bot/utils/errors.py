@@ -54,4 +54,22 @@ class InvalidSongURL(CommandError):
         self.url = url
 
     def __str__(self):
-        return f"Invalid song URL: {self.url}"
\ No newline at end of file
+        return f"Invalid song URL: {self.url}"
+
+class ResolveTimeoutError(CommandError):
+    """Raised when resolving a track takes longer than the configured timeout."""
+    def __init__(self, query):
+        super().__init__()
+        self.query = query
+
+    def __str__(self):
+        return f"Timed out while looking up: {self.query}"
+
+class MediaWorkerError(CommandError):
+    """Raised when a media worker process dies or none is available to take work."""
+    def __init__(self, reason):
+        super().__init__()
+        self.reason = reason
+
+    def __str__(self):
+        return f"Media worker unavailable: {self.reason}"
@@ -0,0 +1,230 @@
+"""A stand-in for Discord's REST API and gateway for running the bot locally.
+
+It accepts any token, answers the handful of REST calls made at startup and
+speaks enough of the gateway protocol (hello, identify, heartbeat, resume and
+member chunking) for sharded bots to log in and receive their guilds. Point the
+bot at it with ``--gateway``:
+
+    python -m music_bot.utils.fake_gateway --port 8765 --guilds 100
+    python -m music_bot.main --gateway http://127.0.0.1:8765 --workers 2 --shards 4
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+
+from aiohttp import WSMsgType, web
+
+# Gateway opcodes
+DISPATCH = 0
+HEARTBEAT = 1
+IDENTIFY = 2
+RESUME = 6
+REQUEST_GUILD_MEMBERS = 8
+HELLO = 10
+HEARTBEAT_ACK = 11
+
+HEARTBEAT_INTERVAL_MS = 41250
+BOT_USER_ID = '1000'
+
+
+def guild_shard(guild_id, shard_count):
+    """Returns the shard Discord delivers a guild's events on.
+
+    Args:
+        guild_id (int): The ID of the guild.
+        shard_count (int): The total number of shards.
+
+    Returns:
+        int: The shard ID.
+    """
+    return (guild_id >> 22) % shard_count
+
+
+def _json_response(data, status=200):
+    # discord.py only parses bodies whose content type is exactly application/json, without a charset
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={'Content-Type': 'application/json'})
+
+
+def _user():
+    return {'id': BOT_USER_ID, 'username': 'music-bot', 'discriminator': '0001', 'avatar': None, 'bot': True,
+            'verified': True, 'mfa_enabled': False, 'flags': 0}
+
+
+def _guild(guild_id):
+    return {
+        'id': str(guild_id), 'name': f'Guild {guild_id >> 22}', 'icon': None, 'owner_id': BOT_USER_ID,
+        'afk_channel_id': None, 'afk_timeout': 300, 'verification_level': 0, 'default_message_notifications': 0,
+        'explicit_content_filter': 0, 'mfa_level': 0, 'system_channel_id': None, 'member_count': 1,
+        'large': False, 'unavailable': False, 'features': [], 'emojis': [], 'stickers': [], 'members': [],
+        'voice_states': [], 'presences': [], 'threads': [], 'stage_instances': [], 'premium_tier': 0,
+        'preferred_locale': 'en-US', 'nsfw_level': 0,
+        'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+                   'hoist': False, 'managed': False, 'mentionable': False}],
+        'channels': [{'id': str(guild_id + 1), 'type': 0, 'name': 'general', 'position': 0,
+                      'permission_overwrites': []}],
+    }
+
+
+class FakeGateway:
+    """
+    Serves a fake REST API and gateway for a fixed set of guilds.
+
+    Each identifying shard is sent READY and then a GUILD_CREATE for every
+    guild that belongs to it. Open sessions can be dropped with ``disconnect``
+    to exercise reconnecting and resuming.
+    """
+
+    def __init__(self, guilds=10, host='127.0.0.1', port=8765):
+        self.host = host
+        self.port = port
+        self.guild_ids = [(index + 1) << 22 for index in range(guilds)]
+        self.sessions = {}
+        self._session_ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def url(self):
+        """
+        str: The base URL the bot should use.
+        """
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        """
+        Starts serving.
+        """
+        app = web.Application()
+        app.router.add_get('/gateway-ws', self._gateway)
+        app.router.add_route('*', '/{path:.*}', self._rest)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f'Fake gateway serving {len(self.guild_ids)} guilds on {self.url}')
+
+    async def close(self):
+        """
+        Closes every session and stops serving.
+        """
+        for ws in list(self.sessions.values()):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def disconnect(self, shard_id):
+        """
+        Drops a shard's connection so the client has to resume.
+
+        Args:
+            shard_id (int): The shard to drop.
+        """
+        for (session_shard, _), ws in list(self.sessions.items()):
+            if session_shard == shard_id:
+                await ws.close(code=4000)
+
+    async def _rest(self, request):
+        path = request.match_info['path']
+        if path.endswith('users/@me'):
+            return _json_response(_user())
+        if path.endswith('applications/@me'):
+            return _json_response({'id': BOT_USER_ID, 'name': 'music-bot', 'icon': None, 'description': '',
+                                      'rpc_origins': [], 'bot_public': True, 'bot_require_code_grant': False,
+                                      'owner': _user(), 'summary': '', 'verify_key': '', 'flags': 0})
+        if path.endswith('gateway/bot'):
+            return _json_response({'url': f'ws://{self.host}:{self.port}/gateway-ws', 'shards': 1,
+                                      'session_start_limit': {'total': 1000, 'remaining': 1000,
+                                                              'reset_after': 0, 'max_concurrency': 16}})
+        if path.endswith('gateway'):
+            return _json_response({'url': f'ws://{self.host}:{self.port}/gateway-ws'})
+        if request.method == 'POST' and path.endswith('/messages'):
+            # Accept sent messages so commands can be exercised
+            body = await request.json()
+            channel_id = path.split('/')[-2]
+            return _json_response({'id': str(next(self._session_ids) << 22), 'channel_id': channel_id,
+                                      'content': body.get('content') or '', 'author': _user(), 'embeds': [],
+                                      'attachments': [], 'mentions': [], 'mention_roles': [], 'pinned': False,
+                                      'mention_everyone': False, 'tts': False, 'type': 0,
+                                      'timestamp': '2020-01-01T00:00:00+00:00', 'edited_timestamp': None})
+        return _json_response({'message': 'Unknown route', 'code': 0}, status=404)
+
+    async def _gateway(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        sequence = itertools.count(1)
+        key = None
+
+        async def dispatch(event, data):
+            await ws.send_str(json.dumps({'op': DISPATCH, 's': next(sequence), 't': event, 'd': data}))
+
+        await ws.send_str(json.dumps({'op': HELLO, 'd': {'heartbeat_interval': HEARTBEAT_INTERVAL_MS}}))
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    break
+                payload = json.loads(message.data)
+                op, data = payload['op'], payload.get('d')
+                if op == HEARTBEAT:
+                    await ws.send_str(json.dumps({'op': HEARTBEAT_ACK}))
+                elif op == IDENTIFY:
+                    shard_id, shard_count = data.get('shard') or (0, 1)
+                    key = (shard_id, next(self._session_ids))
+                    self.sessions[key] = ws
+                    guild_ids = [guild_id for guild_id in self.guild_ids
+                                 if guild_shard(guild_id, shard_count) == shard_id]
+                    await dispatch('READY', {
+                        'v': 9, 'user': _user(), 'session_id': f'session-{key[1]}', 'shard': [shard_id, shard_count],
+                        'guilds': [{'id': str(guild_id), 'unavailable': True} for guild_id in guild_ids],
+                        'private_channels': [], 'relationships': [], 'application': {'id': BOT_USER_ID, 'flags': 0},
+                        'resume_gateway_url': f'ws://{self.host}:{self.port}/gateway-ws',
+                    })
+                    for guild_id in guild_ids:
+                        await dispatch('GUILD_CREATE', _guild(guild_id))
+                    logging.info(f'Shard {shard_id}/{shard_count} identified with {len(guild_ids)} guilds')
+                elif op == RESUME:
+                    key = (None, next(self._session_ids))
+                    self.sessions[key] = ws
+                    await dispatch('RESUMED', {})
+                elif op == REQUEST_GUILD_MEMBERS:
+                    guild_ids = data['guild_id'] if isinstance(data['guild_id'], list) else [data['guild_id']]
+                    for guild_id in guild_ids:
+                        await dispatch('GUILD_MEMBERS_CHUNK', {'guild_id': str(guild_id), 'members': [],
+                                                               'chunk_index': 0, 'chunk_count': 1,
+                                                               'nonce': data.get('nonce')})
+        finally:
+            self.sessions.pop(key, None)
+        return ws
+
+
+async def serve(guilds, host, port):
+    """Runs a fake gateway until cancelled.
+
+    Args:
+        guilds (int): The number of guilds to serve.
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+    """
+    gateway = FakeGateway(guilds, host, port)
+    await gateway.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await gateway.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on.')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on.')
+    parser.add_argument('--guilds', type=int, default=10, help='Guilds spread across the shards.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(serve(args.guilds, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+import math
+
+import numpy as np
+
+from music_bot.config import (
+    BASS_BOOST_FREQUENCY,
+    EQ_BANDS,
+    EQ_Q,
+    NORMALIZE_MAX_GAIN_DB,
+    NORMALIZE_SMOOTHING,
+    NORMALIZE_TARGET_DBFS,
+)
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+# Samples per channel in one 20 ms frame
+FRAME_SAMPLES = 960
+# Frames are filtered in blocks of this many samples; smaller blocks mean smaller matrices
+BLOCK_SAMPLES = 120
+# Full scale of 16-bit PCM
+FULL_SCALE = 32768.0
+
+
+def peaking(frequency, gain_db, q=EQ_Q):
+    """Designs a peaking EQ biquad (RBJ audio EQ cookbook).
+
+    Args:
+        frequency (float): The centre frequency in Hz.
+        gain_db (float): The boost or cut at the centre frequency.
+        q (float): The band's quality factor.
+
+    Returns:
+        tuple: The normalized ``(b, a)`` coefficients, each of length 3.
+    """
+    amplitude = 10 ** (gain_db / 40)
+    w0 = 2 * math.pi * frequency / SAMPLE_RATE
+    alpha = math.sin(w0) / (2 * q)
+    b = (1 + alpha * amplitude, -2 * math.cos(w0), 1 - alpha * amplitude)
+    a = (1 + alpha / amplitude, -2 * math.cos(w0), 1 - alpha / amplitude)
+    return tuple(x / a[0] for x in b), tuple(x / a[0] for x in a)
+
+
+def low_shelf(frequency, gain_db):
+    """Designs a low-shelf biquad with a slope of 1 (RBJ audio EQ cookbook).
+
+    Args:
+        frequency (float): The shelf's corner frequency in Hz.
+        gain_db (float): The boost or cut below the corner.
+
+    Returns:
+        tuple: The normalized ``(b, a)`` coefficients, each of length 3.
+    """
+    amplitude = 10 ** (gain_db / 40)
+    w0 = 2 * math.pi * frequency / SAMPLE_RATE
+    cos_w0 = math.cos(w0)
+    alpha = math.sin(w0) / 2 * math.sqrt(2)
+    root = 2 * math.sqrt(amplitude) * alpha
+    b = (
+        amplitude * ((amplitude + 1) - (amplitude - 1) * cos_w0 + root),
+        2 * amplitude * ((amplitude - 1) - (amplitude + 1) * cos_w0),
+        amplitude * ((amplitude + 1) - (amplitude - 1) * cos_w0 - root),
+    )
+    a = (
+        (amplitude + 1) + (amplitude - 1) * cos_w0 + root,
+        -2 * ((amplitude - 1) + (amplitude + 1) * cos_w0),
+        (amplitude + 1) + (amplitude - 1) * cos_w0 - root,
+    )
+    return tuple(x / a[0] for x in b), tuple(x / a[0] for x in a)
+
+
+class AudioFilters:
+    """
+    The filter settings of one guild.
+
+    Every change bumps ``version``, which is how a playing FilterEngine notices
+    it has to rebuild before the next frame.
+    """
+
+    __slots__ = ('gain_db', 'eq', 'bass_db', 'normalize', 'version')
+
+    def __init__(self):
+        self.gain_db = 0.0
+        self.eq = [0.0] * len(EQ_BANDS)
+        self.bass_db = 0.0
+        self.normalize = False
+        self.version = 0
+
+    @property
+    def active(self):
+        """
+        bool: Whether any filter changes the audio.
+        """
+        return bool(self.gain_db or self.bass_db or self.normalize or any(self.eq))
+
+    def set_gain(self, gain_db):
+        """
+        Sets the gain applied to every frame.
+
+        Args:
+            gain_db (float): The gain in dB.
+        """
+        self.gain_db = gain_db
+        self.version += 1
+
+    def set_band(self, band, gain_db):
+        """
+        Sets the gain of one equalizer band.
+
+        Args:
+            band (int): The index of the band in EQ_BANDS.
+            gain_db (float): The boost or cut in dB.
+        """
+        self.eq[band] = gain_db
+        self.version += 1
+
+    def set_bass(self, gain_db):
+        """
+        Sets the bass boost.
+
+        Args:
+            gain_db (float): The boost below BASS_BOOST_FREQUENCY in dB.
+        """
+        self.bass_db = gain_db
+        self.version += 1
+
+    def set_normalize(self, normalize):
+        """
+        Turns loudness normalization on or off.
+
+        Args:
+            normalize (bool): Whether to normalize.
+        """
+        self.normalize = normalize
+        self.version += 1
+
+    def reset(self):
+        """
+        Turns every filter off.
+        """
+        self.gain_db = 0.0
+        self.eq = [0.0] * len(EQ_BANDS)
+        self.bass_db = 0.0
+        self.normalize = False
+        self.version += 1
+
+    def state(self):
+        """
+        Returns the settings in a form that can be saved or sent to another process.
+
+        Returns:
+            dict: The gain, equalizer, bass boost and normalization settings.
+        """
+        return {'gain_db': self.gain_db, 'eq': list(self.eq), 'bass_db': self.bass_db, 'normalize': self.normalize}
+
+    def load(self, state):
+        """
+        Replaces the settings with ones returned by ``state``.
+
+        Args:
+            state (dict): The settings.
+        """
+        self.gain_db = state['gain_db']
+        self.eq = list(state['eq'])
+        self.bass_db = state['bass_db']
+        self.normalize = state['normalize']
+        self.version += 1
+
+    def sections(self):
+        """
+        Returns the biquads the current settings need.
+
+        Returns:
+            list: ``(b, a)`` coefficient pairs, in processing order.
+        """
+        sections = []
+        if self.bass_db:
+            sections.append(low_shelf(BASS_BOOST_FREQUENCY, self.bass_db))
+        for frequency, gain_db in zip(EQ_BANDS, self.eq):
+            if gain_db:
+                sections.append(peaking(frequency, gain_db))
+        return sections
+
+
+def _state_space(sections):
+    # Chains transposed direct form II biquads into one (A, B, C, D) system
+    A = np.zeros((0, 0))
+    B = np.zeros(0)
+    C = np.zeros(0)
+    D = 1.0
+    for b, a in sections:
+        A2 = np.array([[-a[1], 1.0], [-a[2], 0.0]])
+        B2 = np.array([b[1] - a[1] * b[0], b[2] - a[2] * b[0]])
+        C2 = np.array([1.0, 0.0])
+        D2 = b[0]
+        n = len(B)
+        A = np.block([[A, np.zeros((n, 2))], [np.outer(B2, C), A2]])
+        B = np.concatenate([B, B2 * D])
+        C = np.concatenate([D2 * C, C2])
+        D = D2 * D
+    return A, B, C, D
+
+
+class FilterEngine:
+    """
+    Applies a guild's AudioFilters to 20 ms frames of 16-bit stereo PCM.
+
+    The biquad chain is an IIR filter, which cannot be vectorized sample by
+    sample, so it is rewritten for a block of samples: the output is the block
+    convolved with the chain's impulse response plus the decaying response to
+    the carried-over filter state, and both are matrix products over the block.
+    The matrices are rebuilt only when the settings change; every frame is
+    processed into preallocated buffers.
+
+    When the track's normalizing gain is known, normalization applies it as a
+    fixed gain instead of measuring each frame.
+    """
+
+    def __init__(self, filters, track_gain=None, frame_samples=FRAME_SAMPLES, block_samples=BLOCK_SAMPLES):
+        self.filters = filters
+        self.track_gain = track_gain
+        self.block_samples = block_samples
+        self.samples = np.empty((frame_samples, CHANNELS), dtype=np.float32)
+        self.output = np.empty((frame_samples, CHANNELS), dtype=np.float32)
+        self.pcm = np.empty((frame_samples, CHANNELS), dtype=np.int16)
+        self._blocks = [
+            (self.samples[start:start + block_samples], self.output[start:start + block_samples])
+            for start in range(0, frame_samples, block_samples)
+        ]
+        self.level = 1.0
+        self._version = None
+        self._build()
+
+    def _build(self):
+        filters = self.filters
+        length = self.block_samples
+        A, B, C, D = _state_space(filters.sections())
+        gain_db = filters.gain_db
+        if filters.normalize and self.track_gain is not None:
+            gain_db += self.track_gain
+        gain = 10 ** (gain_db / 20)
+        order = len(B)
+
+        # impulse[k] is the chain's response k samples after an impulse; powers[k] is A^k B
+        impulse = np.empty(length)
+        powers = np.empty((length, order))
+        impulse[0] = D
+        vector = B
+        for k in range(length):
+            powers[k] = vector
+            if k + 1 < length:
+                impulse[k + 1] = C @ vector
+            vector = A @ vector
+        lag = np.subtract.outer(np.arange(length), np.arange(length))
+        toeplitz = np.where(lag >= 0, impulse[np.clip(lag, 0, None)], 0.0)
+
+        observe = np.empty((length, order))
+        row = C
+        for k in range(length):
+            observe[k] = row
+            row = row @ A
+
+        self.gain = gain
+        state = getattr(self, 'state', None)
+        self.toeplitz = (gain * toeplitz).astype(np.float32)
+        self.observe = (gain * observe).astype(np.float32)
+        self.transition = np.linalg.matrix_power(A, length).astype(np.float32)
+        self.inject = powers[::-1].T.astype(np.float32).copy()
+        if state is None or state.shape[0] != order:
+            # A different chain cannot reuse the old state; it settles within a few frames
+            state = np.zeros((order, CHANNELS), dtype=np.float32)
+        self.state = state
+        self._next_state = np.empty_like(state)
+        self._state_input = np.empty_like(state)
+        self._response = np.empty((length, CHANNELS), dtype=np.float32)
+        self._version = filters.version
+
+    def process(self, frame):
+        """
+        Filters one frame.
+
+        Args:
+            frame (bytes): A 20 ms frame of 16-bit little-endian stereo PCM.
+
+        Returns:
+            bytes: The filtered frame.
+        """
+        if self._version != self.filters.version:
+            self._build()
+        np.copyto(self.samples, np.frombuffer(frame, dtype=np.int16).reshape(-1, CHANNELS), casting='unsafe')
+
+        output = self.output
+        if not len(self.state):
+            np.multiply(self.samples, self.gain, out=output)
+        else:
+            for samples, block in self._blocks:
+                np.matmul(self.toeplitz, samples, out=block)
+                np.matmul(self.observe, self.state, out=self._response)
+                block += self._response
+                np.matmul(self.transition, self.state, out=self._next_state)
+                np.matmul(self.inject, samples, out=self._state_input)
+                np.add(self._next_state, self._state_input, out=self.state)
+
+        if self.filters.normalize and self.track_gain is None:
+            self._normalize(output)
+        np.clip(output, -FULL_SCALE, FULL_SCALE - 1, out=output)
+        np.copyto(self.pcm, output, casting='unsafe')
+        return self.pcm.tobytes()
+
+    def _normalize(self, output):
+        # Eases the gain toward whatever brings the frame's RMS level to the target
+        flat = output.reshape(-1)
+        rms = math.sqrt(float(np.dot(flat, flat)) / flat.size) / FULL_SCALE
+        if rms > 1e-4:
+            target = 10 ** (NORMALIZE_TARGET_DBFS / 20) / rms
+            target = min(target, 10 ** (NORMALIZE_MAX_GAIN_DB / 20))
+            self.level += (target - self.level) * NORMALIZE_SMOOTHING
+        output *= self.level
@@ -1,5 +1,10 @@
+import logging
+
 import discord
 
+from music_bot.utils.cache import canonical_track_id, track_cache
+from music_bot.utils.resolver import resolve_track
+
 def format_song_info(song_info):
     """Formats song information for display in embeds.
 
@@ -31,6 +36,26 @@ def get_current_time_string(seconds):
     hours, minutes = divmod(minutes, 60)
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
+def get_song_info(song_url):
+    """Retrieves the resolved track for a song URL from the shared track cache.
+
+    The song is only extracted when it is not cached yet, so looking up the
+    duration, title and artist of the same song costs a single extraction.
+    Only the memory tier is used, since this runs outside the event loop.
+
+    Args:
+        song_url (str): The URL of the song.
+
+    Returns:
+        dict: The resolved track (title, artist, duration, stream_url).
+    """
+    key = canonical_track_id(song_url)
+    track = track_cache.peek(key)
+    if track is None:
+        track = resolve_track(song_url)
+        track_cache.remember(key, track)
+    return track
+
 def get_song_duration(song_url):
     """Retrieves the duration of a song from its URL.
 
@@ -40,16 +65,10 @@ def get_song_duration(song_url):
     Returns:
         int: The duration of the song in seconds.
     """
-    # Implement logic to extract duration from the song URL
-    # This will vary depending on the music source (YouTube, Spotify, SoundCloud)
-    # Example for YouTube using youtube_dl:
     try:
-        with youtube_dl.YoutubeDL({'format': 'bestaudio'}) as ydl:
-            info = ydl.extract_info(song_url, download=False)
-            duration = info['duration']
-            return duration
+        return get_song_info(song_url)['duration']
     except Exception as e:
-        print(f"Error getting song duration: {e}")
+        logging.error(f"Error getting song duration: {e}")
         return None
 
 def get_song_title(song_url):
@@ -61,16 +80,10 @@ def get_song_title(song_url):
     Returns:
         str: The title of the song.
     """
-    # Implement logic to extract the title from the song URL
-    # This will vary depending on the music source
-    # Example for YouTube using youtube_dl:
     try:
-        with youtube_dl.YoutubeDL({'format': 'bestaudio'}) as ydl:
-            info = ydl.extract_info(song_url, download=False)
-            title = info['title']
-            return title
+        return get_song_info(song_url)['title']
     except Exception as e:
-        print(f"Error getting song title: {e}")
+        logging.error(f"Error getting song title: {e}")
         return None
 
 def get_song_artist(song_url):
@@ -82,14 +95,8 @@ def get_song_artist(song_url):
     Returns:
         str: The artist of the song.
     """
-    # Implement logic to extract the artist from the song URL
-    # This will vary depending on the music source
-    # Example for YouTube using youtube_dl:
     try:
-        with youtube_dl.YoutubeDL({'format': 'bestaudio'}) as ydl:
-            info = ydl.extract_info(song_url, download=False)
-            artist = info['uploader']
-            return artist
+        return get_song_info(song_url)['artist']
     except Exception as e:
-        print(f"Error getting song artist: {e}")
+        logging.error(f"Error getting song artist: {e}")
         return None
\ No newline at end of file
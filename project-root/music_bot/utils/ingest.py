@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+
+import youtube_dl
+
+from music_bot.config import INGEST_PROGRESS_INTERVAL
+from music_bot.utils.metrics import counter
+
+# Page sizes are the maximums each endpoint accepts
+SPOTIFY_PLAYLIST_PAGE = 100
+SPOTIFY_ALBUM_PAGE = 50
+SOUNDCLOUD_TRACKS_PAGE = 50
+
+ingested = counter('ingest_songs_total', 'Songs queued from playlist and album URLs.')
+
+
+def is_playlist_url(query):
+    """Checks whether a query points at a playlist or album rather than a single track.
+
+    Args:
+        query (str): The search query or URL.
+
+    Returns:
+        bool: True if the query is a Spotify, YouTube or SoundCloud playlist URL.
+    """
+    url = urlparse(query.strip())
+    host = url.netloc.lower()
+    if 'spotify' in host:
+        return url.path.startswith(('/playlist/', '/album/'))
+    if 'youtube' in host:
+        return url.path == '/playlist'
+    if 'soundcloud' in host:
+        return '/sets/' in url.path
+    return False
+
+
+def extract_playlist(url):
+    """Lists the entries of a YouTube playlist without resolving each video.
+
+    Defined at module level so it can be pickled into a process pool.
+
+    Args:
+        url (str): The playlist URL.
+
+    Returns:
+        dict: The youtube_dl playlist info with flat entries.
+    """
+    with youtube_dl.YoutubeDL({'extract_flat': 'in_playlist', 'quiet': True}) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def _song(title, artist, url=None, query=None):
+    return {'title': title, 'artist': artist, 'url': url, 'query': query}
+
+
+def _youtube_search(title, artist):
+    return f"ytsearch1:{artist} - {title}"
+
+
+def _log_play_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Could not start playing the playlist: {task.exception()}")
+
+
+class PlaylistIngestor:
+    """
+    Streams the songs of a playlist or album into a guild's queue.
+
+    Pages are fetched one at a time through the shared API clients, so they
+    stay under each provider's rate limit, and songs
+    are queued unresolved so the player's prefetcher resolves them just ahead
+    of playback. Playback starts as soon as the first page is queued. Progress
+    is reported through the message scheduler, within Discord's rate limits.
+    """
+
+    def __init__(self, resolver, clients, messages):
+        self.resolver = resolver
+        self.clients = clients
+        self.messages = messages
+
+    async def _spotify_batches(self, url):
+        kind, playlist_id = urlparse(url).path.strip('/').split('/')[:2]
+        offset = 0
+        while True:
+            if kind == 'playlist':
+                page = await self.clients.call('spotify', self.clients.spotify.playlist_items, playlist_id,
+                                               limit=SPOTIFY_PLAYLIST_PAGE, offset=offset, additional_types=('track',))
+                tracks = [item['track'] for item in page['items'] if item.get('track')]
+            else:
+                page = await self.clients.call('spotify', self.clients.spotify.album_tracks, playlist_id,
+                                               limit=SPOTIFY_ALBUM_PAGE, offset=offset)
+                tracks = page['items']
+            yield page['total'], [
+                _song(track['name'], track['artists'][0]['name'],
+                      query=_youtube_search(track['name'], track['artists'][0]['name']))
+                for track in tracks
+            ]
+            if not page.get('next'):
+                return
+            offset += len(page['items'])
+
+    async def _youtube_batches(self, guild_id, url):
+        playlist = await self.resolver.run(guild_id, extract_playlist, url)
+        entries = [entry for entry in playlist['entries'] if entry]
+        yield len(entries), [
+            _song(entry.get('title'), entry.get('uploader'),
+                  query=f"https://www.youtube.com/watch?v={entry['id']}")
+            for entry in entries
+        ]
+
+    async def _soundcloud_batches(self, url):
+        playlist = await self.clients.call('soundcloud', self.clients.soundcloud.get, '/resolve', url=url)
+        tracks = playlist['tracks']
+        total = len(tracks)
+        for start in range(0, total, SOUNDCLOUD_TRACKS_PAGE):
+            page = tracks[start:start + SOUNDCLOUD_TRACKS_PAGE]
+            # Large sets only embed track IDs, so fetch the rest in one batched request
+            missing = [str(track['id']) for track in page if 'title' not in track]
+            if missing:
+                full = await self.clients.call('soundcloud', self.clients.soundcloud.get, '/tracks',
+                                               ids=','.join(missing))
+                by_id = {track['id']: track for track in full}
+                page = [by_id.get(track['id'], track) for track in page]
+            yield total, [
+                _song(track['title'], track['user']['username'], url=track['stream_url'])
+                for track in page if 'title' in track
+            ]
+
+    def batches(self, guild_id, url):
+        """
+        Returns an async iterator over ``(total, songs)`` pages of a playlist.
+
+        Args:
+            guild_id (int): The ID of the guild the playlist is queued in.
+            url (str): The playlist or album URL.
+
+        Returns:
+            AsyncIterator: Pages of songs with the playlist's total length.
+        """
+        host = urlparse(url).netloc.lower()
+        if 'spotify' in host:
+            return self._spotify_batches(url)
+        elif 'soundcloud' in host:
+            return self._soundcloud_batches(url)
+        return self._youtube_batches(guild_id, url)
+
+    async def ingest(self, ctx, player, url):
+        """
+        Queues every song of a playlist, reporting progress on a single message.
+
+        Args:
+            ctx (discord.ext.commands.Context): The context of the command.
+            player (MusicPlayer): The guild's player.
+            url (str): The playlist or album URL.
+
+        Returns:
+            int: The number of queued songs.
+        """
+        message = await self.messages.post(ctx.channel, "Loading playlist...")
+        queued = 0
+        total = 0
+        starter = None
+        last_update = time.monotonic()
+        async for total, songs in self.batches(ctx.guild.id, url):
+            for song in songs:
+                await player.add_to_queue(ctx, song['url'], song['title'], song['artist'], query=song['query'])
+            if songs and not queued:
+                # Start playing while the rest of the playlist is still loading
+                starter = asyncio.get_running_loop().create_task(player.play())
+                starter.add_done_callback(_log_play_error)
+            queued += len(songs)
+            ingested.inc(len(songs))
+            if time.monotonic() - last_update >= INGEST_PROGRESS_INTERVAL:
+                last_update = time.monotonic()
+                self.messages.edit(message, f"Queued {queued}/{total} songs...")
+        self.messages.edit(message, f"Queued {queued} songs from the playlist.")
+        if starter is not None:
+            # Holds on to the task until playback has started; failures are logged by its callback
+            await asyncio.wait([starter])
+        return queued
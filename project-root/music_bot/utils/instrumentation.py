@@ -0,0 +1,352 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from aiohttp import web
+from discord.ext import commands
+
+from music_bot.config import (
+    LOOP_LAG_INTERVAL,
+    LOOP_WATCHDOG_REPORT_INTERVAL,
+    LOOP_WATCHDOG_THRESHOLD,
+    LOOP_WATCHDOG_TOP,
+    METRICS_HOST,
+    METRICS_PORT,
+)
+from music_bot.utils.metrics import counter, exposition, histogram, merge_snapshots, percentile
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+loop_lag = histogram('event_loop_lag_seconds', 'How late the event loop woke up a sleeping task.', buckets=LAG_BUCKETS)
+command_errors = counter('command_errors_total', 'Commands that raised an error or failed a check.')
+loop_stalls = counter('event_loop_stalls_total', 'Times the loop watchdog caught the event loop blocked past its threshold.')
+stall_duration = histogram('event_loop_stall_seconds', 'How long the event loop stayed blocked in each caught stall.',
+                           buckets=LAG_BUCKETS)
+
+# Frames under this directory are the bot's own code, where a blocking call is usually made from
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _command_latency(name):
+    return histogram(f"command_{name.replace(' ', '_')}_latency_seconds", f'Time taken to handle the {name} command.')
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop runs a task that sleeps for a fixed interval.
+
+    Anything that blocks the loop, such as a synchronous call inside a
+    coroutine, shows up as lag in ``event_loop_lag_seconds``. One short sleep
+    per LOOP_LAG_INTERVAL keeps the cost negligible.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    def start(self, loop):
+        """
+        Starts measuring.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): The loop to measure.
+        """
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started_at = loop.time()
+            await asyncio.sleep(self.interval)
+            loop_lag.observe(max(loop.time() - started_at - self.interval, 0.0))
+
+    def stop(self):
+        """
+        Stops measuring.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def _call_site(stack):
+    # The innermost frame of the bot's own code, or the innermost frame if none is
+    for frame in reversed(stack):
+        if frame.filename.startswith(PACKAGE_DIR) and frame.filename != __file__:
+            break
+    else:
+        frame = stack[-1]
+    filename = frame.filename
+    if filename.startswith(PACKAGE_DIR):
+        filename = os.path.relpath(filename, os.path.dirname(PACKAGE_DIR))
+    return f'{filename}:{frame.lineno} in {frame.name}'
+
+
+class _CallSite:
+    """
+    How often and how long one call site has blocked the event loop.
+    """
+
+    __slots__ = ('stalls', 'seconds', 'worst')
+
+    def __init__(self):
+        self.stalls = 0
+        self.seconds = 0.0
+        self.worst = 0.0
+
+
+class LoopWatchdog:
+    """
+    Finds the code that blocks the event loop.
+
+    A background thread keeps scheduling a no-op on the loop and waits for it
+    to run. If it has not run within ``threshold`` seconds, whatever the loop
+    is executing has held it that long, so the thread takes the loop thread's
+    stack right then and charges the stall to the innermost frame of the
+    bot's own code, such as the line calling ``extract_info`` or committing
+    to SQLite. The first stall at a call site is logged with its full stack,
+    and every LOOP_WATCHDOG_REPORT_INTERVAL seconds the call sites that have
+    blocked the loop the longest are logged, worst first.
+
+    The loop only does work when the thread pings it, a few times per
+    threshold, so the watchdog is cheap but not free; it is off unless
+    LOOP_WATCHDOG is set.
+    """
+
+    def __init__(self, threshold=LOOP_WATCHDOG_THRESHOLD, top=LOOP_WATCHDOG_TOP,
+                 report_interval=LOOP_WATCHDOG_REPORT_INTERVAL):
+        self.threshold = threshold
+        self.top = top
+        self.report_interval = report_interval
+        self.sites = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._loop_thread_id = None
+        self._reported_stalls = 0
+
+    def start(self, loop):
+        """
+        Starts watching a loop; it may start running later.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): The loop to watch.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, args=(loop,), name='loop-watchdog', daemon=True)
+            self._thread.start()
+
+    def _ping(self, loop):
+        answered = threading.Event()
+
+        def answer():
+            self._loop_thread_id = threading.get_ident()
+            answered.set()
+
+        loop.call_soon_threadsafe(answer)
+        return answered
+
+    def _wait(self, loop, answered):
+        # Waits until the loop answers, or returns False if it never will
+        while not answered.wait(self.threshold):
+            if self._stopped.is_set() or loop.is_closed():
+                return False
+        return True
+
+    def _watch(self, loop):
+        try:
+            # Nothing counts as a stall until the loop has started running
+            if not self._wait(loop, self._ping(loop)):
+                return
+            next_report = time.monotonic() + self.report_interval
+            while not self._stopped.wait(self.threshold / 2):
+                sent_at = time.monotonic()
+                answered = self._ping(loop)
+                if not answered.wait(self.threshold) and loop.is_running():
+                    site, stack = self._sample()
+                    if not self._wait(loop, answered):
+                        return
+                    self._record(site, stack, time.monotonic() - sent_at)
+                if time.monotonic() >= next_report:
+                    next_report = time.monotonic() + self.report_interval
+                    self.report()
+        except RuntimeError:
+            # The loop was closed between checks
+            return
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return 'unknown', []
+        stack = traceback.extract_stack(frame)
+        del frame
+        return _call_site(stack), stack
+
+    def _record(self, site, stack, duration):
+        loop_stalls.inc()
+        stall_duration.observe(duration)
+        with self._lock:
+            entry = self.sites.get(site)
+            first = entry is None
+            if first:
+                entry = self.sites[site] = _CallSite()
+            entry.stalls += 1
+            entry.seconds += duration
+            entry.worst = max(entry.worst, duration)
+        if first and stack:
+            logging.warning(f'Event loop blocked for {duration:.3f}s at {site}:\n'
+                            f"{''.join(traceback.format_list(stack)).rstrip()}")
+        else:
+            logging.warning(f'Event loop blocked for {duration:.3f}s at {site}')
+
+    def ranking(self):
+        """
+        Returns the call sites that have blocked the loop the longest in total.
+
+        Returns:
+            list: ``(site, stalls, seconds, worst)`` tuples, worst first, at most ``top`` of them.
+        """
+        with self._lock:
+            ranked = sorted(self.sites.items(), key=lambda item: item[1].seconds, reverse=True)[:self.top]
+            return [(site, entry.stalls, entry.seconds, entry.worst) for site, entry in ranked]
+
+    def report(self):
+        """
+        Logs the ranking if the loop has stalled since the last report.
+        """
+        stalls = loop_stalls.value
+        if stalls == self._reported_stalls:
+            return
+        self._reported_stalls = stalls
+        lines = [
+            f'{rank}. {site}: {count} stalls, {seconds:.2f}s blocked, worst {worst:.2f}s'
+            for rank, (site, count, seconds, worst) in enumerate(self.ranking(), 1)
+        ]
+        logging.warning('Call sites blocking the event loop the longest:\n' + '\n'.join(lines))
+
+    def stop(self):
+        """
+        Stops watching.
+        """
+        self._stopped.set()
+
+
+def instrument_commands(bot):
+    """Times every command in a ``command_<name>_latency_seconds`` histogram and logs the ones that fail.
+
+    Errors that reach the bot are counted in ``command_errors_total`` and
+    logged with their traceback instead of being printed to stderr.
+
+    Args:
+        bot (commands.Bot): The bot to instrument.
+    """
+    @bot.before_invoke
+    async def started(ctx):
+        ctx.started_at = time.perf_counter()
+
+    @bot.after_invoke
+    async def finished(ctx):
+        started_at = getattr(ctx, 'started_at', None)
+        if started_at is not None:
+            _command_latency(ctx.command.qualified_name).observe(time.perf_counter() - started_at)
+
+    async def on_command_error(ctx, error):
+        if isinstance(error, commands.CommandNotFound):
+            return
+        command_errors.inc()
+        name = ctx.command.qualified_name if ctx.command is not None else ctx.invoked_with
+        logging.error(f'Command {name} failed in guild {ctx.guild.id if ctx.guild else None}: {error}',
+                      exc_info=(type(error), error, error.__traceback__))
+
+    bot.add_listener(on_command_error)
+
+
+def _combined(values, prefix, suffix):
+    # Merges every histogram whose name matches into one
+    parts = [{'combined': value} for name, value in values.items()
+             if name.startswith(prefix) and name.endswith(suffix) and isinstance(value, tuple)]
+    return merge_snapshots(parts).get('combined')
+
+
+def _milliseconds(value, q):
+    result = percentile(value, q) if value is not None else None
+    if result is None:
+        return '-'
+    if result == float('inf'):
+        return 'slower than the largest bucket'
+    return f'{result * 1000:g} ms'
+
+
+def stats_summary(values):
+    """Picks the figures shown by /stats out of a metrics snapshot.
+
+    Args:
+        values (dict): A snapshot from ``snapshot`` or ``merge_snapshots``.
+
+    Returns:
+        list: ``(name, text)`` pairs, one per line of the summary.
+    """
+    lag = values.get('event_loop_lag_seconds')
+    commands_handled = _combined(values, 'command_', '_latency_seconds')
+    extraction = values.get('resolver_latency_seconds')
+    database = _combined(values, 'db_', '_latency_seconds')
+    frames = values.get('audio_frame_seconds')
+    jitter = values.get('voice_send_jitter_seconds')
+    return [
+        ('Event loop lag', f'p50 {_milliseconds(lag, 0.5)}, p99 {_milliseconds(lag, 0.99)}'),
+        ('Commands', f"{commands_handled[2] if commands_handled else 0} handled, "
+                     f"{values.get('command_errors_total', 0)} failed, p99 {_milliseconds(commands_handled, 0.99)}"),
+        ('Extraction', f"{extraction[2] if extraction else 0} lookups, p50 {_milliseconds(extraction, 0.5)}, "
+                       f"p99 {_milliseconds(extraction, 0.99)}"),
+        ('Database', f"{database[2] if database else 0} calls, p99 {_milliseconds(database, 0.99)}"),
+        ('Audio frames', f"p99 {_milliseconds(frames, 0.99)} to produce, "
+                         f"{values.get('audio_underruns_total', 0)} underruns"),
+        ('Voice send jitter', f'p50 {_milliseconds(jitter, 0.5)}, p99 {_milliseconds(jitter, 0.99)}'),
+    ]
+
+
+class MetricsServer:
+    """
+    Serves this process's metrics at ``/metrics`` in the Prometheus text format.
+
+    It listens on METRICS_HOST, the local interface by default, so metrics
+    are only reachable from the machine unless configured otherwise.
+    """
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        """
+        Starts serving; a port that is already taken is logged rather than raised.
+        """
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except OSError as e:
+            logging.error(f'Could not serve metrics on {self.host}:{self.port}: {e}')
+            await runner.cleanup()
+            return
+        self._runner = runner
+        logging.info(f'Serving metrics on http://{self.host}:{self.port}/metrics')
+
+    async def _metrics(self, request):
+        return web.Response(text=exposition(), content_type='text/plain')
+
+    async def close(self):
+        """
+        Stops serving.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
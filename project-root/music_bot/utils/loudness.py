@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+
+from music_bot.config import (
+    LOUDNESS_ANALYSIS_CONCURRENCY,
+    LOUDNESS_CACHE_SIZE,
+    LOUDNESS_PEAK_CEILING,
+    LOUDNESS_TARGET_LUFS,
+)
+from music_bot.utils.audio import _before_options
+from music_bot.utils.metrics import counter, histogram
+
+analyses = counter('loudness_analyses_total', 'Tracks whose loudness was measured.')
+analysis_failures = counter('loudness_analysis_failures_total', 'Loudness measurements that failed.')
+analysis_latency = histogram('loudness_analysis_seconds', 'Time taken to measure the loudness of a track.')
+
+# The summary FFmpeg's ebur128 filter prints once the input ends
+_INTEGRATED = re.compile(r'Integrated loudness:\s+I:\s+(-?[\d.]+|-inf) LUFS')
+_TRUE_PEAK = re.compile(r'True peak:\s+Peak:\s+(-?[\d.]+|-inf) dBFS')
+
+
+def parse_ebur128(output):
+    """Reads integrated loudness and true peak from FFmpeg's ebur128 summary.
+
+    Args:
+        output (str): FFmpeg's stderr output.
+
+    Returns:
+        tuple: The integrated loudness (LUFS) and true peak (dBTP), or None if the summary is missing.
+    """
+    loudness = _INTEGRATED.search(output)
+    peak = _TRUE_PEAK.search(output)
+    if not loudness or not peak or loudness.group(1) == '-inf':
+        return None
+    # A silent track has no peak; treat it as the quietest level ebur128 reports
+    return float(loudness.group(1)), (float(peak.group(1)) if peak.group(1) != '-inf' else -70.0)
+
+
+def replay_gain(loudness, peak, target=LOUDNESS_TARGET_LUFS, ceiling=LOUDNESS_PEAK_CEILING):
+    """Works out the fixed gain that brings a track to the target loudness.
+
+    The gain is lowered where needed so the track's peak stays under the ceiling.
+
+    Args:
+        loudness (float): The track's integrated loudness in LUFS.
+        peak (float): The track's true peak in dBTP.
+        target (float): The loudness to play at, in LUFS.
+        ceiling (float): The highest peak allowed after the gain, in dBTP.
+
+    Returns:
+        float: The gain in dB.
+    """
+    return min(target - loudness, ceiling - peak)
+
+
+async def analyze_loudness(url, cached=False):
+    """Measures a stream's integrated loudness and true peak with FFmpeg.
+
+    FFmpeg runs as a separate process and decodes the stream as fast as it
+    can be downloaded, so the measurement does not use the event loop.
+
+    Args:
+        url (str): The stream URL.
+        cached (bool): Whether url is a file from the audio cache.
+
+    Returns:
+        tuple: The integrated loudness (LUFS) and true peak (dBTP), or None if it could not be measured.
+    """
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-hide_banner', '-nostats', *_before_options(0, cached).split(), '-i', url,
+        # framelog=verbose keeps the per-frame readings out of stderr, leaving just the summary
+        '-vn', '-af', 'ebur128=peak=true:framelog=verbose', '-f', 'null', '-',
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    return parse_ebur128(stderr.decode(errors='replace'))
+
+
+class LoudnessService:
+    """
+    Measures each track's loudness once and remembers the gain that normalizes it.
+
+    The first time a track is played its stream is analyzed in the background,
+    at most LOUDNESS_ANALYSIS_CONCURRENCY at a time. Results are kept in memory
+    and, when a database is given, stored next to the track cache so later plays
+    can normalize with a fixed gain instead of measuring every frame.
+    """
+
+    def __init__(self, database=None, concurrency=LOUDNESS_ANALYSIS_CONCURRENCY, max_entries=LOUDNESS_CACHE_SIZE):
+        self.database = database
+        self.max_entries = max_entries
+        self._gains = OrderedDict()
+        self._pending = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def _remember(self, track_id, gain):
+        self._gains[track_id] = gain
+        self._gains.move_to_end(track_id)
+        while len(self._gains) > self.max_entries:
+            self._gains.popitem(last=False)
+
+    async def get_gain(self, track_id):
+        """
+        Returns the normalizing gain of a track if it has been analyzed.
+
+        Args:
+            track_id (str): The canonical track ID.
+
+        Returns:
+            float: The gain in dB, or None if the track has not been analyzed yet.
+        """
+        gain = self._gains.get(track_id)
+        if gain is not None:
+            self._gains.move_to_end(track_id)
+            return gain
+        if self.database is not None:
+            entry = await self.database.get_track_loudness(track_id)
+            if entry is not None:
+                gain = replay_gain(*entry)
+                self._remember(track_id, gain)
+                return gain
+        return None
+
+    def analyze(self, track_id, url, cached=False):
+        """
+        Starts measuring a track in the background unless that is already under way.
+
+        Args:
+            track_id (str): The canonical track ID.
+            url (str): The track's stream URL, or its file in the audio cache.
+            cached (bool): Whether url is a file from the audio cache.
+        """
+        if track_id in self._gains or track_id in self._pending:
+            return
+        self._pending[track_id] = asyncio.get_running_loop().create_task(self._analyze(track_id, url, cached))
+
+    async def _analyze(self, track_id, url, cached):
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                started_at = loop.time()
+                result = await analyze_loudness(url, cached)
+                analysis_latency.observe(loop.time() - started_at)
+            if result is None:
+                analysis_failures.inc()
+                logging.warning(f'Could not measure the loudness of {track_id}')
+                return
+            analyses.inc()
+            self._remember(track_id, replay_gain(*result))
+            if self.database is not None:
+                self.database.set_track_loudness(track_id, *result)
+        except Exception as e:
+            analysis_failures.inc()
+            logging.error(f'Error measuring the loudness of {track_id}: {e}')
+        finally:
+            del self._pending[track_id]
+
+    def close(self):
+        """
+        Cancels analyses that are still running.
+        """
+        for task in self._pending.values():
+            task.cancel()
@@ -1,12 +1,30 @@
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+
+import discord
 import lyricsgenius
-from music_bot.config import GENIUS_API_KEY
+from music_bot.config import GENIUS_API_KEY, LYRICS_CACHE_SIZE, LYRICS_CACHE_TTL, LYRICS_MISS_TTL
+from music_bot.utils.metrics import counter
+
+# Discord's limit for an embed description
+EMBED_DESCRIPTION_LIMIT = 4096
+
+# Decorations that differ between uploads of the same song
+TITLE_NOISE = re.compile(r'\(.*?\)|\[.*?\]|\b(?:feat|ft)\..*$|official (?:music )?(?:video|audio)|lyrics?', re.IGNORECASE)
+
+lyrics_hits = counter('lyrics_cache_hits_total', 'Lyrics lookups served from memory, including cached misses.')
+lyrics_misses = counter('lyrics_cache_misses_total', 'Lyrics lookups that went to Genius.')
 
 class LyricsGetter:
     """
     A class to fetch lyrics using the Genius API.
     """
-    def __init__(self):
-        self.genius = lyricsgenius.Genius(GENIUS_API_KEY)
+    def __init__(self, genius=None):
+        # Reuse the shared Genius client when one is given
+        self.genius = genius or lyricsgenius.Genius(GENIUS_API_KEY)
 
     def get_lyrics(self, song_title, artist_name):
         """
@@ -26,5 +44,147 @@ class LyricsGetter:
             else:
                 return None
         except Exception as e:
-            print(f"Error fetching lyrics: {e}")
-            return None
\ No newline at end of file
+            logging.error(f"Error fetching lyrics: {e}")
+            return None
+
+def lyrics_key(song_title, artist_name):
+    """Normalizes a title and artist into a lyrics cache key.
+
+    Args:
+        song_title (str): The title of the song.
+        artist_name (str): The name of the artist.
+
+    Returns:
+        str: The normalized key.
+    """
+    title = ' '.join(TITLE_NOISE.sub(' ', song_title or '').lower().split())
+    artist = ' '.join((artist_name or '').lower().split())
+    return f"{artist}|{title}"
+
+
+def lyrics_embeds(song_title, artist_name, lyrics):
+    """Splits lyrics into embeds that each fit Discord's description limit.
+
+    Pages are split on line breaks so no line is cut in half.
+
+    Args:
+        song_title (str): The title of the song.
+        artist_name (str): The name of the artist.
+        lyrics (str): The lyrics.
+
+    Returns:
+        list: The discord.Embed pages.
+    """
+    pages = []
+    page = ''
+    for line in lyrics.splitlines(keepends=True):
+        while len(line) > EMBED_DESCRIPTION_LIMIT:
+            pages.append(line[:EMBED_DESCRIPTION_LIMIT])
+            line = line[EMBED_DESCRIPTION_LIMIT:]
+        if len(page) + len(line) > EMBED_DESCRIPTION_LIMIT:
+            pages.append(page)
+            page = ''
+        page += line
+    if page:
+        pages.append(page)
+
+    return [
+        discord.Embed(title=f"{song_title} by {artist_name} ({index}/{len(pages)})", description=text)
+        for index, text in enumerate(pages, start=1)
+    ]
+
+
+class LyricsService:
+    """
+    Looks up lyrics off the event loop and caches the results.
+
+    Lyrics are cached by normalized title and artist in memory and, when a
+    database is given, on disk. Songs without lyrics are cached as misses for
+    a shorter time so they are not searched on every request.
+    """
+
+    def __init__(self, clients, database=None, max_entries=LYRICS_CACHE_SIZE):
+        self.clients = clients
+        self.database = database
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    def _search(self, song_title, artist_name):
+        # Unlike LyricsGetter, errors propagate so they are not cached as misses
+        song = self.clients.genius.search_song(song_title, artist_name)
+        return song.lyrics if song else None
+
+    def _cached(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.time():
+            self._entries.move_to_end(key)
+            return entry
+        return None
+
+    def _remember(self, key, lyrics, expires_at):
+        self._entries[key] = (lyrics, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load(self, key, song_title, artist_name):
+        try:
+            if self.database is not None:
+                entry = await self.database.get_cached_lyrics(key)
+                if entry is not None and entry[1] > time.time():
+                    self._remember(key, *entry)
+                    return entry[0]
+
+            lyrics_misses.inc()
+            lyrics = await self.clients.call('genius', self._search, song_title, artist_name)
+            expires_at = time.time() + (LYRICS_CACHE_TTL if lyrics else LYRICS_MISS_TTL)
+            self._remember(key, lyrics, expires_at)
+            if self.database is not None:
+                self.database.set_cached_lyrics(key, lyrics, expires_at)
+            return lyrics
+        finally:
+            del self._inflight[key]
+
+    def _start_load(self, key, song_title, artist_name):
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.get_running_loop().create_task(
+                self._load(key, song_title, artist_name)
+            )
+        return task
+
+    async def get_lyrics(self, song_title, artist_name):
+        """
+        Fetches lyrics for a given song and artist.
+
+        Args:
+            song_title (str): The title of the song.
+            artist_name (str): The name of the artist.
+
+        Returns:
+            str: The lyrics of the song, or None if not found.
+        """
+        key = lyrics_key(song_title, artist_name)
+        entry = self._cached(key)
+        if entry is not None:
+            lyrics_hits.inc()
+            return entry[0]
+        return await asyncio.shield(self._start_load(key, song_title, artist_name))
+
+    def prefetch(self, song_title, artist_name):
+        """
+        Starts fetching lyrics in the background so a later request answers instantly.
+
+        Args:
+            song_title (str): The title of the song.
+            artist_name (str): The name of the artist.
+        """
+        key = lyrics_key(song_title, artist_name)
+        if key in self._inflight or self._cached(key) is not None:
+            return
+        self._start_load(key, song_title, artist_name).add_done_callback(self._log_prefetch_error)
+
+    def _log_prefetch_error(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning(f"Error prefetching lyrics: {task.exception()}")
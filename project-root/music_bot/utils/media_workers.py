@@ -0,0 +1,595 @@
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import discord
+import numpy as np
+
+from music_bot.config import (
+    FFMPEG_OPTIONS,
+    LOGGING_LEVEL,
+    MEDIA_RING_FRAMES,
+    MEDIA_WORKER_RESTART_DELAY,
+    MEDIA_WORKER_RESTART_MAX_DELAY,
+    MEDIA_WORKER_THREADS,
+    MEDIA_WORKERS,
+)
+from music_bot.utils.errors import MediaWorkerError
+from music_bot.utils.filters import AudioFilters, FilterEngine
+from music_bot.utils.metrics import counter, gauge
+
+workers_running = gauge('media_workers_running', 'Media worker processes currently running.')
+worker_restarts = counter('media_worker_restarts_total', 'Media worker processes restarted after dying.')
+jobs_in_flight = gauge('media_jobs_in_flight', 'Calls submitted to media workers that have not returned yet.')
+jobs_lost = counter('media_jobs_lost_total', 'Calls that failed because their media worker died.')
+streams_open = gauge('media_streams_open', 'Audio streams being transcoded by media workers.')
+
+# Header of a FrameRing: frames written, frames read, times the writer found the ring full, end of stream, cancelled
+RING_HEADER = struct.Struct('<QQQII')
+WRITTEN, READ, STALLS, ENDED, CANCELLED = 0, 8, 16, 24, 28
+COUNT = struct.Struct('<Q')
+FLAG = struct.Struct('<I')
+# Every slot starts with the length of the frame in it
+SLOT_HEADER = struct.Struct('<H')
+# An encoded 20 ms frame is never larger than the PCM it was encoded from
+SLOT_SIZE = SLOT_HEADER.size + discord.opus.Encoder.FRAME_SIZE
+# Seconds a writer waits before checking a full ring again
+RING_POLL_INTERVAL = 0.005
+# A worker that ran this long before dying is restarted right away
+STABLE_SECONDS = 60
+
+
+class FrameRing:
+    """
+    A single-producer, single-consumer ring of audio frames in shared memory.
+
+    A media worker writes encoded frames into the ring and the bot hands them
+    to the voice client as memoryviews of the shared memory, so no frame is
+    pickled or copied on the way. Each side only ever writes its own counter,
+    which makes locks unnecessary; the slot returned by ``get`` stays reserved
+    until the next call. When the ring is full the writer waits, so a stream
+    never runs more than a ring's length ahead of playback.
+    """
+
+    def __init__(self, frames=MEDIA_RING_FRAMES, name=None):
+        self.frames = frames
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None,
+                                                 size=RING_HEADER.size + frames * SLOT_SIZE)
+        self.owner = name is None
+        self._buffer = self.memory.buf
+        self._view = None
+        if self.owner:
+            RING_HEADER.pack_into(self._buffer, 0, 0, 0, 0, 0, 0)
+
+    @property
+    def name(self):
+        """
+        str: The name other processes attach to the ring with.
+        """
+        return self.memory.name
+
+    def _header(self):
+        return RING_HEADER.unpack_from(self._buffer, 0)
+
+    @property
+    def fill(self):
+        """
+        float: The fraction of the ring holding frames that have not been read.
+        """
+        written, read, _, _, _ = self._header()
+        return (written - read) / self.frames
+
+    @property
+    def stalls(self):
+        """
+        int: How many frames the writer had to wait to write because the ring was full.
+        """
+        return COUNT.unpack_from(self._buffer, STALLS)[0]
+
+    @property
+    def ended(self):
+        """
+        bool: Whether the writer has finished and every frame has been read.
+        """
+        written, read, _, ended, _ = self._header()
+        return bool(ended) and read == written
+
+    @property
+    def cancelled(self):
+        """
+        bool: Whether the reader has stopped reading.
+        """
+        return bool(FLAG.unpack_from(self._buffer, CANCELLED)[0])
+
+    def put(self, frame):
+        """
+        Writes a frame, waiting while the ring is full.
+
+        Args:
+            frame (bytes): The encoded frame.
+
+        Returns:
+            bool: False if the reader stopped reading instead.
+        """
+        stalled = False
+        while True:
+            written, read, stalls, _, cancelled = self._header()
+            if cancelled:
+                return False
+            if written - read < self.frames:
+                break
+            if not stalled:
+                stalled = True
+                COUNT.pack_into(self._buffer, STALLS, stalls + 1)
+            time.sleep(RING_POLL_INTERVAL)
+        offset = RING_HEADER.size + (written % self.frames) * SLOT_SIZE
+        SLOT_HEADER.pack_into(self._buffer, offset, len(frame))
+        start = offset + SLOT_HEADER.size
+        self._buffer[start:start + len(frame)] = frame
+        # Only publish the frame once it is complete
+        COUNT.pack_into(self._buffer, WRITTEN, written + 1)
+        return True
+
+    def get(self):
+        """
+        Returns the next frame without waiting, releasing the one returned before.
+
+        Returns:
+            memoryview: The frame, or None if the ring is empty.
+        """
+        written, read, _, _, _ = self._header()
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+            read += 1
+            COUNT.pack_into(self._buffer, READ, read)
+        if read == written:
+            return None
+        offset = RING_HEADER.size + (read % self.frames) * SLOT_SIZE
+        length, = SLOT_HEADER.unpack_from(self._buffer, offset)
+        start = offset + SLOT_HEADER.size
+        self._view = self._buffer[start:start + length]
+        return self._view
+
+    def finish(self):
+        """
+        Marks the end of the stream once the frames written so far are read.
+        """
+        FLAG.pack_into(self._buffer, ENDED, 1)
+
+    def cancel(self):
+        """
+        Tells the writer to stop.
+        """
+        FLAG.pack_into(self._buffer, CANCELLED, 1)
+
+    def close(self):
+        """
+        Detaches from the ring, removing it if this process created it.
+        """
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        self._buffer.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class MediaStream:
+    """
+    The bot's handle on one stream being transcoded by a media worker.
+    """
+
+    __slots__ = ('stream_id', 'ring', 'worker', 'pool', 'lost')
+
+    def __init__(self, stream_id, ring, worker, pool):
+        self.stream_id = stream_id
+        self.ring = ring
+        self.worker = worker
+        self.pool = pool
+        # Set when the worker dies; frames already in the ring can still be read
+        self.lost = False
+
+    def update(self, **settings):
+        """
+        Changes the stream's volume or filters; the change is heard once the frames already in the ring have played.
+
+        Args:
+            **settings: ``volume`` (float) and/or ``filters`` (dict from AudioFilters.state).
+        """
+        if not self.lost:
+            self.pool._send(self.worker, ('settings', self.stream_id, settings))
+
+    def close(self):
+        """
+        Stops the stream and frees its ring.
+        """
+        self.ring.cancel()
+        self.pool._close_stream(self)
+        self.ring.close()
+
+
+class _MediaWorker:
+    """
+    The pool's record of one worker process.
+    """
+
+    __slots__ = ('index', 'process', 'connection', 'jobs', 'streams', 'started_at', 'delay', 'restart_at')
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.connection = None
+        self.jobs = set()
+        self.streams = {}
+        self.started_at = None
+        self.delay = 0
+        self.restart_at = None
+
+    @property
+    def load(self):
+        return len(self.jobs) + len(self.streams)
+
+
+class MediaWorkerPool(concurrent.futures.Executor):
+    """
+    Runs track extraction and audio transcoding in separate worker processes.
+
+    As an Executor it can stand in for the resolver's pool: submitted calls go
+    to the least busy worker and run on its threads. ``open_stream`` has a
+    worker decode a URL with FFmpeg, apply volume and filters and encode it to
+    Opus, writing the frames into a FrameRing the bot reads from, so none of
+    that work holds the bot's GIL. A worker that dies fails its pending calls,
+    marks its streams lost so their sources can reopen them elsewhere, and is
+    restarted, right away if it had been running for a while and with a
+    growing delay if it keeps crashing.
+    """
+
+    def __init__(self, workers=MEDIA_WORKERS, threads=MEDIA_WORKER_THREADS, ring_frames=MEDIA_RING_FRAMES,
+                 restart_delay=MEDIA_WORKER_RESTART_DELAY, max_restart_delay=MEDIA_WORKER_RESTART_MAX_DELAY):
+        if workers < 1:
+            raise ValueError('A media worker pool needs at least one worker.')
+        self.threads = threads
+        self.ring_frames = ring_frames
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        # Forked children would inherit the event loop's threads and locks in whatever state they were in
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._jobs = {}
+        self._closed = False
+        self._workers = [_MediaWorker(index) for index in range(workers)]
+        for worker in self._workers:
+            self._start(worker)
+        self._receiver = threading.Thread(target=self._receive, name='media-workers', daemon=True)
+        self._receiver.start()
+
+    def _start(self, worker):
+        connection, child_connection = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_connection, self.threads),
+                                        name=f'media-worker-{worker.index}', daemon=True)
+        process.start()
+        child_connection.close()
+        worker.process = process
+        worker.connection = connection
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        workers_running.inc()
+        logging.info(f'Started media worker {worker.index} (pid {process.pid})')
+
+    def _pick(self):
+        # Called with the lock held
+        if self._closed:
+            raise MediaWorkerError('the pool is shut down')
+        workers = [worker for worker in self._workers if worker.restart_at is None]
+        if not workers:
+            raise MediaWorkerError('every worker is restarting')
+        return min(workers, key=lambda worker: worker.load)
+
+    def _send(self, worker, item):
+        with self._lock:
+            if worker.restart_at is None and worker.connection is not None:
+                try:
+                    worker.connection.send(item)
+                except (OSError, EOFError):
+                    # Picked up by the receiver, which restarts the worker
+                    pass
+
+    def submit(self, fn, /, *args, **kwargs):
+        """
+        Runs a call on the least busy worker.
+
+        The function and its arguments and result must be picklable.
+
+        Args:
+            fn (callable): The function to run, defined at module level.
+            *args: Positional arguments passed to the function.
+            **kwargs: Keyword arguments passed to the function.
+
+        Returns:
+            concurrent.futures.Future: The call's result.
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            worker = self._pick()
+            job_id = next(self._ids)
+            worker.connection.send(('call', job_id, fn, args, kwargs))
+            worker.jobs.add(job_id)
+            self._jobs[job_id] = (future, worker)
+        jobs_in_flight.inc()
+        return future
+
+    def open_stream(self, url, before_options, volume=1.0, filters=None, track_gain=None):
+        """
+        Starts transcoding a stream on the least busy worker.
+
+        Args:
+            url (str): The stream URL or file path.
+            before_options (str): FFmpeg options placed before the input.
+            volume (float): The initial volume.
+            filters (dict): The filter settings from AudioFilters.state, if any.
+            track_gain (float): The track's normalizing gain in dB, if it has been measured.
+
+        Returns:
+            MediaStream: The stream, whose ring fills with Opus frames.
+        """
+        ring = FrameRing(self.ring_frames)
+        try:
+            with self._lock:
+                worker = self._pick()
+                stream = MediaStream(next(self._ids), ring, worker, self)
+                worker.connection.send(('stream', stream.stream_id, ring.name, ring.frames, url, before_options, volume,
+                                        filters, track_gain))
+                worker.streams[stream.stream_id] = stream
+        except BaseException:
+            ring.close()
+            raise
+        streams_open.inc()
+        return stream
+
+    def _close_stream(self, stream):
+        with self._lock:
+            if stream.worker.streams.pop(stream.stream_id, None) is None:
+                return
+        streams_open.dec()
+        self._send(stream.worker, ('stop', stream.stream_id))
+
+    def _receive(self):
+        # Runs on its own thread, since receiving from a pipe blocks
+        while not self._closed:
+            with self._lock:
+                connections = {worker.connection: worker for worker in self._workers if worker.restart_at is None}
+            for connection in wait(list(connections), timeout=0.5):
+                worker = connections[connection]
+                try:
+                    message = connection.recv()
+                except (OSError, EOFError):
+                    # The process has exited
+                    self._lost(worker)
+                    continue
+                self._handle(worker, message)
+            self._restart_due()
+
+    def _handle(self, worker, message):
+        kind = message[0]
+        if kind == 'result':
+            _, job_id, ok, value = message
+            with self._lock:
+                job = self._jobs.pop(job_id, None)
+                worker.jobs.discard(job_id)
+            if job is None:
+                return
+            jobs_in_flight.dec()
+            future = job[0]
+            if future.set_running_or_notify_cancel():
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        elif kind == 'ended':
+            # The worker finished writing; the ring stays open until the source has read it
+            with self._lock:
+                stream = worker.streams.pop(message[1], None)
+            if stream is not None:
+                streams_open.dec()
+
+    def _lost(self, worker):
+        with self._lock:
+            if self._closed or worker.restart_at is not None:
+                return
+            now = time.monotonic()
+            if now - worker.started_at >= STABLE_SECONDS:
+                worker.delay = 0
+            else:
+                worker.delay = min(max(worker.delay * 2, self.restart_delay), self.max_restart_delay)
+            worker.restart_at = now + worker.delay
+            worker.connection.close()
+            futures = [self._jobs.pop(job_id)[0] for job_id in worker.jobs]
+            worker.jobs.clear()
+            streams = list(worker.streams.values())
+            worker.streams.clear()
+        worker.process.join(1)
+        workers_running.dec()
+        jobs_in_flight.dec(len(futures))
+        jobs_lost.inc(len(futures))
+        streams_open.dec(len(streams))
+        for stream in streams:
+            stream.lost = True
+        for future in futures:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(MediaWorkerError(f'worker {worker.index} died'))
+        logging.error(f'Media worker {worker.index} exited with code {worker.process.exitcode}, losing '
+                      f'{len(futures)} calls and {len(streams)} streams; restarting in {worker.delay} seconds')
+
+    def _restart_due(self):
+        now = time.monotonic()
+        with self._lock:
+            for worker in self._workers:
+                if self._closed:
+                    return
+                if worker.restart_at is not None and now >= worker.restart_at:
+                    worker_restarts.inc()
+                    self._start(worker)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        """
+        Stops every worker.
+
+        Args:
+            wait (bool): Whether to wait for the workers to exit.
+            cancel_futures (bool): Ignored; calls that have not returned fail either way.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = [worker for worker in self._workers if worker.restart_at is None]
+            futures = [future for future, _ in self._jobs.values()]
+            self._jobs.clear()
+            for worker in workers:
+                try:
+                    worker.connection.send(('close',))
+                except (OSError, EOFError):
+                    pass
+        for future in futures:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(MediaWorkerError('the pool is shut down'))
+        jobs_in_flight.dec(len(futures))
+        workers_running.dec(len(workers))
+        if wait:
+            for worker in workers:
+                worker.process.join(5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+
+
+def _scale(frame, volume):
+    samples = np.frombuffer(frame, dtype=np.int16) * volume
+    np.clip(samples, -32768, 32767, out=samples)
+    return samples.astype(np.int16).tobytes()
+
+
+class _Transcoder:
+    """
+    A worker's side of one stream: FFmpeg PCM through filters and volume into Opus frames in a ring.
+    """
+
+    def __init__(self, ring, url, before_options, volume, filters, track_gain):
+        self.ring = ring
+        self.url = url
+        self.before_options = before_options
+        self.volume = volume
+        self.filters = AudioFilters()
+        if filters is not None:
+            self.filters.load(filters)
+        self.track_gain = track_gain
+        self.stopped = False
+
+    def update(self, settings):
+        if 'volume' in settings:
+            self.volume = settings['volume']
+        if 'filters' in settings:
+            self.filters.load(settings['filters'])
+
+    def run(self):
+        source = None
+        try:
+            source = discord.FFmpegPCMAudio(self.url, before_options=self.before_options, options=FFMPEG_OPTIONS)
+            encoder = discord.opus.Encoder()
+            engine = None
+            while not self.stopped:
+                frame = source.read()
+                if not frame:
+                    break
+                if self.filters.active:
+                    if engine is None:
+                        engine = FilterEngine(self.filters, self.track_gain)
+                    frame = engine.process(frame)
+                if self.volume != 1.0:
+                    frame = _scale(frame, self.volume)
+                if not self.ring.put(encoder.encode(frame, encoder.SAMPLES_PER_FRAME)):
+                    break
+        except Exception as e:
+            logging.error(f'Error transcoding {self.url}: {e}')
+        finally:
+            if source is not None:
+                source.cleanup()
+            self.ring.finish()
+            self.ring.close()
+
+
+def _worker_main(connection, threads):
+    # The bot handles Ctrl+C and stops its workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=LOGGING_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+    executor = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix='media-call')
+    send_lock = threading.Lock()
+    transcoders = {}
+
+    def reply(item):
+        with send_lock:
+            try:
+                connection.send(item)
+            except (OSError, EOFError):
+                # The bot has gone away; the main loop notices and exits
+                pass
+
+    def call(job_id, fn, args, kwargs):
+        try:
+            item = ('result', job_id, True, fn(*args, **kwargs))
+        except Exception as e:
+            item = ('result', job_id, False, e)
+        try:
+            reply(item)
+        except Exception as e:
+            # The result or exception could not be pickled
+            reply(('result', job_id, False, MediaWorkerError(f'could not return the result: {e}')))
+
+    def transcode(stream_id, transcoder):
+        try:
+            transcoder.run()
+        finally:
+            transcoders.pop(stream_id, None)
+            reply(('ended', stream_id))
+
+    while True:
+        try:
+            message = connection.recv()
+        except (OSError, EOFError):
+            break
+        kind = message[0]
+        if kind == 'call':
+            executor.submit(call, *message[1:])
+        elif kind == 'stream':
+            stream_id, ring_name, frames, url, before_options, volume, filters, track_gain = message[1:]
+            try:
+                ring = FrameRing(frames, ring_name)
+            except FileNotFoundError:
+                # Closed by the bot before the worker got to it
+                reply(('ended', stream_id))
+                continue
+            transcoder = transcoders[stream_id] = _Transcoder(ring, url, before_options, volume, filters, track_gain)
+            threading.Thread(target=transcode, args=(stream_id, transcoder), name=f'media-stream-{stream_id}',
+                             daemon=True).start()
+        elif kind == 'settings':
+            transcoder = transcoders.get(message[1])
+            if transcoder is not None:
+                transcoder.update(message[2])
+        elif kind == 'stop':
+            transcoder = transcoders.get(message[1])
+            if transcoder is not None:
+                transcoder.stopped = True
+        elif kind == 'close':
+            break
+    for transcoder in list(transcoders.values()):
+        transcoder.stopped = True
+    executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,127 @@
+import copy
+import threading
+
+from music_bot.utils.database import Database
+
+class MemoryDatabase(Database):
+    """
+    Keeps everything in process memory. Nothing survives a restart.
+
+    Meant for tests and benchmarks, where it isolates the cost of the code
+    above the storage layer.
+    """
+
+    def __init__(self):
+        self.playlists = {}
+        self.user_preferences = {}
+        self.bot_settings = {}
+        self.guild_settings = {}
+        self.track_cache = {}
+        self.track_loudness = {}
+        self.lyrics_cache = {}
+        self.player_state = {}
+        self.player_state_log = {}
+        # AsyncDatabase reads and writes from different threads
+        self._lock = threading.Lock()
+
+    def create_playlist(self, playlist_name, user_id):
+        with self._lock:
+            self.playlists.setdefault((user_id, playlist_name), [])
+
+    def add_songs_to_playlist(self, playlist_name, song_urls, user_id):
+        with self._lock:
+            songs = self.playlists.get((user_id, playlist_name))
+            if songs is not None:
+                songs.extend(song_urls)
+
+    def remove_songs_from_playlist(self, playlist_name, song_urls, user_id):
+        with self._lock:
+            songs = self.playlists.get((user_id, playlist_name))
+            if songs is not None:
+                removed = set(song_urls)
+                songs[:] = [url for url in songs if url not in removed]
+
+    def delete_playlist(self, playlist_name, user_id):
+        with self._lock:
+            self.playlists.pop((user_id, playlist_name), None)
+
+    def get_playlist(self, playlist_name, user_id):
+        with self._lock:
+            songs = self.playlists.get((user_id, playlist_name))
+            return list(songs) if songs is not None else None
+
+    def get_all_playlists(self, user_id):
+        with self._lock:
+            return [name for owner, name in self.playlists if owner == user_id]
+
+    def set_user_preference(self, user_id, preference_name, preference_value):
+        with self._lock:
+            self.user_preferences[(user_id, preference_name)] = preference_value
+
+    def get_user_preference(self, user_id, preference_name):
+        with self._lock:
+            return self.user_preferences.get((user_id, preference_name))
+
+    def set_bot_setting(self, setting_name, setting_value):
+        with self._lock:
+            self.bot_settings[setting_name] = setting_value
+
+    def get_bot_setting(self, setting_name):
+        with self._lock:
+            return self.bot_settings.get(setting_name)
+
+    def set_guild_setting(self, guild_id, setting_name, setting_value):
+        with self._lock:
+            self.guild_settings[(guild_id, setting_name)] = setting_value
+
+    def get_guild_setting(self, guild_id, setting_name):
+        with self._lock:
+            return self.guild_settings.get((guild_id, setting_name))
+
+    def get_guild_settings(self, setting_name):
+        with self._lock:
+            return {guild_id: value for (guild_id, name), value in self.guild_settings.items() if name == setting_name}
+
+    def get_cached_track(self, track_id):
+        with self._lock:
+            entry = self.track_cache.get(track_id)
+            return (copy.deepcopy(entry[0]), entry[1]) if entry else None
+
+    def set_cached_track(self, track_id, track, expires_at):
+        with self._lock:
+            self.track_cache[track_id] = (copy.deepcopy(track), expires_at)
+
+    def delete_cached_track(self, track_id):
+        with self._lock:
+            self.track_cache.pop(track_id, None)
+
+    def get_track_loudness(self, track_id):
+        with self._lock:
+            return self.track_loudness.get(track_id)
+
+    def set_track_loudness(self, track_id, loudness, peak):
+        with self._lock:
+            self.track_loudness[track_id] = (loudness, peak)
+
+    def get_player_state(self, guild_id):
+        with self._lock:
+            snapshot = self.player_state.get(guild_id)
+            deltas = self.player_state_log.get(guild_id, [])
+            return copy.deepcopy(snapshot), copy.deepcopy(deltas)
+
+    def append_player_state(self, guild_id, delta):
+        with self._lock:
+            self.player_state_log.setdefault(guild_id, []).append(copy.deepcopy(delta))
+
+    def save_player_state(self, guild_id, snapshot):
+        with self._lock:
+            self.player_state[guild_id] = copy.deepcopy(snapshot)
+            self.player_state_log.pop(guild_id, None)
+
+    def get_cached_lyrics(self, lyrics_key):
+        with self._lock:
+            return self.lyrics_cache.get(lyrics_key)
+
+    def set_cached_lyrics(self, lyrics_key, lyrics, expires_at):
+        with self._lock:
+            self.lyrics_cache[lyrics_key] = (lyrics, expires_at)
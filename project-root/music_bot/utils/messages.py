@@ -0,0 +1,220 @@
+import asyncio
+import logging
+from collections import deque
+
+from music_bot.config import (
+    CHANNEL_MESSAGE_BURST,
+    CHANNEL_MESSAGE_RATE,
+    GLOBAL_MESSAGE_RATE,
+    MESSAGE_COALESCE_WINDOW,
+)
+from music_bot.utils.metrics import counter
+from music_bot.utils.ratelimit import RateLimiter
+
+messages_sent = counter('chat_messages_sent_total', 'Messages posted to text channels.')
+updates_coalesced = counter('chat_updates_coalesced_total', 'Updates merged into a message with other updates.')
+now_playing_edits = counter('chat_now_playing_edits_total', 'Now playing messages edited in place instead of posted.')
+send_failures = counter('chat_send_failures_total', 'Messages Discord refused or failed to deliver.')
+
+# Discord rejects messages longer than this
+MESSAGE_LIMIT = 2000
+
+
+class _Outbox:
+    """
+    Messages waiting to be sent to one channel.
+    """
+
+    __slots__ = ('channel', 'limiter', 'pending', 'edits', 'now_playing', 'now_playing_message', 'flusher')
+
+    def __init__(self, channel, rate, burst):
+        self.channel = channel
+        self.limiter = RateLimiter(rate, burst)
+        # (content, embed) pairs in the order they were sent
+        self.pending = deque()
+        # Message ID -> (message, content) of edits not made yet; only the latest content is sent
+        self.edits = {}
+        self.now_playing = None
+        self.now_playing_message = None
+        self.flusher = None
+
+
+class MessageScheduler:
+    """
+    Sends bot messages through one outbox per text channel.
+
+    Text sent to a channel within MESSAGE_COALESCE_WINDOW seconds is merged
+    into as few messages as Discord's length limit allows, and only the latest
+    now playing update is shown, edited into the previous one while that is
+    still the last message in the channel. Each channel has its own token
+    bucket matching Discord's per-channel limit, and all channels share one
+    for the global limit, so messages wait their turn here instead of being
+    answered with a 429.
+    """
+
+    def __init__(self, window=MESSAGE_COALESCE_WINDOW, rate=CHANNEL_MESSAGE_RATE, burst=CHANNEL_MESSAGE_BURST,
+                 global_rate=GLOBAL_MESSAGE_RATE):
+        self.window = window
+        self.rate = rate
+        self.burst = burst
+        self._global = RateLimiter(global_rate)
+        self._outboxes = {}
+
+    def _outbox(self, channel):
+        outbox = self._outboxes.get(channel.id)
+        if outbox is None:
+            outbox = self._outboxes[channel.id] = _Outbox(channel, self.rate, self.burst)
+        if outbox.flusher is None:
+            outbox.flusher = asyncio.get_running_loop().create_task(self._flush(outbox))
+        return outbox
+
+    def send(self, channel, content=None, embed=None):
+        """
+        Queues a message for a channel; text is merged with other text sent close to it.
+
+        Args:
+            channel (discord.abc.Messageable): The channel to post in.
+            content (str): The text of the message.
+            embed (discord.Embed): An embed to post on its own, if any.
+        """
+        self._outbox(channel).pending.append((content, embed))
+
+    async def post(self, channel, content=None, embed=None):
+        """
+        Sends a message on its own right away, within the rate limits, so it can be edited later.
+
+        Args:
+            channel (discord.abc.Messageable): The channel to post in.
+            content (str): The text of the message.
+            embed (discord.Embed): An embed to post, if any.
+
+        Returns:
+            discord.Message: The sent message.
+        """
+        outbox = self._outbox(channel)
+        message = await self._request(outbox, channel.send, content=content, embed=embed)
+        outbox.now_playing_message = None
+        return message
+
+    def edit(self, message, content):
+        """
+        Replaces the text of a message sent earlier; an edit that has not been made yet is replaced.
+
+        Args:
+            message (discord.Message): The message to edit.
+            content (str): The new text.
+        """
+        outbox = self._outbox(message.channel)
+        if message.id in outbox.edits:
+            updates_coalesced.inc()
+        outbox.edits[message.id] = (message, content)
+
+    def now_playing(self, channel, content):
+        """
+        Shows the song that is playing, replacing an update that has not been shown yet.
+
+        Args:
+            channel (discord.abc.Messageable): The channel to post in.
+            content (str): The now playing text.
+        """
+        outbox = self._outbox(channel)
+        if outbox.now_playing is not None:
+            updates_coalesced.inc()
+        outbox.now_playing = content
+
+    async def _flush(self, outbox):
+        try:
+            # Give updates arriving right after this one a chance to join it
+            await asyncio.sleep(self.window)
+            while outbox.pending:
+                content, embed = self._next_message(outbox.pending)
+                try:
+                    await self._request(outbox, outbox.channel.send, content=content, embed=embed)
+                except Exception as e:
+                    self._failed(outbox, e)
+                    continue
+                # Anything posted after the now playing message pushes it out of view
+                outbox.now_playing_message = None
+            while outbox.edits:
+                message, content = outbox.edits.pop(next(iter(outbox.edits)))
+                try:
+                    await self._request(outbox, message.edit, content=content)
+                except Exception as e:
+                    self._failed(outbox, e)
+            if outbox.now_playing is not None:
+                content, outbox.now_playing = outbox.now_playing, None
+                await self._show_now_playing(outbox, content)
+        finally:
+            outbox.flusher = None
+            if outbox.pending or outbox.edits or outbox.now_playing is not None:
+                # More arrived while the last message was being sent
+                outbox.flusher = asyncio.get_running_loop().create_task(self._flush(outbox))
+            elif outbox.now_playing_message is None:
+                # Keep the bucket until it has refilled, so the channel's next message cannot start a fresh burst
+                asyncio.get_running_loop().call_later(self.burst / self.rate, self._forget, outbox)
+
+    def _forget(self, outbox):
+        channel_id = outbox.channel.id
+        if self._outboxes.get(channel_id) is outbox and outbox.flusher is None and outbox.now_playing_message is None:
+            del self._outboxes[channel_id]
+
+    @staticmethod
+    def _next_message(pending):
+        content, embed = pending.popleft()
+        if embed is not None or content is None:
+            return content, embed
+        # Merge following text until an embed or the length limit
+        lines = [content]
+        length = len(content)
+        while pending:
+            next_content, next_embed = pending[0]
+            if next_embed is not None or next_content is None or length + 1 + len(next_content) > MESSAGE_LIMIT:
+                break
+            pending.popleft()
+            lines.append(next_content)
+            length += 1 + len(next_content)
+            updates_coalesced.inc()
+        return '\n'.join(lines), None
+
+    async def _show_now_playing(self, outbox, content):
+        message = outbox.now_playing_message
+        if message is not None and getattr(outbox.channel, 'last_message_id', None) == message.id:
+            try:
+                await self._request(outbox, message.edit, content=content)
+                now_playing_edits.inc()
+                return
+            except Exception as e:
+                self._failed(outbox, e)
+        outbox.now_playing_message = None
+        try:
+            outbox.now_playing_message = await self._request(outbox, outbox.channel.send, content=content)
+        except Exception as e:
+            self._failed(outbox, e)
+
+    async def _request(self, outbox, method, **kwargs):
+        # Wait for both buckets so the request goes out within Discord's limits
+        await self._global.acquire()
+        await outbox.limiter.acquire()
+        response = await method(**kwargs)
+        messages_sent.inc()
+        return response
+
+    @staticmethod
+    def _failed(outbox, error):
+        send_failures.inc()
+        # Connection errors and timeouts never reached Discord, so they carry no status
+        if getattr(error, 'status', None) == 429:
+            outbox.limiter.penalize(float(error.response.headers.get('Retry-After', 1)))
+        logging.error(f'Could not send a message to channel {outbox.channel.id}: {error}')
+
+    def close(self):
+        """
+        Cancels messages that have not been sent yet.
+        """
+        for outbox in self._outboxes.values():
+            outbox.pending.clear()
+            outbox.edits.clear()
+            outbox.now_playing = None
+            if outbox.flusher is not None:
+                outbox.flusher.cancel()
+        self._outboxes.clear()
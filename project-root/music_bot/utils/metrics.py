@@ -0,0 +1,286 @@
+import bisect
+import threading
+
+# Default latency buckets (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Counter:
+    """
+    A monotonically increasing counter.
+    """
+
+    def __init__(self, name, description=''):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        Increments the counter.
+
+        Args:
+            amount (int): The amount to add.
+        """
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """
+    A value that can go up and down, such as the number of running workers.
+    """
+
+    def __init__(self, name, description=''):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        """
+        Sets the gauge.
+
+        Args:
+            value (float): The new value.
+        """
+        with self._lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        """
+        Raises the gauge.
+
+        Args:
+            amount (float): The amount to add.
+        """
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        """
+        Lowers the gauge.
+
+        Args:
+            amount (float): The amount to subtract.
+        """
+        with self._lock:
+            self.value -= amount
+
+
+class Histogram:
+    """
+    A bucketed histogram for latency-style observations.
+    """
+
+    def __init__(self, name, description='', buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Records a single observation.
+
+        Args:
+            value (float): The observed value.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def percentile(self, q):
+        """
+        Estimates a percentile from the bucket counts.
+
+        Args:
+            q (float): The percentile to estimate, between 0 and 1.
+
+        Returns:
+            float: The upper bound of the bucket holding the percentile, or None if empty.
+        """
+        with self._lock:
+            return percentile((self.buckets, self.counts, self.count, self.sum), q)
+
+
+def percentile(value, q):
+    """
+    Estimates a percentile of a histogram from ``snapshot``.
+
+    Args:
+        value (tuple): The histogram's ``(buckets, counts, count, sum)`` tuple.
+        q (float): The percentile to estimate, between 0 and 1.
+
+    Returns:
+        float: The upper bound of the bucket holding the percentile, or None if empty.
+    """
+    buckets, counts, count, _ = value
+    if not count:
+        return None
+    target = q * count
+    seen = 0
+    for index, bucket_count in enumerate(counts):
+        seen += bucket_count
+        if seen >= target:
+            return buckets[index] if index < len(buckets) else float('inf')
+    return float('inf')
+
+
+def _get_or_create(cls, name, *args):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} is already registered as a {type(metric).__name__}.")
+        return metric
+
+
+def counter(name, description=''):
+    """
+    Returns the counter registered under the given name, creating it if needed.
+
+    Args:
+        name (str): The metric name.
+        description (str): A short description of the metric.
+
+    Returns:
+        Counter: The registered counter.
+    """
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name, description=''):
+    """
+    Returns the gauge registered under the given name, creating it if needed.
+
+    Args:
+        name (str): The metric name.
+        description (str): A short description of the metric.
+
+    Returns:
+        Gauge: The registered gauge.
+    """
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name, description='', buckets=DEFAULT_BUCKETS):
+    """
+    Returns the histogram registered under the given name, creating it if needed.
+
+    Args:
+        name (str): The metric name.
+        description (str): A short description of the metric.
+        buckets (tuple): The bucket upper bounds.
+
+    Returns:
+        Histogram: The registered histogram.
+    """
+    return _get_or_create(Histogram, name, description, buckets)
+
+
+def all_metrics():
+    """
+    Returns a snapshot of every registered metric.
+
+    Returns:
+        list: The registered metrics, sorted by name.
+    """
+    with _registry_lock:
+        return [_registry[name] for name in sorted(_registry)]
+
+
+def snapshot():
+    """
+    Returns the current values of every registered metric in a form that can be sent to another process.
+
+    Returns:
+        dict: Counter and gauge values and histogram ``(buckets, counts, count, sum)`` tuples, keyed by metric name.
+    """
+    values = {}
+    for metric in all_metrics():
+        with metric._lock:
+            if isinstance(metric, Histogram):
+                values[metric.name] = (metric.buckets, list(metric.counts), metric.count, metric.sum)
+            else:
+                values[metric.name] = metric.value
+    return values
+
+
+def merge_snapshots(snapshots):
+    """
+    Adds up snapshots taken in several processes.
+
+    Histograms are only merged with histograms that use the same buckets.
+
+    Args:
+        snapshots (iterable): Snapshots returned by ``snapshot``.
+
+    Returns:
+        dict: The combined snapshot.
+    """
+    merged = {}
+    for values in snapshots:
+        for name, value in values.items():
+            total = merged.get(name)
+            if total is None:
+                merged[name] = value
+            elif isinstance(value, tuple):
+                if value[0] == total[0]:
+                    merged[name] = (total[0], [a + b for a, b in zip(total[1], value[1])], total[2] + value[2],
+                                    total[3] + value[3])
+            else:
+                merged[name] = total + value
+    return merged
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition(values=None):
+    """
+    Renders metrics in the Prometheus text exposition format.
+
+    Args:
+        values (dict): A snapshot to render, such as the merged one of a cluster, or None for this process's metrics.
+
+    Returns:
+        str: The metrics, one ``# HELP``/``# TYPE`` block per metric.
+    """
+    if values is None:
+        values = snapshot()
+    with _registry_lock:
+        registered = dict(_registry)
+    lines = []
+    for name in sorted(values):
+        value = values[name]
+        metric = registered.get(name)
+        if metric is not None and metric.description:
+            lines.append(f'# HELP {name} {metric.description}')
+        if isinstance(value, tuple):
+            buckets, counts, count, total = value
+            lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, bucket_count in zip((*buckets, float('inf')), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{le="{_format(bound)}"}} {cumulative}')
+            lines.append(f'{name}_sum {_format(total)}')
+            lines.append(f'{name}_count {count}')
+        else:
+            kind = 'gauge' if isinstance(metric, Gauge) or (metric is None and not name.endswith('_total')) else 'counter'
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {_format(value)}')
+    return '\n'.join(lines) + '\n'
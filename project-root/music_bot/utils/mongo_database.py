@@ -0,0 +1,187 @@
+import pymongo
+
+from music_bot.utils.database import Database
+
+class MongoDatabase(Database):
+    """
+    Stores everything in MongoDB collections.
+
+    pymongo pools connections and is thread safe, so one instance serves every reader.
+    """
+
+    def __init__(self, database_url, database_name):
+        self.client = pymongo.MongoClient(database_url)
+        self.db = self.client[database_name]
+        self.create_indexes()
+
+    def create_indexes(self):
+        """
+        Creates the indexes backing every lookup.
+        """
+        playlists_index = self.db.playlists.index_information().get("user_id_1_name_1")
+        if playlists_index is not None and not playlists_index.get("unique"):
+            self._deduplicate_playlists()
+            self.db.playlists.drop_index("user_id_1_name_1")
+        self.db.playlists.create_index([("user_id", pymongo.ASCENDING), ("name", pymongo.ASCENDING)], unique=True)
+        self.db.user_preferences.create_index(
+            [("user_id", pymongo.ASCENDING), ("preference_name", pymongo.ASCENDING)], unique=True
+        )
+        self.db.bot_settings.create_index("setting_name", unique=True)
+        self.db.guild_settings.create_index(
+            [("guild_id", pymongo.ASCENDING), ("setting_name", pymongo.ASCENDING)], unique=True
+        )
+        self.db.guild_settings.create_index("setting_name")
+        self.db.player_state_log.create_index([("guild_id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+
+    def _deduplicate_playlists(self):
+        # Lookups only ever found the first of a user's playlists with the same name, so drop the rest
+        duplicates = self.db.playlists.aggregate([
+            {"$sort": {"_id": pymongo.ASCENDING}},
+            {"$group": {"_id": {"user_id": "$user_id", "name": "$name"}, "ids": {"$push": "$_id"}}},
+            {"$match": {"ids.1": {"$exists": True}}},
+        ])
+        for duplicate in duplicates:
+            self.db.playlists.delete_many({"_id": {"$in": duplicate["ids"][1:]}})
+
+    def create_playlist(self, playlist_name, user_id):
+        self.db.playlists.update_one(
+            {"name": playlist_name, "user_id": user_id},
+            {"$setOnInsert": {"songs": []}},
+            upsert=True
+        )
+
+    def add_songs_to_playlist(self, playlist_name, song_urls, user_id):
+        self.db.playlists.update_one(
+            {"name": playlist_name, "user_id": user_id},
+            {"$push": {"songs": {"$each": list(song_urls)}}}
+        )
+
+    def remove_songs_from_playlist(self, playlist_name, song_urls, user_id):
+        self.db.playlists.update_one(
+            {"name": playlist_name, "user_id": user_id},
+            {"$pull": {"songs": {"$in": list(song_urls)}}}
+        )
+
+    def delete_playlist(self, playlist_name, user_id):
+        self.db.playlists.delete_one({"name": playlist_name, "user_id": user_id})
+
+    def get_playlist(self, playlist_name, user_id):
+        playlist = self.db.playlists.find_one({"name": playlist_name, "user_id": user_id})
+        if playlist:
+            return playlist["songs"]
+        else:
+            return None
+
+    def get_all_playlists(self, user_id):
+        playlists = self.db.playlists.find({"user_id": user_id})
+        return [playlist["name"] for playlist in playlists]
+
+    def set_user_preference(self, user_id, preference_name, preference_value):
+        self.db.user_preferences.update_one(
+            {"user_id": user_id, "preference_name": preference_name},
+            {"$set": {"preference_value": preference_value}},
+            upsert=True  # Create the document if it doesn't exist
+        )
+
+    def get_user_preference(self, user_id, preference_name):
+        preference = self.db.user_preferences.find_one({"user_id": user_id, "preference_name": preference_name})
+        if preference:
+            return preference["preference_value"]
+        else:
+            return None
+
+    def set_bot_setting(self, setting_name, setting_value):
+        self.db.bot_settings.update_one(
+            {"setting_name": setting_name},
+            {"$set": {"setting_value": setting_value}},
+            upsert=True  # Create the document if it doesn't exist
+        )
+
+    def get_bot_setting(self, setting_name):
+        setting = self.db.bot_settings.find_one({"setting_name": setting_name})
+        if setting:
+            return setting["setting_value"]
+        else:
+            return None
+
+    def set_guild_setting(self, guild_id, setting_name, setting_value):
+        self.db.guild_settings.update_one(
+            {"guild_id": guild_id, "setting_name": setting_name},
+            {"$set": {"setting_value": setting_value}},
+            upsert=True
+        )
+
+    def get_guild_setting(self, guild_id, setting_name):
+        setting = self.db.guild_settings.find_one({"guild_id": guild_id, "setting_name": setting_name})
+        if setting:
+            return setting["setting_value"]
+        else:
+            return None
+
+    def get_guild_settings(self, setting_name):
+        settings = self.db.guild_settings.find({"setting_name": setting_name}, {"guild_id": 1, "setting_value": 1})
+        return {setting["guild_id"]: setting["setting_value"] for setting in settings}
+
+    def get_cached_track(self, track_id):
+        entry = self.db.track_cache.find_one({"_id": track_id})
+        if entry:
+            return entry["data"], entry["expires_at"]
+        else:
+            return None
+
+    def set_cached_track(self, track_id, track, expires_at):
+        self.db.track_cache.replace_one(
+            {"_id": track_id},
+            {"_id": track_id, "data": track, "expires_at": expires_at},
+            upsert=True
+        )
+
+    def delete_cached_track(self, track_id):
+        self.db.track_cache.delete_one({"_id": track_id})
+
+    def get_track_loudness(self, track_id):
+        entry = self.db.track_loudness.find_one({"_id": track_id})
+        if entry:
+            return entry["loudness"], entry["peak"]
+        else:
+            return None
+
+    def set_track_loudness(self, track_id, loudness, peak):
+        self.db.track_loudness.replace_one(
+            {"_id": track_id},
+            {"_id": track_id, "loudness": loudness, "peak": peak},
+            upsert=True
+        )
+
+    def get_player_state(self, guild_id):
+        entry = self.db.player_state.find_one({"_id": guild_id})
+        deltas = [log["delta"] for log in self.db.player_state_log.find({"guild_id": guild_id}).sort("_id", 1)]
+        return (entry["snapshot"] if entry else None), deltas
+
+    def append_player_state(self, guild_id, delta):
+        self.db.player_state_log.insert_one({"guild_id": guild_id, "delta": delta})
+
+    def save_player_state(self, guild_id, snapshot):
+        self.db.player_state.replace_one(
+            {"_id": guild_id},
+            {"_id": guild_id, "snapshot": snapshot},
+            upsert=True
+        )
+        self.db.player_state_log.delete_many({"guild_id": guild_id})
+
+    def get_cached_lyrics(self, lyrics_key):
+        entry = self.db.lyrics_cache.find_one({"_id": lyrics_key})
+        if entry:
+            return entry["lyrics"], entry["expires_at"]
+        else:
+            return None
+
+    def set_cached_lyrics(self, lyrics_key, lyrics, expires_at):
+        self.db.lyrics_cache.replace_one(
+            {"_id": lyrics_key},
+            {"_id": lyrics_key, "lyrics": lyrics, "expires_at": expires_at},
+            upsert=True
+        )
+
+    def close(self):
+        self.client.close()
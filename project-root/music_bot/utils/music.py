@@ -0,0 +1,533 @@
+import asyncio
+import itertools
+import logging
+import time
+
+import discord
+
+from music_bot.config import PLAYER_IDLE_TIMEOUT, PLAYER_SWEEP_INTERVAL, PREFETCH_DEPTH, STREAM_EXPIRY_MARGIN
+from music_bot.utils.audio import TimedSource, WorkerAudioSource, create_audio_source, stream_position
+from music_bot.utils.cache import stream_expiry
+from music_bot.utils.filters import AudioFilters
+from music_bot.utils.metrics import counter
+from music_bot.utils.track_queue import QueueEntry, TrackQueue
+
+prefetched = counter('player_prefetch_resolves_total', 'Queued songs resolved ahead of playback.')
+stale_at_play = counter('player_stale_at_play_total', 'Songs whose stream URL had to be resolved again when their turn came.')
+
+
+class MusicPlayer:
+    """
+    Playback state for a single guild: its voice connection, queue and volume.
+
+    When a resolver is given, the stream URLs of the next PREFETCH_DEPTH queued
+    songs are kept fresh in the background so the next song starts without
+    waiting on extraction. When a lyrics service is given, lyrics for the
+    current and upcoming songs are fetched ahead of time as well. When a
+    loudness service is given, songs are measured on their first play so
+    normalization can use a fixed gain afterwards. When an audio cache is
+    given, cached songs play from disk and popular ones are added to it. When a
+    playback store is given, every change to the queue, current song, volume,
+    loop mode and filters is journaled so the player can be restored later.
+    When a message scheduler is given, each song that starts is announced in
+    the channel it was last queued from. When a media worker pool is given,
+    songs that have to be transcoded are transcoded there.
+    """
+
+    __slots__ = ('guild_id', 'resolver', 'lyrics', 'loudness', 'audio_cache', 'store', 'messages', 'media',
+                 'prefetch_depth', 'voice_client', 'text_channel', 'queue', 'current', 'volume', 'loop', 'filters',
+                 'last_active', '_prefetcher', '_playback')
+
+    def __init__(self, guild_id, resolver=None, lyrics=None, loudness=None, audio_cache=None, store=None,
+                 messages=None, media=None, prefetch_depth=PREFETCH_DEPTH):
+        self.guild_id = guild_id
+        self.resolver = resolver
+        self.lyrics = lyrics
+        self.loudness = loudness
+        self.audio_cache = audio_cache
+        self.store = store
+        self.messages = messages
+        self.media = media
+        self.prefetch_depth = prefetch_depth
+        self._prefetcher = None
+        # Counts songs taken from the queue, so a late playback callback can tell it is stale
+        self._playback = 0
+        self.voice_client = None
+        self.text_channel = None
+        self.queue = TrackQueue(on_change=self._record)
+        self.current = None
+        self.volume = 1.0
+        self.loop = 'off'
+        self.filters = AudioFilters()
+        self.last_active = time.monotonic()
+
+    def touch(self):
+        """
+        Marks the player as active so it is not evicted.
+        """
+        self.last_active = time.monotonic()
+
+    @property
+    def is_active(self):
+        """
+        bool: Whether the player is currently playing or paused.
+        """
+        voice_client = self.voice_client
+        return voice_client is not None and (voice_client.is_playing() or voice_client.is_paused())
+
+    def _record(self, op, *args):
+        if self.store is not None:
+            self.store.record(self, op, *args)
+
+    def state(self):
+        """
+        Returns everything needed to restore the player later.
+
+        Returns:
+            dict: The current song and its position, queue, volume, loop mode and filters.
+        """
+        source = self.voice_client.source if self.voice_client is not None else None
+        return {
+            'current': self.current.to_dict() if self.current is not None else None,
+            'position': stream_position(source) if self.current is not None else 0,
+            'queue': [entry.to_dict() for entry in self.queue],
+            'volume': self.volume,
+            'loop': self.loop,
+            'filters': self.filters.state(),
+        }
+
+    def load_state(self, entries, volume, loop, filters):
+        """
+        Replaces the player's queue and settings with restored ones without journaling them.
+
+        Args:
+            entries (list): The QueueEntry objects to queue, the interrupted song first.
+            volume (float): The playback volume.
+            loop (str): The loop mode.
+            filters (dict): The filter settings from state(), or None for none.
+        """
+        self.queue = TrackQueue(entries, on_change=self._record)
+        self.volume = volume
+        self.loop = loop
+        if filters is not None:
+            self.filters.load(filters)
+
+    async def connect(self, channel):
+        """
+        Connects to a voice channel, or moves there if already connected elsewhere.
+
+        Args:
+            channel (discord.VoiceChannel): The channel to join.
+        """
+        if self.voice_client is None or not self.voice_client.is_connected():
+            self.voice_client = await channel.connect()
+        elif self.voice_client.channel != channel:
+            await self.voice_client.move_to(channel)
+        self.touch()
+
+    async def disconnect(self):
+        """
+        Leaves the voice channel, keeping the queue so playback can carry on later.
+
+        A song that is still playing goes back to the front of the queue and
+        resumes from the same spot.
+        """
+        voice_client, self.voice_client = self.voice_client, None
+        if self._prefetcher is not None:
+            self._prefetcher.cancel()
+        song, self.current = self.current, None
+        if song is not None:
+            song.position = stream_position(voice_client.source) if voice_client is not None else 0
+            self._record('current', None)
+            self.queue.insert(0, song)
+        if self.store is not None:
+            self.store.snapshot(self)
+        if voice_client is not None:
+            # With voice_client cleared the playback callback leaves the queue alone
+            voice_client.stop()
+            await voice_client.disconnect()
+
+    async def add_to_queue(self, ctx, url, title, artist, query=None, codec=None, track_id=None):
+        """
+        Adds a song to the end of the queue.
+
+        Args:
+            ctx (discord.ext.commands.Context): The context of the command.
+            url (str): The stream URL of the song.
+            title (str): The title of the song.
+            artist (str): The artist of the song.
+            query (str): The page URL or search used to resolve the stream URL, either because
+                it was queued unresolved (url is None) or because it expired.
+            codec (str): The audio codec of the stream, if known.
+            track_id (str): The canonical track ID, if known.
+
+        Returns:
+            QueueEntry: The queued song.
+        """
+        entry = QueueEntry(
+            url, title, artist, ctx.author.id, query=query, codec=codec,
+            expires_at=stream_expiry(url) if url else None, track_id=track_id
+        )
+        self.queue.append(entry)
+        self.text_channel = ctx.channel
+        self.touch()
+        self.schedule_prefetch()
+        return entry
+
+    def _is_stale(self, song):
+        expires_at = song.expires_at
+        return song.query is not None and (
+            song.url is None or (expires_at is not None and expires_at - STREAM_EXPIRY_MARGIN < time.time())
+        )
+
+    async def _refresh(self, song):
+        track = await self.resolver.resolve(self.guild_id, song.query)
+        song.url = track['stream_url']
+        song.codec = track.get('codec')
+        song.track_id = track['id']
+        song.expires_at = stream_expiry(track['stream_url'])
+
+    def schedule_prefetch(self):
+        """
+        Starts resolving upcoming songs in the background if that is not already running.
+        """
+        if self.lyrics is not None:
+            for song in itertools.islice(self.queue, self.prefetch_depth):
+                self.lyrics.prefetch(song.title, song.artist)
+        if self.resolver is None or not self.prefetch_depth:
+            return
+        if self._prefetcher is None or self._prefetcher.done():
+            self._prefetcher = asyncio.get_running_loop().create_task(self._prefetch())
+
+    async def _prefetch(self):
+        # Loop until the upcoming window is fresh, since songs may be queued while resolving
+        failed = set()
+        while True:
+            upcoming = [
+                song for song in itertools.islice(self.queue, self.prefetch_depth)
+                if id(song) not in failed and self._is_stale(song)
+            ]
+            if not upcoming:
+                return
+            results = await asyncio.gather(*(self._refresh(song) for song in upcoming), return_exceptions=True)
+            for song, result in zip(upcoming, results):
+                if isinstance(result, Exception):
+                    # play() retries when the song's turn comes
+                    logging.warning(f"Could not prefetch {song.title} in guild {self.guild_id}: {result}")
+                    failed.add(id(song))
+                else:
+                    prefetched.inc()
+
+    async def play(self):
+        """
+        Starts the next song in the queue unless something is already playing.
+        """
+        if self.voice_client is None or self.current is not None or self.is_active:
+            return
+
+        while self.queue:
+            song = self.current = self.queue.popleft()
+            self._playback += 1
+            playback = self._playback
+            try:
+                await self._prepare(song)
+                if self._playback != playback or self.current is not song:
+                    # Skipped or stopped while resolving
+                    return
+                source = create_audio_source(song.path or song.url, self.volume, song.codec,
+                                             position=song.position, filters=self.filters,
+                                             track_gain=song.gain, cached=song.path is not None, pool=self.media)
+                song.position = 0
+                loop = asyncio.get_running_loop()
+                self.voice_client.play(TimedSource(source), after=lambda error: self._after(loop, playback, error))
+                self._record('current', song)
+                if song.path is None and song.track_id is not None and self.audio_cache is not None:
+                    self.audio_cache.record_play(song.track_id, song.url, song.codec)
+            except Exception as e:
+                logging.error(f"Could not play {song.title} in guild {self.guild_id}: {e}")
+                self.current = None
+                continue
+            self.touch()
+            if self.messages is not None and self.text_channel is not None:
+                self.messages.now_playing(self.text_channel, f"Now playing: {song.title} by {song.artist}")
+            if self.lyrics is not None:
+                self.lyrics.prefetch(song.title, song.artist)
+            self.schedule_prefetch()
+            return
+
+    async def _prepare(self, song):
+        if song.track_id is None and self._is_stale(song):
+            # Unresolved songs have to be resolved before the cache can be checked
+            stale_at_play.inc()
+            await self._refresh(song)
+        if self.audio_cache is not None and song.track_id is not None:
+            song.path = await self.audio_cache.lookup(song.track_id)
+        # A cached copy does not need a fresh stream URL
+        if song.path is None and self._is_stale(song):
+            stale_at_play.inc()
+            await self._refresh(song)
+        await self._load_gain(song)
+
+    async def _load_gain(self, song):
+        # Known tracks get their measured gain; new ones are measured while they play
+        if self.loudness is None or song.track_id is None:
+            return
+        song.gain = await self.loudness.get_gain(song.track_id)
+        if song.gain is None:
+            self.loudness.analyze(song.track_id, song.path or song.url, cached=song.path is not None)
+
+    def _after(self, loop, playback, error):
+        # Runs on the voice thread once a song ends
+        if error:
+            logging.error(f'Playback error in guild {self.guild_id}: {error}')
+        asyncio.run_coroutine_threadsafe(self._finished(playback), loop)
+
+    async def _finished(self, playback):
+        if self.voice_client is None:
+            # Disconnected on purpose; the interrupted song stays saved as current
+            return
+        # After a skip the callback can arrive once the next song is already being prepared, which it must not end
+        song = self.current if playback == self._playback else None
+        if song is not None:
+            self.current = None
+            self._record('current', None)
+            if self.loop == 'song':
+                self.queue.insert(0, song)
+            elif self.loop == 'queue':
+                self.queue.append(song)
+        await self.play()
+
+    async def skip(self):
+        """
+        Skips the current song, even when it is looping.
+
+        The next song starts from the playback callback, or right away if the
+        skipped song was still being prepared.
+        """
+        song, self.current = self.current, None
+        if song is not None:
+            self._record('current', None)
+            if self.loop == 'queue':
+                self.queue.append(song)
+        if self.is_active:
+            self.voice_client.stop()
+        else:
+            await self.play()
+        self.touch()
+
+    async def stop(self):
+        """
+        Stops playback and clears the queue.
+        """
+        self.queue.clear()
+        if self.current is not None:
+            self.current = None
+            self._record('current', None)
+        if self._prefetcher is not None:
+            self._prefetcher.cancel()
+        if self.voice_client is not None:
+            self.voice_client.stop()
+
+    async def pause(self):
+        """
+        Pauses playback.
+        """
+        if self.voice_client is not None:
+            self.voice_client.pause()
+        self.touch()
+
+    async def resume(self):
+        """
+        Resumes paused playback.
+        """
+        if self.voice_client is not None:
+            self.voice_client.resume()
+        self.touch()
+
+    async def set_volume(self, volume):
+        """
+        Sets the playback volume for the current and following songs.
+
+        Args:
+            volume (float): The new volume (0.0-1.0).
+        """
+        self.volume = volume
+        source = self._source()
+        if isinstance(source, (discord.PCMVolumeTransformer, WorkerAudioSource)):
+            source.volume = volume
+        elif volume != 1.0:
+            self._leave_passthrough()
+        self._record('volume', volume)
+        self.touch()
+
+    async def set_loop(self, mode):
+        """
+        Sets what happens to a song when it ends.
+
+        Args:
+            mode (str): 'off' to move on, 'song' to repeat it or 'queue' to add it back to the end of the queue.
+        """
+        self.loop = mode
+        self._record('loop', mode)
+        self.touch()
+
+    async def apply_filters(self):
+        """
+        Makes changes to ``filters`` audible; PCM streams pick them up on their next frame.
+        """
+        if self.filters.active:
+            self._leave_passthrough()
+        self._record('filters', self.filters.state())
+        self.touch()
+
+    def _leave_passthrough(self):
+        # Passed-through Opus cannot be scaled or filtered, so carry on from the same spot on the PCM path
+        source = self._source()
+        if source is None or not source.is_opus() or isinstance(source, WorkerAudioSource) or self.current is None:
+            return
+        song = self.current
+        if self.voice_client.encoder is None:
+            # The voice client only creates its encoder when play() is given PCM, which passthrough never was
+            self.voice_client.encoder = discord.opus.Encoder()
+        self.voice_client.source = TimedSource(create_audio_source(
+            song.path or song.url, self.volume, position=stream_position(source), filters=self.filters,
+            track_gain=song.gain, cached=song.path is not None, pool=self.media
+        ))
+        source.cleanup()
+
+    def _source(self):
+        # The source that is playing, without the TimedSource around it
+        source = self.voice_client.source if self.voice_client is not None else None
+        return source.original if isinstance(source, TimedSource) else source
+
+
+class PlayerRegistry:
+    """
+    Holds one MusicPlayer per guild.
+
+    Players are created on first use and dropped again after sitting idle for
+    PLAYER_IDLE_TIMEOUT seconds, so memory grows with active guilds only. When
+    a playback store is given, a guild's saved state is loaded into its player
+    when the player is created, so only guilds that come back pay for it.
+    """
+
+    def __init__(self, resolver=None, lyrics=None, loudness=None, audio_cache=None, store=None, messages=None,
+                 media=None, idle_timeout=PLAYER_IDLE_TIMEOUT, sweep_interval=PLAYER_SWEEP_INTERVAL):
+        self.resolver = resolver
+        self.lyrics = lyrics
+        self.loudness = loudness
+        self.audio_cache = audio_cache
+        self.store = store
+        self.messages = messages
+        self.media = media
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self._players = {}
+        self._restoring = {}
+        self._sweeper = None
+
+    def __len__(self):
+        return len(self._players)
+
+    async def get(self, guild_id):
+        """
+        Returns the player for a guild, creating and restoring it if needed.
+
+        Args:
+            guild_id (int): The ID of the guild.
+
+        Returns:
+            MusicPlayer: The guild's player.
+        """
+        player = self._players.get(guild_id)
+        if player is not None:
+            return player
+        # Commands arriving while a guild is being restored wait for the same restore
+        task = self._restoring.get(guild_id)
+        if task is None:
+            task = self._restoring[guild_id] = asyncio.get_running_loop().create_task(self._create(guild_id))
+        return await asyncio.shield(task)
+
+    async def _create(self, guild_id):
+        player = MusicPlayer(guild_id, self.resolver, self.lyrics, self.loudness, self.audio_cache, self.store,
+                             self.messages, self.media)
+        try:
+            if self.store is not None:
+                try:
+                    await self.store.restore(player)
+                except Exception as e:
+                    logging.error(f'Could not restore playback state for guild {guild_id}: {e}')
+            self._players[guild_id] = player
+            if self._sweeper is None:
+                self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+            return player
+        finally:
+            del self._restoring[guild_id]
+
+    def peek(self, guild_id):
+        """
+        Returns the player for a guild without creating one.
+
+        Args:
+            guild_id (int): The ID of the guild.
+
+        Returns:
+            MusicPlayer: The guild's player, or None if it has none.
+        """
+        return self._players.get(guild_id)
+
+    async def remove(self, guild_id):
+        """
+        Disconnects and drops the player for a guild.
+
+        Args:
+            guild_id (int): The ID of the guild.
+        """
+        player = self._players.pop(guild_id, None)
+        if player is not None:
+            await player.disconnect()
+
+    async def evict_idle(self):
+        """
+        Disconnects and drops every player that has been idle for too long.
+
+        Returns:
+            int: The number of evicted players.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [
+            guild_id for guild_id, player in self._players.items()
+            if not player.is_active and player.last_active < cutoff
+        ]
+        for guild_id in idle:
+            try:
+                await self.remove(guild_id)
+            except Exception as e:
+                logging.error(f'Error evicting player for guild {guild_id}: {e}')
+        return len(idle)
+
+    def save_positions(self):
+        """
+        Saves how far each playing guild has got, so a crash loses at most one sweep interval.
+        """
+        if self.store is None:
+            return
+        for player in self._players.values():
+            if player.is_active and player.current is not None:
+                self.store.record(player, 'position', stream_position(player.voice_client.source))
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.save_positions()
+            await self.evict_idle()
+
+    async def close(self):
+        """
+        Stops idle eviction and disconnects every player.
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for guild_id in list(self._players):
+            await self.remove(guild_id)
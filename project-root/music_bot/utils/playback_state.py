@@ -0,0 +1,133 @@
+import logging
+
+from music_bot.config import STATE_COMPACT_EVERY
+from music_bot.utils.metrics import counter, histogram
+from music_bot.utils.track_queue import QueueEntry
+
+deltas_written = counter('playback_state_deltas_total', 'Playback state changes appended to the delta log.')
+snapshots_written = counter('playback_state_snapshots_total', 'Playback state snapshots written, compacting the log.')
+restores = counter('playback_state_restores_total', 'Guild players restored from saved playback state.')
+restored_deltas = histogram('playback_state_restored_deltas', 'Deltas replayed on top of the snapshot per restore.',
+                            buckets=(0, 1, 5, 10, 25, 50, 100, 250))
+
+
+def _encode(value):
+    if isinstance(value, QueueEntry):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    return value
+
+
+def empty_state():
+    """Returns the playback state of a guild that has never played anything.
+
+    Returns:
+        dict: The state.
+    """
+    return {'current': None, 'position': 0, 'queue': [], 'volume': 1.0, 'loop': 'off', 'filters': None}
+
+
+def apply_delta(state, delta):
+    """Applies one recorded change to a playback state.
+
+    Args:
+        state (dict): The state, updated in place.
+        delta (list): The operation name followed by its arguments.
+    """
+    op, *args = delta
+    queue = state['queue']
+    if op == 'append':
+        queue.append(args[0])
+    elif op == 'pop':
+        queue.pop(0)
+    elif op == 'remove':
+        del queue[args[0]]
+    elif op == 'insert':
+        queue.insert(args[0], args[1])
+    elif op == 'clear':
+        queue.clear()
+    elif op == 'reset':
+        state['queue'] = args[0]
+    elif op == 'current':
+        state['current'] = args[0]
+        state['position'] = 0
+    elif op in ('position', 'volume', 'loop', 'filters'):
+        state[op] = args[0]
+    else:
+        raise ValueError(f'Unknown playback state change: {op}')
+
+
+class PlaybackStore:
+    """
+    Saves each guild's queue, current song and position, volume, loop mode and
+    filters so they survive restarts and cog reloads.
+
+    Every change is appended to a per-guild delta log; once a guild has
+    STATE_COMPACT_EVERY deltas they are replaced by a single snapshot. State is
+    only read back when a guild's player is next created, so guilds that never
+    return cost nothing at startup.
+    """
+
+    def __init__(self, database, compact_every=STATE_COMPACT_EVERY):
+        self.database = database
+        self.compact_every = compact_every
+        self._deltas = {}
+
+    def record(self, player, op, *args):
+        """
+        Appends one change to a guild's delta log, compacting it when it grows too long.
+
+        Args:
+            player (MusicPlayer): The changed player.
+            op (str): The operation name.
+            *args: The operation's arguments.
+        """
+        guild_id = player.guild_id
+        count = self._deltas.get(guild_id, 0) + 1
+        if count >= self.compact_every:
+            self.snapshot(player)
+            return
+        self._deltas[guild_id] = count
+        self.database.append_player_state(guild_id, [op, *(_encode(arg) for arg in args)])
+        deltas_written.inc()
+
+    def snapshot(self, player):
+        """
+        Writes a guild's full playback state, replacing its delta log.
+
+        Args:
+            player (MusicPlayer): The player to save.
+        """
+        self.database.save_player_state(player.guild_id, player.state())
+        self._deltas[player.guild_id] = 0
+        snapshots_written.inc()
+
+    async def restore(self, player):
+        """
+        Loads a guild's saved playback state into a new player.
+
+        Args:
+            player (MusicPlayer): The freshly created player.
+        """
+        # Readers only see committed writes, and a /stop just before this may still be queued
+        await self.database.flush()
+        snapshot, deltas = await self.database.get_player_state(player.guild_id)
+        if snapshot is None and not deltas:
+            return
+        state = snapshot or empty_state()
+        for delta in deltas:
+            apply_delta(state, delta)
+
+        entries = [QueueEntry.from_dict(entry) for entry in state['queue']]
+        if state['current'] is not None:
+            # The interrupted song resumes first, from where it stopped
+            current = QueueEntry.from_dict(state['current'])
+            current.position = state['position']
+            entries.insert(0, current)
+        player.load_state(entries, state['volume'], state['loop'], state['filters'])
+        # The player's queue now differs from the saved one, so later deltas need a fresh base
+        self.snapshot(player)
+        restores.inc()
+        restored_deltas.observe(len(deltas))
+        logging.info(f'Restored {len(entries)} songs for guild {player.guild_id}')
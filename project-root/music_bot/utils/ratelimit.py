@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    A token bucket limiting how often an upstream API is called.
+
+    Callers wait in ``acquire`` until a token is available, so a burst of work
+    is spread out instead of tripping the provider's rate limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """
+        Waits until a call is allowed and consumes a token for it.
+        """
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def penalize(self, seconds):
+        """
+        Holds back every caller, e.g. after the provider answered with a Retry-After.
+
+        Args:
+            seconds (float): How long the provider asked us to wait.
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+def retry_after(error):
+    """Reads the Retry-After delay from a rate-limited API error.
+
+    Understands both spotipy's SpotifyException and requests' HTTPError.
+
+    Args:
+        error (Exception): The error raised by the API client.
+
+    Returns:
+        float: The number of seconds to wait, or None if the error is not a rate limit.
+    """
+    status = getattr(error, 'http_status', None)
+    headers = getattr(error, 'headers', None)
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = response.status_code
+        headers = response.headers
+    if status != 429:
+        return None
+    try:
+        return float((headers or {}).get('Retry-After', 1))
+    except ValueError:
+        return 1.0
@@ -0,0 +1,159 @@
+import asyncio
+import concurrent.futures
+import time
+import weakref
+
+import youtube_dl
+
+from music_bot.config import (
+    RESOLVER_EXECUTOR,
+    RESOLVER_GUILD_CONCURRENCY,
+    RESOLVER_MAX_WORKERS,
+    RESOLVER_TIMEOUT,
+)
+from music_bot.utils.cache import canonical_track_id, track_cache, track_from_info
+from music_bot.utils.errors import ResolveTimeoutError
+from music_bot.utils.metrics import counter, histogram
+
+YTDL_OPTIONS = {'format': 'bestaudio[acodec=opus]/bestaudio/best'}
+
+queue_wait = histogram('resolver_queue_wait_seconds', 'Time between a resolve request and a worker picking it up.')
+resolve_latency = histogram('resolver_latency_seconds', 'End-to-end time to resolve a track.')
+resolve_timeouts = counter('resolver_timeouts_total', 'Resolutions cancelled after exceeding the timeout.')
+
+
+def extract_info(query):
+    """Extracts track metadata with youtube_dl.
+
+    Defined at module level so it can be pickled into a process pool.
+
+    Args:
+        query (str): The search query or URL of the song.
+
+    Returns:
+        dict: The youtube_dl info dictionary.
+    """
+    with youtube_dl.YoutubeDL(YTDL_OPTIONS) as ydl:
+        return ydl.extract_info(query, download=False)
+
+
+def resolve_track(query):
+    """Extracts a track and reduces it to the compact form stored in the track cache.
+
+    Reducing inside the worker keeps process pools from pickling the full info dictionary.
+
+    Args:
+        query (str): The search query or URL of the song.
+
+    Returns:
+        dict: The compact track.
+    """
+    return track_from_info(extract_info(query))
+
+
+def _call_timed(enqueued_at, func, *args):
+    # time.monotonic is system-wide on Linux, so this also works in worker processes
+    started_at = time.monotonic()
+    return started_at - enqueued_at, func(*args)
+
+
+class TrackResolver:
+    """
+    Runs blocking metadata lookups on a bounded worker pool.
+
+    Each guild may only hold a limited number of lookups at once, so a single
+    busy guild cannot starve the pool for everyone else. The pool is either
+    created here ('thread' or 'process') or an Executor shared with other work,
+    such as a MediaWorkerPool, which is then left running on shutdown.
+    """
+
+    def __init__(self, executor=RESOLVER_EXECUTOR, max_workers=RESOLVER_MAX_WORKERS,
+                 guild_concurrency=RESOLVER_GUILD_CONCURRENCY, timeout=RESOLVER_TIMEOUT, cache=track_cache):
+        self._owns_executor = not isinstance(executor, concurrent.futures.Executor)
+        if not self._owns_executor:
+            self.executor = executor
+        elif executor == 'thread':
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='resolver')
+        elif executor == 'process':
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+        else:
+            raise ValueError("Invalid resolver executor. Choose thread, process or an Executor.")
+        self.guild_concurrency = guild_concurrency
+        self.timeout = timeout
+        self.cache = cache
+        # Semaphores are dropped as soon as no lookup for the guild is in flight
+        self._guild_limits = weakref.WeakValueDictionary()
+
+    def _guild_limit(self, guild_id):
+        limit = self._guild_limits.get(guild_id)
+        if limit is None:
+            limit = asyncio.Semaphore(self.guild_concurrency)
+            self._guild_limits[guild_id] = limit
+        return limit
+
+    async def _submit(self, guild_id, enqueued_at, func, *args):
+        loop = asyncio.get_running_loop()
+        async with self._guild_limit(guild_id):
+            # Cancelling this coroutine also cancels the job if no worker has picked it up yet
+            return await loop.run_in_executor(self.executor, _call_timed, enqueued_at, func, *args)
+
+    async def run(self, guild_id, func, *args):
+        """
+        Runs a blocking function on the worker pool.
+
+        Args:
+            guild_id (int): The ID of the guild the lookup is made for.
+            func (callable): The blocking function to run.
+            *args: Positional arguments passed to the function.
+
+        Returns:
+            The return value of the function.
+
+        Raises:
+            ResolveTimeoutError: If the lookup does not finish within the timeout.
+        """
+        enqueued_at = time.monotonic()
+        try:
+            waited, result = await asyncio.wait_for(self._submit(guild_id, enqueued_at, func, *args), self.timeout)
+        except asyncio.TimeoutError:
+            resolve_timeouts.inc()
+            raise ResolveTimeoutError(args[0] if args else func.__name__)
+        queue_wait.observe(waited)
+        resolve_latency.observe(time.monotonic() - enqueued_at)
+        return result
+
+    async def extract_info(self, guild_id, query):
+        """
+        Resolves a query to its youtube_dl info dictionary off the event loop.
+
+        Args:
+            guild_id (int): The ID of the guild the lookup is made for.
+            query (str): The search query or URL of the song.
+
+        Returns:
+            dict: The youtube_dl info dictionary.
+        """
+        return await self.run(guild_id, extract_info, query)
+
+    async def resolve(self, guild_id, query):
+        """
+        Resolves a query to a compact track, reusing cached and in-flight results.
+
+        Args:
+            guild_id (int): The ID of the guild the lookup is made for.
+            query (str): The search query or URL of the song.
+
+        Returns:
+            dict: The compact track.
+        """
+        return await self.cache.get_or_load(
+            canonical_track_id(query),
+            lambda: self.run(guild_id, resolve_track, query)
+        )
+
+    def shutdown(self):
+        """
+        Shuts down the worker pool without waiting for running lookups, unless it was passed in.
+        """
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,269 @@
+import logging
+
+from music_bot.utils.metrics import counter
+
+settings_hits = counter('settings_cache_hits_total', 'Setting lookups answered from memory.')
+settings_loads = counter('settings_cache_loads_total', 'Setting lookups that had to query the database.')
+settings_invalidations = counter('settings_invalidations_total', 'Cached settings dropped after a change elsewhere.')
+
+# Marks a setting that is known to be unset, so it is not queried again
+_UNSET = object()
+
+
+class InvalidationBus:
+    """
+    Carries cache invalidations between processes.
+
+    Publishing forwards a message to the attached transport, if any; messages
+    arriving from the transport are handed to every local subscriber. Messages
+    are plain tuples so any transport can serialize them.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._transport = None
+
+    def subscribe(self, callback):
+        """
+        Registers a callback for invalidations coming from other processes.
+
+        Args:
+            callback (callable): Called with each received message.
+        """
+        self._subscribers.append(callback)
+
+    def attach(self, transport):
+        """
+        Connects the bus to other processes.
+
+        Args:
+            transport (callable): Called with each published message to send it on.
+        """
+        self._transport = transport
+
+    def publish(self, message):
+        """
+        Tells other processes that a cached value changed.
+
+        Args:
+            message (tuple): The invalidation message.
+        """
+        if self._transport is not None:
+            self._transport(message)
+
+    def receive(self, message):
+        """
+        Delivers an invalidation from another process to local subscribers.
+
+        Args:
+            message (tuple): The invalidation message.
+        """
+        for callback in self._subscribers:
+            try:
+                callback(message)
+            except Exception as e:
+                logging.error(f'Error handling invalidation {message}: {e}')
+
+
+class SettingsCache:
+    """
+    A write-through cache of guild settings, user preferences and bot settings.
+
+    Values are loaded from the database on first use and then answered from a
+    dictionary. Changes are written to memory and the database together, and
+    other processes are told to drop their copy through the invalidation bus.
+    Without a database the cache still works, but nothing is persisted.
+    """
+
+    def __init__(self, database=None, bus=None):
+        self.database = database
+        self.bus = bus or InvalidationBus()
+        self.bus.subscribe(self.invalidate)
+        self._values = {}
+
+    def _peek(self, key, default):
+        value = self._values.get(key)
+        if value is None:
+            return None
+        settings_hits.inc()
+        return default if value is _UNSET else value
+
+    async def _get(self, key, load, default):
+        value = self._values.get(key)
+        if value is None:
+            settings_loads.inc()
+            loaded = await load() if self.database is not None else None
+            # Another task may have written the setting while this one was loading
+            value = self._values.setdefault(key, _UNSET if loaded is None else loaded)
+        else:
+            settings_hits.inc()
+        return default if value is _UNSET else value
+
+    async def _set(self, key, value, write):
+        self._values[key] = _UNSET if value is None else value
+        if self.database is not None:
+            await write()
+        # Publish only once the write is committed, so other processes reload the new value
+        self.bus.publish(key)
+
+    def peek_guild_setting(self, guild_id, setting_name, default=None):
+        """
+        Returns a guild setting from memory without touching the database.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            setting_name (str): The name of the setting.
+            default: The value returned when the setting is unset.
+
+        Returns:
+            The setting's value, the default if it is unset, or None if it is not loaded yet.
+        """
+        return self._peek(('guild', guild_id, setting_name), default)
+
+    async def get_guild_setting(self, guild_id, setting_name, default=None):
+        """
+        Retrieves a guild setting, loading it on first use.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            setting_name (str): The name of the setting.
+            default: The value returned when the setting is unset.
+
+        Returns:
+            The setting's value, or the default if it is unset.
+        """
+        return await self._get(
+            ('guild', guild_id, setting_name),
+            lambda: self.database.get_guild_setting(guild_id, setting_name),
+            default
+        )
+
+    async def set_guild_setting(self, guild_id, setting_name, setting_value):
+        """
+        Updates a guild setting in memory and in the database.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            setting_name (str): The name of the setting.
+            setting_value (str): The value of the setting.
+        """
+        await self._set(
+            ('guild', guild_id, setting_name),
+            setting_value,
+            lambda: self.database.set_guild_setting(guild_id, setting_name, setting_value)
+        )
+
+    async def warm_guild_setting(self, setting_name, guild_ids=()):
+        """
+        Loads one setting for every guild in a single query.
+
+        Args:
+            setting_name (str): The name of the setting.
+            guild_ids (iterable): Guilds to remember as unset if they have no value.
+
+        Returns:
+            dict: The setting's value keyed by guild ID.
+        """
+        values = await self.database.get_guild_settings(setting_name) if self.database is not None else {}
+        for guild_id, value in values.items():
+            self._values.setdefault(('guild', guild_id, setting_name), value)
+        for guild_id in guild_ids:
+            self._values.setdefault(('guild', guild_id, setting_name), _UNSET)
+        return values
+
+    async def get_user_preference(self, user_id, preference_name, default=None):
+        """
+        Retrieves a user's preference, loading it on first use.
+
+        Args:
+            user_id (int): The ID of the user.
+            preference_name (str): The name of the preference.
+            default: The value returned when the preference is unset.
+
+        Returns:
+            The preference's value, or the default if it is unset.
+        """
+        return await self._get(
+            ('user', user_id, preference_name),
+            lambda: self.database.get_user_preference(user_id, preference_name),
+            default
+        )
+
+    async def set_user_preference(self, user_id, preference_name, preference_value):
+        """
+        Updates a user's preference in memory and in the database.
+
+        Args:
+            user_id (int): The ID of the user.
+            preference_name (str): The name of the preference.
+            preference_value (str): The value of the preference.
+        """
+        await self._set(
+            ('user', user_id, preference_name),
+            preference_value,
+            lambda: self.database.set_user_preference(user_id, preference_name, preference_value)
+        )
+
+    async def get_bot_setting(self, setting_name, default=None):
+        """
+        Retrieves a bot-wide setting, loading it on first use.
+
+        Args:
+            setting_name (str): The name of the setting.
+            default: The value returned when the setting is unset.
+
+        Returns:
+            The setting's value, or the default if it is unset.
+        """
+        return await self._get(
+            ('bot', setting_name),
+            lambda: self.database.get_bot_setting(setting_name),
+            default
+        )
+
+    async def set_bot_setting(self, setting_name, setting_value):
+        """
+        Updates a bot-wide setting in memory and in the database.
+
+        Args:
+            setting_name (str): The name of the setting.
+            setting_value (str): The value of the setting.
+        """
+        await self._set(
+            ('bot', setting_name),
+            setting_value,
+            lambda: self.database.set_bot_setting(setting_name, setting_value)
+        )
+
+    def invalidate(self, key):
+        """
+        Drops a cached value so the next lookup reloads it.
+
+        Args:
+            key (tuple): The invalidated setting, as published on the bus.
+        """
+        if self._values.pop(tuple(key), None) is not None:
+            settings_invalidations.inc()
+
+
+def prefix_resolver(settings, default):
+    """Builds a ``command_prefix`` callable that looks up each guild's prefix.
+
+    Prefixes are answered from the settings cache, so once warmed no message
+    touches the database. Direct messages use the default prefix.
+
+    Args:
+        settings (SettingsCache): The settings cache holding the ``prefix`` guild setting.
+        default (str): The prefix for guilds that have not set one.
+
+    Returns:
+        callable: An async ``(bot, message)`` prefix function.
+    """
+    async def get_prefix(bot, message):
+        if message.guild is None:
+            return default
+        prefix = settings.peek_guild_setting(message.guild.id, 'prefix', default)
+        if prefix is None:
+            prefix = await settings.get_guild_setting(message.guild.id, 'prefix', default)
+        return prefix
+    return get_prefix
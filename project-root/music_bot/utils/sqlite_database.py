@@ -0,0 +1,359 @@
+import json
+import sqlite3
+
+from music_bot.utils.database import Database
+
+# Bumped whenever create_tables gains a data migration
+SCHEMA_VERSION = 3
+
+class SQLiteDatabase(Database):
+    """
+    Stores everything in a local SQLite file.
+    """
+
+    def __init__(self, path, autocommit=True):
+        self.path = path
+        # When autocommit is off, writes are only committed by an explicit commit() call
+        self.autocommit = autocommit
+        # Connections may be handed between threads by AsyncDatabase, one thread at a time.
+        # The statement cache keeps every query below prepared for reuse.
+        self.connection = sqlite3.connect(path, check_same_thread=False, cached_statements=256)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        # WAL lets readers run alongside the writer, and NORMAL skips the fsync on every commit
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        """
+        Creates the required tables in the SQLite database.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS playlists (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                songs TEXT
+            )
+        """)
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_playlists_user_name ON playlists (user_id, name)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS playlist_songs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                playlist_id INTEGER NOT NULL REFERENCES playlists (id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                url TEXT NOT NULL
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlist_songs_position ON playlist_songs (playlist_id, position)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlist_songs_url ON playlist_songs (playlist_id, url)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_preferences (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                preference_name TEXT NOT NULL,
+                preference_value TEXT
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bot_settings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                setting_name TEXT NOT NULL,
+                setting_value TEXT
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS guild_settings (
+                guild_id INTEGER NOT NULL,
+                setting_name TEXT NOT NULL,
+                setting_value TEXT,
+                PRIMARY KEY (guild_id, setting_name)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_guild_settings_name ON guild_settings (setting_name)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS track_cache (
+                track_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS track_loudness (
+                track_id TEXT PRIMARY KEY,
+                loudness REAL NOT NULL,
+                peak REAL NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS player_state (
+                guild_id INTEGER PRIMARY KEY,
+                snapshot TEXT NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS player_state_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id INTEGER NOT NULL,
+                delta TEXT NOT NULL
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_player_state_log_guild ON player_state_log (guild_id, id)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lyrics_cache (
+                lyrics_key TEXT PRIMARY KEY,
+                lyrics TEXT,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self.connection.commit()
+        self.migrate()
+
+    def migrate(self):
+        """
+        Applies the data migrations that have not run yet, tracked through PRAGMA user_version.
+        """
+        cursor = self.connection.cursor()
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        if version < 1:
+            # Move playlists stored in the legacy comma-joined songs column into playlist_songs
+            cursor.execute("SELECT id, songs FROM playlists WHERE songs IS NOT NULL AND songs != ''")
+            for playlist_id, songs in cursor.fetchall():
+                urls = [url for url in songs.split(',') if url]
+                cursor.executemany(
+                    "INSERT INTO playlist_songs (playlist_id, position, url) VALUES (?, ?, ?)",
+                    [(playlist_id, position, url) for position, url in enumerate(urls)]
+                )
+            cursor.execute("UPDATE playlists SET songs = NULL")
+        if version < 2:
+            # INSERT OR REPLACE only replaces with a unique key, so keep the newest duplicate and add one
+            cursor.execute(
+                "DELETE FROM user_preferences WHERE id NOT IN "
+                "(SELECT MAX(id) FROM user_preferences GROUP BY user_id, preference_name)"
+            )
+            cursor.execute("DELETE FROM bot_settings WHERE id NOT IN (SELECT MAX(id) FROM bot_settings GROUP BY setting_name)")
+            cursor.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_user_preferences_key ON user_preferences (user_id, preference_name)"
+            )
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bot_settings_name ON bot_settings (setting_name)")
+        if version < 3:
+            # Lookups only ever found the oldest of a user's playlists with the same name, so drop the rest
+            cursor.execute(
+                "DELETE FROM playlists WHERE id NOT IN (SELECT MIN(id) FROM playlists GROUP BY user_id, name)"
+            )
+            # Databases created before this version have the (user_id, name) index without the unique key
+            cursor.execute("DROP INDEX IF EXISTS idx_playlists_user_name")
+            cursor.execute("CREATE UNIQUE INDEX idx_playlists_user_name ON playlists (user_id, name)")
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.commit()
+
+    def _playlist_id(self, cursor, playlist_name, user_id):
+        cursor.execute("SELECT id FROM playlists WHERE name = ? AND user_id = ?", (playlist_name, user_id))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _commit(self):
+        if self.autocommit:
+            self.connection.commit()
+
+    def create_playlist(self, playlist_name, user_id):
+        cursor = self.connection.cursor()
+        cursor.execute("INSERT OR IGNORE INTO playlists (name, user_id) VALUES (?, ?)", (playlist_name, user_id))
+        self._commit()
+
+    def add_songs_to_playlist(self, playlist_name, song_urls, user_id):
+        cursor = self.connection.cursor()
+        playlist_id = self._playlist_id(cursor, playlist_name, user_id)
+        if playlist_id is None:
+            return
+        # MAX(position) is answered from the (playlist_id, position) index
+        cursor.execute("SELECT COALESCE(MAX(position), -1) FROM playlist_songs WHERE playlist_id = ?", (playlist_id,))
+        start = cursor.fetchone()[0] + 1
+        cursor.executemany(
+            "INSERT INTO playlist_songs (playlist_id, position, url) VALUES (?, ?, ?)",
+            [(playlist_id, start + offset, url) for offset, url in enumerate(song_urls)]
+        )
+        self._commit()
+
+    def remove_songs_from_playlist(self, playlist_name, song_urls, user_id):
+        cursor = self.connection.cursor()
+        playlist_id = self._playlist_id(cursor, playlist_name, user_id)
+        if playlist_id is None:
+            return
+        cursor.executemany(
+            "DELETE FROM playlist_songs WHERE playlist_id = ? AND url = ?",
+            [(playlist_id, url) for url in song_urls]
+        )
+        self._commit()
+
+    def delete_playlist(self, playlist_name, user_id):
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM playlists WHERE name = ? AND user_id = ?", (playlist_name, user_id))
+        self._commit()
+
+    def get_playlist(self, playlist_name, user_id):
+        cursor = self.connection.cursor()
+        playlist_id = self._playlist_id(cursor, playlist_name, user_id)
+        if playlist_id is not None:
+            cursor.execute("SELECT url FROM playlist_songs WHERE playlist_id = ? ORDER BY position", (playlist_id,))
+            return [row[0] for row in cursor.fetchall()]
+        else:
+            return None
+
+    def get_all_playlists(self, user_id):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT name FROM playlists WHERE user_id = ?", (user_id,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def set_user_preference(self, user_id, preference_name, preference_value):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO user_preferences (user_id, preference_name, preference_value) VALUES (?, ?, ?)",
+            (user_id, preference_name, preference_value)
+        )
+        self._commit()
+
+    def get_user_preference(self, user_id, preference_name):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT preference_value FROM user_preferences WHERE user_id = ? AND preference_name = ?", (user_id, preference_name))
+        preference = cursor.fetchone()
+        if preference:
+            return preference[0]
+        else:
+            return None
+
+    def set_bot_setting(self, setting_name, setting_value):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO bot_settings (setting_name, setting_value) VALUES (?, ?)",
+            (setting_name, setting_value)
+        )
+        self._commit()
+
+    def get_bot_setting(self, setting_name):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT setting_value FROM bot_settings WHERE setting_name = ?", (setting_name,))
+        setting = cursor.fetchone()
+        if setting:
+            return setting[0]
+        else:
+            return None
+
+    def set_guild_setting(self, guild_id, setting_name, setting_value):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO guild_settings (guild_id, setting_name, setting_value) VALUES (?, ?, ?)",
+            (guild_id, setting_name, setting_value)
+        )
+        self._commit()
+
+    def get_guild_setting(self, guild_id, setting_name):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "SELECT setting_value FROM guild_settings WHERE guild_id = ? AND setting_name = ?",
+            (guild_id, setting_name)
+        )
+        setting = cursor.fetchone()
+        if setting:
+            return setting[0]
+        else:
+            return None
+
+    def get_guild_settings(self, setting_name):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT guild_id, setting_value FROM guild_settings WHERE setting_name = ?", (setting_name,))
+        return dict(cursor.fetchall())
+
+    def get_cached_track(self, track_id):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT data, expires_at FROM track_cache WHERE track_id = ?", (track_id,))
+        row = cursor.fetchone()
+        if row:
+            return json.loads(row[0]), row[1]
+        else:
+            return None
+
+    def set_cached_track(self, track_id, track, expires_at):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO track_cache (track_id, data, expires_at) VALUES (?, ?, ?)",
+            (track_id, json.dumps(track), expires_at)
+        )
+        self._commit()
+
+    def delete_cached_track(self, track_id):
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM track_cache WHERE track_id = ?", (track_id,))
+        self._commit()
+
+    def get_track_loudness(self, track_id):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT loudness, peak FROM track_loudness WHERE track_id = ?", (track_id,))
+        row = cursor.fetchone()
+        if row:
+            return row[0], row[1]
+        else:
+            return None
+
+    def set_track_loudness(self, track_id, loudness, peak):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO track_loudness (track_id, loudness, peak) VALUES (?, ?, ?)",
+            (track_id, loudness, peak)
+        )
+        self._commit()
+
+    def get_player_state(self, guild_id):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT snapshot FROM player_state WHERE guild_id = ?", (guild_id,))
+        row = cursor.fetchone()
+        cursor.execute("SELECT delta FROM player_state_log WHERE guild_id = ? ORDER BY id", (guild_id,))
+        deltas = [json.loads(delta) for delta, in cursor.fetchall()]
+        return (json.loads(row[0]) if row else None), deltas
+
+    def append_player_state(self, guild_id, delta):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT INTO player_state_log (guild_id, delta) VALUES (?, ?)",
+            (guild_id, json.dumps(delta))
+        )
+        self._commit()
+
+    def save_player_state(self, guild_id, snapshot):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO player_state (guild_id, snapshot) VALUES (?, ?)",
+            (guild_id, json.dumps(snapshot))
+        )
+        cursor.execute("DELETE FROM player_state_log WHERE guild_id = ?", (guild_id,))
+        self._commit()
+
+    def get_cached_lyrics(self, lyrics_key):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT lyrics, expires_at FROM lyrics_cache WHERE lyrics_key = ?", (lyrics_key,))
+        row = cursor.fetchone()
+        if row:
+            return row[0], row[1]
+        else:
+            return None
+
+    def set_cached_lyrics(self, lyrics_key, lyrics, expires_at):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO lyrics_cache (lyrics_key, lyrics, expires_at) VALUES (?, ?, ?)",
+            (lyrics_key, lyrics, expires_at)
+        )
+        self._commit()
+
+    def commit(self):
+        self.connection.commit()
+
+    def open_reader(self):
+        return SQLiteDatabase(self.path)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,228 @@
+import itertools
+import random
+from collections import deque
+
+
+class QueueEntry:
+    """
+    A queued song.
+
+    Attributes:
+        url (str): The stream URL, or None until the song is resolved.
+        title (str): The title of the song.
+        artist (str): The artist of the song.
+        requester (int): The ID of the user who queued the song.
+        query (str): The page URL or search used to resolve the stream URL again.
+        codec (str): The audio codec of the stream, if known.
+        expires_at (float): When the stream URL stops working, if known.
+        track_id (str): The canonical track ID, if known.
+        gain (float): The measured normalizing gain in dB, if known.
+        path (str): The file in the audio cache the song plays from, if any.
+        position (float): Seconds into the song to start from, when resuming it.
+    """
+
+    __slots__ = ('url', 'title', 'artist', 'requester', 'query', 'codec', 'expires_at', 'track_id', 'gain', 'path',
+                 'position')
+
+    # Fields saved with the playback state; the rest are looked up again when the song plays
+    PERSISTED = ('url', 'title', 'artist', 'requester', 'query', 'codec', 'expires_at', 'track_id', 'position')
+
+    def __init__(self, url, title, artist, requester, query=None, codec=None, expires_at=None, track_id=None):
+        self.url = url
+        self.title = title
+        self.artist = artist
+        self.requester = requester
+        self.query = query
+        self.codec = codec
+        self.expires_at = expires_at
+        self.track_id = track_id
+        self.gain = None
+        self.path = None
+        self.position = 0
+
+    def to_dict(self):
+        """
+        Returns the song's persisted fields.
+
+        Returns:
+            dict: The fields in PERSISTED.
+        """
+        return {name: getattr(self, name) for name in self.PERSISTED}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds a song saved with to_dict.
+
+        Args:
+            data (dict): The persisted fields.
+
+        Returns:
+            QueueEntry: The song.
+        """
+        data = dict(data)
+        position = data.pop('position', 0)
+        entry = cls(**data)
+        entry.position = position
+        return entry
+
+
+class TrackQueue:
+    """
+    A guild's queue of QueueEntry objects.
+
+    Adding to the end and taking from the front are O(1). Removing or moving
+    the song at position k rotates the underlying deque so k is at an end,
+    which costs O(min(k, n - k)) pointer moves in C and no copying.
+
+    Every change is reported to ``on_change`` as an operation name and its
+    arguments, so the queue can be journaled.
+    """
+
+    __slots__ = ('_entries', 'on_change')
+
+    def __init__(self, entries=(), on_change=None):
+        self._entries = deque(entries)
+        self.on_change = on_change
+
+    def _changed(self, *delta):
+        if self.on_change is not None:
+            self.on_change(*delta)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def append(self, entry):
+        """
+        Adds a song to the end of the queue.
+
+        Args:
+            entry (QueueEntry): The song.
+        """
+        self._entries.append(entry)
+        self._changed('append', entry)
+
+    def popleft(self):
+        """
+        Takes the song at the front of the queue.
+
+        Returns:
+            QueueEntry: The song.
+        """
+        entry = self._entries.popleft()
+        self._changed('pop')
+        return entry
+
+    def clear(self):
+        """
+        Removes every song.
+        """
+        self._entries.clear()
+        self._changed('clear')
+
+    def _check(self, index):
+        if not 0 <= index < len(self._entries):
+            raise IndexError(f'Position {index + 1} is not in the queue.')
+
+    def remove(self, index):
+        """
+        Removes the song at a position.
+
+        Args:
+            index (int): The zero-based position.
+
+        Returns:
+            QueueEntry: The removed song.
+        """
+        self._check(index)
+        entries = self._entries
+        if index < len(entries) // 2:
+            entries.rotate(-index)
+            entry = entries.popleft()
+            entries.rotate(index)
+        else:
+            tail = len(entries) - index - 1
+            entries.rotate(tail)
+            entry = entries.pop()
+            entries.rotate(-tail)
+        self._changed('remove', index)
+        return entry
+
+    def insert(self, index, entry):
+        """
+        Inserts a song before a position.
+
+        Args:
+            index (int): The zero-based position; positions past the end append.
+            entry (QueueEntry): The song.
+        """
+        entries = self._entries
+        index = max(0, min(index, len(entries)))
+        if index < len(entries) // 2:
+            entries.rotate(-index)
+            entries.appendleft(entry)
+            entries.rotate(index)
+        else:
+            tail = len(entries) - index
+            entries.rotate(tail)
+            entries.append(entry)
+            entries.rotate(-tail)
+        self._changed('insert', index, entry)
+
+    def move(self, source, destination):
+        """
+        Moves a song to another position.
+
+        Args:
+            source (int): The zero-based position of the song.
+            destination (int): The zero-based position it ends up at.
+
+        Returns:
+            QueueEntry: The moved song.
+        """
+        entry = self.remove(source)
+        self.insert(destination, entry)
+        return entry
+
+    def shuffle(self):
+        """
+        Shuffles the queue.
+        """
+        # Indexing a deque is O(n) in the middle, so shuffle a list and swap it back in
+        entries = list(self._entries)
+        random.shuffle(entries)
+        self._entries.clear()
+        self._entries.extend(entries)
+        self._changed('reset', entries)
+
+    def page(self, page, page_size):
+        """
+        Returns the songs on one page of the queue.
+
+        Args:
+            page (int): The zero-based page number.
+            page_size (int): The number of songs per page.
+
+        Returns:
+            list: The songs on the page.
+        """
+        start = page * page_size
+        return list(itertools.islice(self._entries, start, start + page_size))
+
+    def pages(self, page_size):
+        """
+        Returns the number of pages the queue fills.
+
+        Args:
+            page_size (int): The number of songs per page.
+
+        Returns:
+            int: The number of pages, at least 1.
+        """
+        return max(1, -(-len(self._entries) // page_size))
@@ -0,0 +1,296 @@
+import os
+import sqlite3
+import uuid
+
+import pytest
+
+from music_bot.utils.memory_database import MemoryDatabase
+from music_bot.utils.sqlite_database import SCHEMA_VERSION, SQLiteDatabase
+
+# Mongo cases only run against a server named here, e.g. mongodb://localhost:27017/
+MONGODB_URL = os.getenv('MONGODB_URL')
+
+USER = 1
+OTHER_USER = 2
+
+
+@pytest.fixture(params=['sqlite', 'memory', 'mongo'])
+def reopen(request, tmp_path):
+    """
+    Returns a function that opens the backend under test on the same storage each time it is called.
+    """
+    opened = []
+    cleanup = None
+
+    if request.param == 'sqlite':
+        path = str(tmp_path / 'musicbot.db')
+
+        def open_backend():
+            opened.append(SQLiteDatabase(path))
+            return opened[-1]
+    elif request.param == 'memory':
+        database = MemoryDatabase()
+
+        def open_backend():
+            # Memory storage lives and dies with the instance, so reopening hands back the same one
+            return database
+    else:
+        if not MONGODB_URL:
+            pytest.skip("MONGODB_URL is not set")
+        pytest.importorskip('pymongo')
+        from music_bot.utils.mongo_database import MongoDatabase
+        database_name = f'musicbot_test_{uuid.uuid4().hex}'
+
+        def open_backend():
+            opened.append(MongoDatabase(MONGODB_URL, database_name))
+            return opened[-1]
+
+        def cleanup():
+            opened[0].client.drop_database(database_name)
+
+    yield open_backend
+    if cleanup and opened:
+        cleanup()
+    for database in reversed(opened):
+        database.close()
+
+
+@pytest.fixture
+def db(reopen):
+    return reopen()
+
+
+def test_user_preferences(db):
+    assert db.get_user_preference(USER, 'volume') is None
+
+    db.set_user_preference(USER, 'volume', '50')
+    db.set_user_preference(USER, 'volume', '80')
+    db.set_user_preference(OTHER_USER, 'volume', '20')
+
+    assert db.get_user_preference(USER, 'volume') == '80'
+    assert db.get_user_preference(OTHER_USER, 'volume') == '20'
+
+
+def test_bot_settings(db):
+    assert db.get_bot_setting('prefix') is None
+
+    db.set_bot_setting('prefix', '!')
+    db.set_bot_setting('prefix', '?')
+
+    assert db.get_bot_setting('prefix') == '?'
+
+
+def test_guild_settings(db):
+    assert db.get_guild_setting(10, 'volume') is None
+    assert db.get_guild_settings('volume') == {}
+
+    db.set_guild_setting(10, 'volume', '50')
+    db.set_guild_setting(10, 'volume', '70')
+    db.set_guild_setting(20, 'volume', '30')
+    db.set_guild_setting(20, 'loop', 'song')
+
+    assert db.get_guild_setting(10, 'volume') == '70'
+    assert db.get_guild_setting(10, 'loop') is None
+    assert db.get_guild_settings('volume') == {10: '70', 20: '30'}
+    assert db.get_guild_settings('loop') == {20: 'song'}
+
+
+def test_playlists(db):
+    assert db.get_playlist('mix', USER) is None
+    assert db.get_all_playlists(USER) == []
+
+    db.create_playlist('mix', USER)
+    db.create_playlist('chill', USER)
+    db.create_playlist('mix', OTHER_USER)
+
+    assert db.get_playlist('mix', USER) == []
+    assert sorted(db.get_all_playlists(USER)) == ['chill', 'mix']
+    assert db.get_all_playlists(OTHER_USER) == ['mix']
+
+    db.delete_playlist('mix', USER)
+
+    assert db.get_playlist('mix', USER) is None
+    assert db.get_all_playlists(USER) == ['chill']
+    assert db.get_playlist('mix', OTHER_USER) == []
+
+
+def test_creating_a_playlist_twice_keeps_one(db):
+    db.create_playlist('mix', USER)
+    db.add_songs_to_playlist('mix', ['a', 'b'], USER)
+    db.create_playlist('mix', USER)
+
+    assert db.get_all_playlists(USER) == ['mix']
+    assert db.get_playlist('mix', USER) == ['a', 'b']
+
+
+def test_playlist_songs_keep_insertion_order(db):
+    db.create_playlist('mix', USER)
+
+    db.add_song_to_playlist('mix', 'c', USER)
+    db.add_songs_to_playlist('mix', ['a', 'd', 'b'], USER)
+    db.add_song_to_playlist('mix', 'a', USER)
+
+    assert db.get_playlist('mix', USER) == ['c', 'a', 'd', 'b', 'a']
+
+    db.remove_song_from_playlist('mix', 'a', USER)
+
+    assert db.get_playlist('mix', USER) == ['c', 'd', 'b']
+
+    db.add_songs_to_playlist('mix', ['e', 'f'], USER)
+    db.remove_songs_from_playlist('mix', ['d', 'f'], USER)
+
+    assert db.get_playlist('mix', USER) == ['c', 'b', 'e']
+
+
+def test_playlist_songs_are_scoped_to_the_playlist(db):
+    db.create_playlist('mix', USER)
+    db.create_playlist('mix', OTHER_USER)
+
+    db.add_songs_to_playlist('mix', ['a', 'b'], USER)
+    db.add_songs_to_playlist('mix', ['x'], OTHER_USER)
+    db.add_songs_to_playlist('missing', ['y'], USER)
+    db.remove_songs_from_playlist('mix', ['x'], USER)
+
+    assert db.get_playlist('mix', USER) == ['a', 'b']
+    assert db.get_playlist('mix', OTHER_USER) == ['x']
+    assert db.get_playlist('missing', USER) is None
+
+
+def test_track_cache(db):
+    track = {'title': 'Song', 'url': 'https://example.com/a', 'duration': 200}
+    assert db.get_cached_track('yt:a') is None
+
+    db.set_cached_track('yt:a', track, 1000.0)
+    db.set_cached_track('yt:a', dict(track, duration=201), 2000.0)
+
+    assert db.get_cached_track('yt:a') == (dict(track, duration=201), 2000.0)
+
+    db.delete_cached_track('yt:a')
+    db.delete_cached_track('yt:missing')
+
+    assert db.get_cached_track('yt:a') is None
+
+
+def test_track_loudness(db):
+    assert db.get_track_loudness('yt:a') is None
+
+    db.set_track_loudness('yt:a', -14.5, -1.0)
+    db.set_track_loudness('yt:a', -9.25, -0.5)
+
+    assert db.get_track_loudness('yt:a') == (-9.25, -0.5)
+
+
+def test_player_state(db):
+    assert db.get_player_state(10) == (None, [])
+
+    db.append_player_state(10, ['append', {'url': 'a'}])
+    db.append_player_state(10, ['append', {'url': 'b'}])
+    db.append_player_state(20, ['clear'])
+
+    assert db.get_player_state(10) == (None, [['append', {'url': 'a'}], ['append', {'url': 'b'}]])
+
+    db.save_player_state(10, {'queue': [{'url': 'a'}, {'url': 'b'}], 'loop': False})
+    db.append_player_state(10, ['pop'])
+
+    assert db.get_player_state(10) == ({'queue': [{'url': 'a'}, {'url': 'b'}], 'loop': False}, [['pop']])
+    assert db.get_player_state(20) == (None, [['clear']])
+
+
+def test_lyrics_cache(db):
+    assert db.get_cached_lyrics('song - artist') is None
+
+    db.set_cached_lyrics('song - artist', 'la la la', 1000.0)
+    db.set_cached_lyrics('missing - artist', None, 500.0)
+
+    assert db.get_cached_lyrics('song - artist') == ('la la la', 1000.0)
+    # A cached miss is stored as None lyrics, unlike a key that was never looked up
+    assert db.get_cached_lyrics('missing - artist') == (None, 500.0)
+
+
+def test_reopening_keeps_data(reopen):
+    db = reopen()
+    db.create_playlist('mix', USER)
+    db.add_songs_to_playlist('mix', ['a', 'b'], USER)
+    db.set_user_preference(USER, 'volume', '80')
+    db.set_bot_setting('prefix', '?')
+    db.set_guild_setting(10, 'volume', '70')
+
+    # Schema setup and migrations run again on every open and must leave existing data alone
+    db = reopen()
+
+    assert db.get_playlist('mix', USER) == ['a', 'b']
+    assert db.get_user_preference(USER, 'volume') == '80'
+    assert db.get_bot_setting('prefix') == '?'
+    assert db.get_guild_settings('volume') == {10: '70'}
+
+
+def test_sqlite_migrates_legacy_data(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    legacy = sqlite3.connect(path)
+    legacy.executescript("""
+        CREATE TABLE playlists (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            songs TEXT
+        );
+        CREATE TABLE user_preferences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            preference_name TEXT NOT NULL,
+            preference_value TEXT
+        );
+        CREATE TABLE bot_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            setting_name TEXT NOT NULL,
+            setting_value TEXT
+        );
+        INSERT INTO playlists (name, user_id, songs) VALUES ('mix', 1, 'c,a,b');
+        INSERT INTO playlists (name, user_id, songs) VALUES ('empty', 1, '');
+        INSERT INTO user_preferences (user_id, preference_name, preference_value) VALUES (1, 'volume', '50');
+        INSERT INTO user_preferences (user_id, preference_name, preference_value) VALUES (1, 'volume', '80');
+        INSERT INTO bot_settings (setting_name, setting_value) VALUES ('prefix', '!');
+        INSERT INTO bot_settings (setting_name, setting_value) VALUES ('prefix', '?');
+    """)
+    legacy.close()
+
+    db = SQLiteDatabase(path)
+
+    assert db.connection.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert db.get_playlist('mix', USER) == ['c', 'a', 'b']
+    assert db.get_playlist('empty', USER) == []
+    assert db.get_user_preference(USER, 'volume') == '80'
+    assert db.get_bot_setting('prefix') == '?'
+
+    # The unique keys added by the migration let later writes replace the value in place
+    db.set_user_preference(USER, 'volume', '90')
+    db.set_bot_setting('prefix', '$')
+    db.add_song_to_playlist('mix', 'd', USER)
+
+    assert db.connection.execute("SELECT COUNT(*) FROM user_preferences").fetchone()[0] == 1
+    assert db.connection.execute("SELECT COUNT(*) FROM bot_settings").fetchone()[0] == 1
+    assert db.get_playlist('mix', USER) == ['c', 'a', 'b', 'd']
+    db.close()
+
+
+def test_sqlite_removes_duplicate_playlists(tmp_path):
+    path = str(tmp_path / 'duplicates.db')
+    db = SQLiteDatabase(path)
+    # Rebuild the state before playlist names were unique per user
+    db.connection.executescript("""
+        DROP INDEX idx_playlists_user_name;
+        CREATE INDEX idx_playlists_user_name ON playlists (user_id, name);
+        INSERT INTO playlists (name, user_id) VALUES ('mix', 1);
+        INSERT INTO playlists (name, user_id) VALUES ('mix', 1);
+        INSERT INTO playlist_songs (playlist_id, position, url) VALUES (1, 0, 'a');
+        INSERT INTO playlist_songs (playlist_id, position, url) VALUES (2, 0, 'b');
+        PRAGMA user_version = 2;
+    """)
+    db.close()
+
+    db = SQLiteDatabase(path)
+
+    assert db.get_all_playlists(USER) == ['mix']
+    assert db.get_playlist('mix', USER) == ['a']
+    assert db.connection.execute("SELECT COUNT(*) FROM playlist_songs").fetchone()[0] == 1
+    db.close()
@@ -0,0 +1,120 @@
+import pytest
+
+from music_bot.utils.playback_state import apply_delta, empty_state
+from music_bot.utils.track_queue import TrackQueue
+
+
+def make_queue(size):
+    return TrackQueue(range(size))
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 6])
+def test_remove_at_every_position(size):
+    for index in range(size):
+        queue = make_queue(size)
+        expected = list(range(size))
+
+        assert queue.remove(index) == expected.pop(index)
+        assert list(queue) == expected
+
+
+@pytest.mark.parametrize('size', [0, 1, 5, 6])
+def test_insert_at_every_position(size):
+    for index in range(size + 1):
+        queue = make_queue(size)
+        expected = list(range(size))
+
+        queue.insert(index, 'new')
+        expected.insert(index, 'new')
+
+        assert list(queue) == expected
+
+
+def test_insert_outside_the_queue_clamps_to_the_ends():
+    queue = make_queue(3)
+
+    queue.insert(-5, 'first')
+    queue.insert(50, 'last')
+
+    assert list(queue) == ['first', 0, 1, 2, 'last']
+
+
+@pytest.mark.parametrize('source, destination, expected', [
+    (0, 4, [1, 2, 3, 4, 0]),
+    (4, 0, [4, 0, 1, 2, 3]),
+    (2, 2, [0, 1, 2, 3, 4]),
+    (1, 3, [0, 2, 3, 1, 4]),
+    (3, 1, [0, 3, 1, 2, 4]),
+    (0, 2, [1, 2, 0, 3, 4]),
+    (4, 2, [0, 1, 4, 2, 3]),
+])
+def test_move(source, destination, expected):
+    queue = make_queue(5)
+
+    assert queue.move(source, destination) == source
+    assert list(queue) == expected
+
+
+@pytest.mark.parametrize('index', [-1, 3, 10])
+def test_remove_out_of_range(index):
+    queue = make_queue(3)
+
+    with pytest.raises(IndexError):
+        queue.remove(index)
+    assert list(queue) == [0, 1, 2]
+
+
+def test_move_out_of_range_leaves_the_queue_alone():
+    queue = make_queue(3)
+
+    with pytest.raises(IndexError):
+        queue.move(3, 0)
+    assert list(queue) == [0, 1, 2]
+
+
+def test_remove_from_an_empty_queue():
+    with pytest.raises(IndexError):
+        TrackQueue().remove(0)
+
+
+def test_append_and_popleft():
+    queue = TrackQueue()
+    queue.append('a')
+    queue.append('b')
+
+    assert queue.popleft() == 'a'
+    assert list(queue) == ['b']
+    assert len(queue) == 1
+
+
+@pytest.mark.parametrize('page, expected', [
+    (0, [0, 1, 2, 3]),
+    (1, [4, 5, 6, 7]),
+    (2, [8, 9]),
+    (3, []),
+])
+def test_page(page, expected):
+    queue = make_queue(10)
+
+    assert queue.page(page, 4) == expected
+    assert queue.pages(4) == 3
+
+
+def test_pages_of_an_empty_queue():
+    assert TrackQueue().pages(10) == 1
+
+
+def test_changes_replay_to_the_same_queue():
+    state = empty_state()
+    queue = TrackQueue(on_change=lambda *delta: apply_delta(state, list(delta)))
+
+    for entry in range(6):
+        queue.append(entry)
+    queue.remove(4)
+    queue.insert(1, 'new')
+    queue.move(0, 5)
+    queue.popleft()
+    queue.shuffle()
+    queue.remove(0)
+
+    assert state['queue'] == list(queue)